@@ -0,0 +1,169 @@
+# coding: utf-8
+
+from __future__ import division
+import numpy as np
+
+from joint_dependency.utils import num_bins, to_bins
+
+
+class ExperienceBuffer(object):
+    """
+    The experiences of a joint in compact arrays, replacing a list of
+    `{'data': joint positions, 'value': bool}` dictionaries.
+
+    The joint positions are stored as the bins they fall into (an int16
+    matrix, experiences x joints) and the observed values as a uint8 vector,
+    i.e. 2 bytes per joint and 1 byte per experience instead of a dictionary
+    and an array object per experience. Like `quantize` the positions are
+    rounded down to the start of their bin.
+
+    The buffer behaves like an append-only list of experiences: `append` and
+    `extend` take dictionaries (or another buffer), indexing and iterating
+    give dictionaries. Appending is amortized O(1), the arrays grow
+    geometrically. Slicing gives a snapshot view sharing the memory of the
+    buffer. A view copies its experiences on its first append, so
+    hypothetical experiences can be added to a snapshot without changing the
+    buffer it was taken from.
+    """
+    def __init__(self, num_joints, resolution=1., experiences=None,
+                 capacity=16):
+        """
+        :param num_joints: The number of joints of the experiences
+        :param resolution: The size of one position bin in degrees
+        :param experiences: Experiences to start with (list of dictionaries
+                            or `ExperienceBuffer`)
+        :param capacity: The number of experiences to allocate memory for
+        """
+        if num_bins(resolution) > np.iinfo(np.int16).max:
+            raise ValueError("A resolution of {} degrees has too many bins "
+                             "for an ExperienceBuffer".format(resolution))
+        self.num_joints = num_joints
+        self.resolution = resolution
+        self._bins = np.zeros((capacity, num_joints), dtype=np.int16)
+        self._values = np.zeros((capacity,), dtype=np.uint8)
+        self._length = 0
+        self._view = False
+
+        if experiences is not None:
+            self.extend(experiences)
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def bins(self):
+        """
+        The bins of the joint positions (experiences x joints).
+        """
+        return self._bins[:self._length]
+
+    @property
+    def values(self):
+        """
+        The observed values of the experiences.
+        """
+        return self._values[:self._length]
+
+    @property
+    def positions(self):
+        """
+        The joint positions in degrees (experiences x joints).
+        """
+        return self.bins * self.resolution
+
+    @property
+    def nbytes(self):
+        """
+        The memory used by the stored experiences.
+        """
+        return self.bins.nbytes + self.values.nbytes
+
+    def _reserve(self, size):
+        if size <= self._bins.shape[0] and not self._view:
+            return
+        capacity = max(size, 2 * self._bins.shape[0])
+        bins = np.zeros((capacity, self.num_joints), dtype=np.int16)
+        values = np.zeros((capacity,), dtype=np.uint8)
+        bins[:self._length] = self.bins
+        values[:self._length] = self.values
+        self._bins, self._values = bins, values
+        self._view = False
+
+    def add(self, joint_pos, value):
+        """
+        :param joint_pos: The positions of all joints in degrees
+        :param value: The observed value
+        """
+        self._reserve(self._length + 1)
+        self._bins[self._length] = to_bins(joint_pos, self.resolution)
+        self._values[self._length] = value
+        self._length += 1
+
+    def append(self, experience):
+        """
+        :param experience: The new experience (dictionary)
+        """
+        self.add(experience['data'], experience['value'])
+
+    def extend(self, experiences):
+        """
+        :param experiences: The new experiences (list of dictionaries or
+                            `ExperienceBuffer`)
+        """
+        if len(experiences) == 0:
+            return
+        bins, values = experience_arrays(experiences, self.resolution)
+        n = self._length
+        self._reserve(n + values.shape[0])
+        self._bins[n:n + values.shape[0]] = bins
+        self._values[n:n + values.shape[0]] = values
+        self._length += values.shape[0]
+
+    def snapshot(self):
+        """
+        :return: A view of the experiences made so far
+        """
+        return self[:]
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(self._length)
+            if step != 1:
+                return ExperienceBuffer(
+                    self.num_joints, self.resolution,
+                    [self[i] for i in range(start, stop, step)])
+            view = ExperienceBuffer.__new__(ExperienceBuffer)
+            view.num_joints = self.num_joints
+            view.resolution = self.resolution
+            view._bins = self._bins[start:max(start, stop)]
+            view._values = self._values[start:max(start, stop)]
+            view._length = view._values.shape[0]
+            view._view = True
+            return view
+        idx = range(self._length)[idx]
+        return {'data': self._bins[idx] * self.resolution,
+                'value': bool(self._values[idx])}
+
+    def __iter__(self):
+        for idx in range(self._length):
+            yield self[idx]
+
+
+def experience_arrays(experiences, resolution=1.):
+    """
+    Stack experiences into arrays.
+
+    :param experiences: The experiences (list of dictionaries or
+                        `ExperienceBuffer`)
+    :param resolution: The size of one bin in degrees
+    :return: A tuple of the bins of the joint positions (N x joints int array)
+             and the observed values (N int array)
+    """
+    if isinstance(experiences, ExperienceBuffer):
+        bins = experiences.bins.astype(int)
+        if resolution != experiences.resolution:
+            bins = to_bins(bins * experiences.resolution, resolution)
+        return bins, experiences.values.astype(int)
+    positions = to_bins([e['data'] for e in experiences], resolution)
+    values = np.array([e['value'] for e in experiences], dtype=int)
+    return positions, values
@@ -0,0 +1,412 @@
+# coding: utf-8
+"""
+Distribute the runs of a campaign to workers on other machines.
+
+A `Coordinator` serves the specifications of the runs (see
+`experiments.run_specs`) over TCP with a `multiprocessing` manager. Workers
+(`run_worker`, or scripts/joint_dep_worker.py) pull one run after the other,
+run it in a temporary directory and push the summary and the files the run
+wrote back to the coordinator, which stores the files in its output
+directory.
+
+A worker leases its run and renews the lease with heartbeats while the run is
+going on. A run whose lease expires, e.g. because the worker or its machine
+died, is given to the next worker asking for one, up to `max_attempts` times.
+
+Only the standard library is needed. The connections are authenticated with
+the authkey, but the messages are pickled, so anybody who knows the key can
+run code on the coordinator and the workers. There is no default key: it is
+taken from the environment variable JOINT_DEPENDENCY_AUTHKEY or the command
+line, otherwise the coordinator generates a random one and prints it. The
+coordinator only listens on localhost unless a host is given, only serve to
+trusted networks.
+"""
+from __future__ import division
+from collections import deque
+from multiprocessing.managers import BaseManager
+import os
+import secrets
+import socket
+import threading
+import time
+import traceback
+
+AUTHKEY_VARIABLE = 'JOINT_DEPENDENCY_AUTHKEY'
+
+# what `JobBoard.take` returns when all runs are finished
+DONE = 'done'
+
+
+def parse_address(address):
+    """
+    :param address: The address as 'HOST:PORT' (an empty host means
+                    localhost, 0.0.0.0 all interfaces)
+    :return: The address as (host, port) tuple
+    """
+    host, _, port = address.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def default_authkey():
+    """
+    :return: The authkey in the environment variable JOINT_DEPENDENCY_AUTHKEY,
+             None if it isn't set
+    """
+    return os.environ.get(AUTHKEY_VARIABLE) or None
+
+
+class JobBoard(object):
+    """
+    The runs of a coordinator and their state: pending, leased by a worker,
+    finished or failed. The methods are called by the workers through the
+    manager, every connection in its own thread.
+    """
+    def __init__(self, specs, output_dir='.', lease=60., max_attempts=3):
+        """
+        :param specs: The specifications of the runs (see
+                      `experiments.run_specs`)
+        :param output_dir: The directory the result files are stored in
+        :param lease: The seconds without a heartbeat after which a worker is
+                      considered lost
+        :param max_attempts: How often a run is tried
+        """
+        self.specs = list(specs)
+        self.output_dir = output_dir
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self._pending = deque(range(len(self.specs)))
+        self._leases = {}
+        self._attempts = [0] * len(self.specs)
+        self._results = {}
+        self._errors = {}
+        self._failed = set()
+        self._lock = threading.Lock()
+
+    def lease_time(self):
+        return self.lease
+
+    def _expire(self):
+        now = time.time()
+        for job, (worker, deadline) in list(self._leases.items()):
+            if deadline < now:
+                del self._leases[job]
+                self._retry(job, "The worker {} was lost".format(worker))
+
+    def _retry(self, job, error):
+        self._errors[job] = error
+        if self._attempts[job] < self.max_attempts:
+            self._pending.append(job)
+        else:
+            self._failed.add(job)
+
+    def take(self, worker):
+        """
+        :param worker: The name of the worker
+        :return: A tuple of the number and the specification of the next run,
+                 None if all remaining runs are leased by other workers, or
+                 `DONE` if all runs are finished
+        """
+        with self._lock:
+            self._expire()
+            if self._pending:
+                job = self._pending.popleft()
+                self._attempts[job] += 1
+                self._leases[job] = worker, time.time() + self.lease
+                return job, self.specs[job]
+            if not self._leases:
+                return DONE
+            return None
+
+    def heartbeat(self, job, worker):
+        """
+        :return: If the worker still holds the lease of the run
+        """
+        with self._lock:
+            if self._leases.get(job, (None,))[0] != worker:
+                return False
+            self._leases[job] = worker, time.time() + self.lease
+            return True
+
+    def complete(self, job, worker, result, files):
+        """
+        :param job: The number of the run
+        :param worker: The name of the worker
+        :param result: The summary of the run (dictionary)
+        :param files: The files the run wrote (dictionary of the file names
+                      and their content)
+        :return: If the result was accepted, i.e. the run was neither
+                 finished by nor leased to another worker. A late result of a
+                 worker whose lease expired is accepted as long as no other
+                 worker took the run since.
+        """
+        with self._lock:
+            self._expire()
+            holder = self._leases.get(job, (worker,))[0]
+            if job in self._results or holder != worker:
+                return False
+            paths = []
+            for name, content in files.items():
+                path = os.path.join(self.output_dir, os.path.basename(name))
+                with open(path, 'wb') as _file:
+                    _file.write(content)
+                paths.append(path)
+            result = dict(result)
+            result.update(Worker=worker, Attempts=self._attempts[job],
+                          Files=sorted(paths))
+            self._results[job] = result
+            self._leases.pop(job, None)
+            self._failed.discard(job)
+            if job in self._pending:
+                self._pending.remove(job)
+            return True
+
+    def fail(self, job, worker, error):
+        """
+        :param job: The number of the run
+        :param worker: The name of the worker
+        :param error: The description of the error
+        """
+        with self._lock:
+            if self._leases.get(job, (None,))[0] == worker:
+                del self._leases[job]
+                self._retry(job, error)
+
+    def status(self):
+        """
+        :return: The number of pending, leased, finished and failed runs
+                 (dictionary)
+        """
+        with self._lock:
+            self._expire()
+            return {'pending': len(self._pending),
+                    'running': len(self._leases),
+                    'finished': len(self._results),
+                    'failed': len(self._failed)}
+
+    def finished(self):
+        """
+        :return: If no run is pending or leased anymore
+        """
+        status = self.status()
+        return status['pending'] == 0 and status['running'] == 0
+
+    def results(self):
+        """
+        :return: The summary of every run, the failed runs with their
+                 specification and the last error
+        """
+        with self._lock:
+            rows = []
+            for job, spec in enumerate(self.specs):
+                if job in self._results:
+                    rows.append(self._results[job])
+                elif job in self._failed:
+                    rows.append({'Run': spec['run'], 'Seed': spec['seed'],
+                                 'Attempts': self._attempts[job],
+                                 'Error': self._errors[job]})
+            return rows
+
+
+class _WorkerManager(BaseManager):
+    pass
+
+
+_WorkerManager.register('board')
+
+
+class Coordinator(object):
+    """
+    Serve a `JobBoard` to workers over TCP.
+    """
+    def __init__(self, specs, output_dir='.', address=('127.0.0.1', 0),
+                 authkey=None, lease=60., max_attempts=3):
+        """
+        :param specs: The specifications of the runs (see
+                      `experiments.run_specs`)
+        :param output_dir: The directory the result files are stored in
+        :param address: The (host, port) to serve at, port 0 picks a free
+                        port
+        :param authkey: The key the workers authenticate with (default: the
+                        environment variable JOINT_DEPENDENCY_AUTHKEY, or a
+                        random key in `authkey` if it isn't set)
+        :param lease: The seconds without a heartbeat after which a worker is
+                      considered lost
+        :param max_attempts: How often a run is tried
+        """
+        if authkey is None:
+            authkey = default_authkey()
+        self.generated_authkey = authkey is None
+        if self.generated_authkey:
+            authkey = secrets.token_hex(16)
+        self.authkey = authkey
+        self.board = JobBoard(specs, output_dir, lease, max_attempts)
+        # the registry is per class, every coordinator needs its own
+        manager_cls = type('CoordinatorManager', (BaseManager,), {})
+        manager_cls.register('board', callable=lambda: self.board)
+        manager = manager_cls(address=address, authkey=_as_bytes(authkey))
+        self._server = manager.get_server()
+        self.address = self._server.address
+        self._thread = None
+
+    def _serve(self):
+        try:
+            self._server.serve_forever()
+        except SystemExit:
+            # serve_forever exits when it is stopped
+            pass
+
+    def start(self):
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def wait(self, poll=.5, timeout=None):
+        """
+        Wait until all runs are finished or failed.
+
+        :param poll: The seconds between two checks
+        :param timeout: The seconds to wait at most
+        :return: The summaries of the runs (pandas DataFrame, one row per run)
+        """
+        import pandas as pd
+
+        start = time.time()
+        while not self.board.finished():
+            if timeout is not None and time.time() - start > timeout:
+                raise RuntimeError("The runs didn't finish within {} "
+                                   "s".format(timeout))
+            time.sleep(poll)
+        return pd.DataFrame(self.board.results()).set_index('Run')
+
+    def stop(self):
+        while self._thread is not None and self._thread.is_alive():
+            # serve_forever creates its stop event when it starts
+            stop_event = getattr(self._server, 'stop_event', None)
+            if stop_event is not None:
+                stop_event.set()
+            self._thread.join(.1)
+        self._thread = None
+        self._server.listener.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def _as_bytes(authkey):
+    if isinstance(authkey, bytes):
+        return authkey
+    return authkey.encode('utf-8')
+
+
+def _connect(address, authkey):
+    manager = _WorkerManager(address=address, authkey=_as_bytes(authkey))
+    manager.connect()
+    return manager.board()
+
+
+def _heartbeats(address, authkey, job, worker, interval, stop):
+    # with its own connection, the proxies are not thread-safe
+    board = _connect(address, authkey)
+    while not stop.wait(interval):
+        if not board.heartbeat(job, worker):
+            return
+
+
+def run_worker(address, authkey=None, run_fnc=None, name=None, poll=1.):
+    """
+    Run the runs of a coordinator until all are finished.
+
+    :param address: The (host, port) of the coordinator
+    :param authkey: The key to authenticate with (default: the environment
+                    variable JOINT_DEPENDENCY_AUTHKEY)
+    :param run_fnc: The function running one experiment, called with the
+                    arguments, the number of the run and its seed (default:
+                    `experiments.run_experiment`)
+    :param name: The name of the worker (default: host name and pid)
+    :param poll: The seconds to wait before asking again while all runs are
+                 leased by other workers
+    :return: The number of runs this worker finished
+    :raises ValueError: If no authkey is given
+    """
+    from joint_dependency.experiments import run_experiment, run_in_directory
+    if authkey is None:
+        authkey = default_authkey()
+    if authkey is None:
+        raise ValueError("The worker needs the authkey of the coordinator, "
+                         "set {} or pass it".format(AUTHKEY_VARIABLE))
+    if run_fnc is None:
+        run_fnc = run_experiment
+    if name is None:
+        name = "{}-{}".format(socket.gethostname(), os.getpid())
+    board = _connect(address, authkey)
+    interval = board.lease_time() / 3
+    finished = 0
+    while True:
+        job = board.take(name)
+        if job == DONE:
+            return finished
+        if job is None:
+            time.sleep(poll)
+            continue
+        job, spec = job
+
+        stop = threading.Event()
+        heartbeats = threading.Thread(target=_heartbeats,
+                                      args=(address, authkey, job, name,
+                                            interval, stop))
+        heartbeats.daemon = True
+        heartbeats.start()
+        try:
+            result, files = run_in_directory(spec, run_fnc)
+        except Exception:
+            board.fail(job, name, traceback.format_exc())
+            continue
+        finally:
+            stop.set()
+            heartbeats.join()
+        if board.complete(job, name, result, files):
+            finished += 1
+
+
+def serve_experiments(args):
+    """
+    Serve the runs of a campaign to workers and collect their results in the
+    current directory.
+
+    :param args: The parsed command line arguments, with the address in
+                 `args.serve`
+    :return: The summaries of the runs (pandas DataFrame, one row per run)
+    """
+    from joint_dependency.experiments import run_specs
+    with Coordinator(run_specs(args), '.', parse_address(args.serve),
+                     args.authkey, args.lease, args.max_attempts) as coord:
+        print("Serving {} runs at {}:{}".format(args.runs, *coord.address))
+        if coord.generated_authkey:
+            print("The workers authenticate with --authkey {}".format(
+                coord.authkey))
+        return coord.wait()
+
+
+def worker_main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Run the experiments served by "
+                    "joint_dep_exp.py --serve HOST:PORT")
+    parser.add_argument("address", type=str, metavar="HOST:PORT",
+                        help="The address of the coordinator")
+    parser.add_argument("--authkey", type=str, default=default_authkey(),
+                        help="The key to authenticate with, defaults to the "
+                             "environment variable JOINT_DEPENDENCY_AUTHKEY.")
+    parser.add_argument("--name", type=str, default=None,
+                        help="The name of the worker in the summaries")
+    args = parser.parse_args()
+    if args.authkey is None:
+        parser.error("the authkey of the coordinator is needed, set "
+                     "{} or pass --authkey".format(AUTHKEY_VARIABLE))
+    finished = run_worker(parse_address(args.address), args.authkey,
+                          name=args.name)
+    print("Finished {} runs".format(finished))
@@ -4,44 +4,108 @@ from joint_dependency.simulation import (create_world,  create_lockbox,
                                          Controller,
                                          ActionMachine)
 from joint_dependency.recorder import Record
-from joint_dependency.inference import (model_posterior, same_segment,
-                                        exp_cross_entropy, random_objective,
-                                        exp_neg_entropy, heuristic_proximity)
-try:
-    from joint_dependency.ros_adapter import (RosActionMachine,
-                                              create_ros_lockbox)
-except ImportError:
-    print("Disable ROS.")
-
-from joint_dependency.utils import rand_max
-
-try:
-    import bayesian_changepoint_detection.offline_changepoint_detection as bcd
-except:
-    bcd = None
-    print("Disable Changepoint Detection")
+from joint_dependency.inference import (use_backend, active_backend,
+                                        BACKENDS, model_posterior,
+                                        model_posterior_grid,
+                                        exp_cross_entropy,
+                                        random_objective, exp_neg_entropy,
+                                        heuristic_proximity,
+                                        exp_cross_entropy_all_joints,
+                                        exp_neg_entropy_all_joints)
+from joint_dependency.buffer import ExperienceBuffer
+from joint_dependency.posterior import PosteriorCache
+from joint_dependency.scoring import ScoringPool
+from joint_dependency.psame import PSame, as_p_same, SINGLE_PRECISION_ATOL
+from joint_dependency.utils import rand_max, num_bins, quantize
 
 from functools import partial
 import datetime
-try:
-    import dill as cPickle
-except ImportError:
-    import pickle as cPickle
 import multiprocessing
-import multiprocessing.dummy
 import argparse
+import os
+import random
+import shutil
+import tempfile
 
 import numpy as np
-import pandas as pd
-from scipy.stats import entropy
-
-from progressbar import ProgressBar, Bar, Percentage
-from blessings import Terminal
+from scipy.special import entr
 
 from copy import deepcopy
 import time
 
-term = Terminal()
+# pandas, dill, progressbar, blessings and the optional ROS and change point
+# detection packages are imported when a feature needs them, so the command
+# line interface and the pool workers start fast
+_terminal = None
+
+# the floating point types selectable with --precision
+precisions = {'double': np.float64, 'single': np.float32}
+
+# objectives which can score a whole matrix of candidates for every checked
+# joint at once
+all_joint_objectives = {exp_cross_entropy: exp_cross_entropy_all_joints,
+                        exp_neg_entropy: exp_neg_entropy_all_joints}
+
+# the all-joint objectives score every sample for every checked joint, the
+# other objectives check one random joint per sample and need more samples
+DEFAULT_SAMPLES = 4000
+DEFAULT_ALL_JOINT_SAMPLES = 1000
+
+
+def default_samples(objective_fnc):
+    """
+    :param objective_fnc: The objective
+    :return: The default number of samples drawn for one query
+    """
+    if objective_fnc in all_joint_objectives:
+        return DEFAULT_ALL_JOINT_SAMPLES
+    return DEFAULT_SAMPLES
+
+
+def terminal():
+    """
+    :return: The `blessings.Terminal` controlling the screen
+    """
+    global _terminal
+    if _terminal is None:
+        from blessings import Terminal
+        _terminal = Terminal()
+    return _terminal
+
+
+def changepoint_detection():
+    """
+    :return: The offline change point detection module of
+             bayesian_changepoint_detection
+    :raises ImportError: If the package is not installed
+    """
+    import bayesian_changepoint_detection.offline_changepoint_detection as bcd
+    return bcd
+
+
+def dump(data, filename):
+    """
+    Pickle data to a file, with dill if it is installed.
+
+    :param data: The object to store
+    :param filename: The name of the file
+    """
+    try:
+        import dill as cPickle
+    except ImportError:
+        import pickle as cPickle
+    with open(filename, "wb") as _file:
+        cPickle.dump(data, _file)
+
+
+class NullProgressBar(object):
+    """A progress bar which shows nothing, for headless runs."""
+    def update(self, value):
+        pass
+
+    def finish(self):
+        pass
+
 
 class Writer(object):
     """Create an object with a write method that writes to a
@@ -57,59 +121,228 @@ class Writer(object):
         self.location = location
 
     def write(self, string):
-        with term.location(*self.location):
+        with terminal().location(*self.location):
             print(string)
 
 
-def generate_filename(metadata):
-    return "data_" + str(metadata["Date"]).replace(" ", "-")\
-        .replace("/", "-").replace(":", "-") + "_" + metadata['Objective'] + (".pkl")
+def generate_filename(metadata, prefix="data"):
+    # concurrent runs are told apart by their number
+    run = "_run{}".format(metadata['Run']) if 'Run' in metadata else ""
+    return prefix + "_" + str(metadata["Date"]).replace(" ", "-")\
+        .replace("/", "-").replace(":", "-") + "_" + metadata['Objective'] + run + (".pkl")
 
 
-def init(world):
+def seed_for_run(base_seed, run):
+    """
+    Derive the seed of one run of a campaign. The seeds of different runs
+    give independent random streams and are reproducible from the base seed.
+
+    :param base_seed: The seed of the campaign (int)
+    :param run: The number of the run
+    :return: The seed of the run (int)
+    """
+    return int(np.random.SeedSequence([base_seed, run]).generate_state(1)[0])
+
+
+def init(world, resolution=1.):
     P_cp = []
     experiences = []
     for i, joint in enumerate(world.joints):
-        P_cp.append(np.array([.1] * 360))
-        experiences.append([])
+        P_cp.append(resample_p_cp(np.array([.1] * 360), resolution))
+        experiences.append(ExperienceBuffer(len(world.joints), resolution))
     return P_cp, experiences
 
 
-def compute_p_same(p_cp):
-    p_same = []
-    for pcp in p_cp:
-        p_same.append(same_segment(pcp))
-    return p_same
+def resample_p_cp(p_cp, resolution=1.):
+    """
+    Resample change point probabilities to bins of `resolution` degrees.
+
+    The probability of no change point within any range of degrees is kept,
+    i.e. coarse bins combine the probabilities of the bins they cover and fine
+    bins split them evenly.
+
+    :param p_cp: The change point probabilities over a full turn (one entry
+                 per bin)
+    :param resolution: The size of the new bins in degrees
+    :return: The change point probabilities of the new bins
+    """
+    p_cp = np.asarray(p_cp, dtype=float)
+    n = num_bins(resolution)
+    if p_cp.shape[0] == n:
+        return p_cp
+    log_q = np.log(np.maximum(1 - p_cp, np.finfo(float).tiny))
+    log_survival = np.zeros((p_cp.shape[0] + 1,))
+    log_survival[1:] = np.cumsum(log_q)
+    edges = np.linspace(0, 360, p_cp.shape[0] + 1)
+    log_survival = np.interp(np.linspace(0, 360, n + 1), edges, log_survival)
+    return 1 - np.exp(np.diff(log_survival))
+
+
+def compute_p_same(p_cp, resolution=1., dtype=np.float64):
+    return PSame([resample_p_cp(pcp, resolution) for pcp in p_cp], dtype)
+
+
+def _score_actions(objective_fnc, actions, experiences, p_same, alpha_prior,
+                   model_prior, world, idx_last_successes, idx_last_failures,
+                   use_joint_positions, posterior_cache, exhaustive,
+                   scoring_pool):
+    """
+    :return: The scored actions as list of (joint positions, checked joint,
+             moved joint, value) tuples
+    """
+    if objective_fnc in all_joint_objectives:
+        # score every candidate for every checked joint in one pass
+        joint_positions = np.array([action[1] for action in actions])
+        joint_posteriors = posterior_cache.joint_posteriors(experiences)
+        if scoring_pool is not None:
+            values = scoring_pool.score(all_joint_objectives[objective_fnc],
+                                        joint_posteriors, joint_positions,
+                                        alpha_prior).ravel()
+        else:
+            values = all_joint_objectives[objective_fnc](
+                joint_posteriors, joint_positions, alpha_prior).ravel()
+        check_joints = np.repeat(np.arange(len(world.joints)), len(actions))
+        actions = actions * len(world.joints)
+    else:
+        if exhaustive:
+            # every action is scored for every joint that could be checked
+            check_joints = np.repeat(np.arange(len(world.joints)),
+                                     len(actions))
+            actions = actions * len(world.joints)
+        else:
+            check_joints = np.random.randint(0, len(world.joints),
+                                             size=len(actions))
+
+        values = []
+        for action, check_joint in zip(actions, check_joints):
+            joint_posterior = posterior_cache.joint_posterior(
+                check_joint, experiences[check_joint])
+            values.append(objective_fnc(experiences[check_joint],
+                                        action[1],
+                                        p_same,
+                                        alpha_prior,
+                                        model_prior[check_joint],
+                                        joint_posterior.posterior,
+                                        idx_last_successes,
+                                        action[0],
+                                        idx_last_failures,
+                                        world,
+                                        use_joint_positions))
+
+    return [(action[1], check_joint, action[0], value)
+            for action, check_joint, value
+            in zip(actions, check_joints, values)]
+
+
+def _best_action(action_values, exhaustive):
+    if exhaustive:
+        # the first of equally good actions, so the choice is deterministic
+        return action_values[int(np.argmax([action_value[3] for action_value
+                                            in action_values]))]
+    return rand_max(action_values, lambda x: x[3])
 
 
 def get_best_point(objective_fnc, experiences, p_same, alpha_prior,
                    model_prior, N_samples, world, locked_states,
                    action_sampling_fnc,
                    idx_last_successes=[], idx_last_failures=[],
-                   use_joint_positions=False):
-    actions = action_sampling_fnc(N_samples, world, locked_states)
-
-    action_values = []
-    for action in actions:
-        check_joint = np.random.randint(0, len(world.joints))
-        value = objective_fnc(experiences[check_joint],
-                              action[1],
-                              np.asarray(p_same),
-                              alpha_prior,
-                              model_prior[check_joint],
-                              None,
-                              idx_last_successes,
-                              action[0],
-                              idx_last_failures,
-                              world,
-                              use_joint_positions)
-        action_values.append((action[1], check_joint, action[0], value))
-
-    best_action = rand_max(action_values, lambda x: x[3])
-
+                   use_joint_positions=False, posterior_cache=None,
+                   resolution=1., exhaustive=False, scoring_pool=None,
+                   time_budget=None, batch_size=16, info=None):
+    """
+    Choose the next action by scoring candidate actions with the objective.
+
+    Without a time budget `N_samples` candidates are scored. With a time
+    budget the candidates are scored in batches, which double in size as long
+    as the next batch is expected to finish within the budget. The actions of
+    a sampling function which enumerates a fixed set of actions (see
+    `enumerates_actions`) are scored in slices instead of being sampled again
+    for every batch. The best action so far is kept, and it is returned once
+    the budget is used up, `N_samples` candidates (if not None) are scored or
+    the enumerated actions are exhausted. The first batch is always scored.
+
+    :param time_budget: The wall-clock seconds to spend on scoring (default:
+                        no limit)
+    :param batch_size: The size of the first batch with a time budget
+    :param info: A dictionary which is updated with the number of scored
+                 'Candidates', the number of 'Batches' and the 'Time' spent
+    :return: A tuple of the joint positions, the checked joint, the moved
+             joint and the value of the best action
+    """
+    start = time.time()
+    if posterior_cache is None:
+        posterior_cache = PosteriorCache(alpha_prior, model_prior, resolution)
+    p_same = posterior_cache.p_same(p_same)
+
+    def score(actions):
+        return _score_actions(objective_fnc, actions, experiences, p_same,
+                              alpha_prior, model_prior, world,
+                              idx_last_successes, idx_last_failures,
+                              use_joint_positions, posterior_cache,
+                              exhaustive, scoring_pool)
+
+    if time_budget is None:
+        actions = action_sampling_fnc(N_samples, world, locked_states)
+        best_action = _best_action(score(actions), exhaustive)
+        candidates, batches = len(actions), 1
+    else:
+        deadline = start + time_budget
+        size = batch_size if N_samples is None else min(batch_size,
+                                                        N_samples)
+        actions = action_sampling_fnc(size, world, locked_states)
+        # a fixed set of enumerated actions is scored in slices
+        enumerated = (actions if exhaustive or
+                      enumerates_actions(action_sampling_fnc) else None)
+        best_action = None
+        candidates = batches = 0
+        while True:
+            if enumerated is not None:
+                actions = enumerated[candidates:candidates + size]
+            elif batches > 0:
+                actions = action_sampling_fnc(size, world, locked_states)
+            batch_start = time.time()
+            action = _best_action(score(actions), exhaustive)
+            # a later batch has to be better, so ties keep the earlier action
+            if best_action is None or action[3] > best_action[3]:
+                best_action = action
+            candidates += len(actions)
+            batches += 1
+
+            now = time.time()
+            remaining = deadline - now
+            if remaining <= 0:
+                break
+            # the next batch has to finish within the budget
+            size = 2 * size
+            per_candidate = (now - batch_start) / len(actions)
+            if per_candidate > 0:
+                size = min(size, int(remaining / per_candidate))
+            if enumerated is not None:
+                size = min(size, len(enumerated) - candidates)
+            elif N_samples is not None:
+                size = min(size, N_samples - candidates)
+            if size < 1:
+                break
+
+    if info is not None:
+        info.update(Candidates=candidates, Batches=batches,
+                    Time=time.time() - start)
     return best_action
 
 
+def enumerates_actions(action_sampling_fnc):
+    """
+    :param action_sampling_fnc: The action sampling function, or a partial of
+                                it
+    :return: If the function enumerates a fixed set of actions instead of
+             sampling the requested number of actions (its `enumerates`
+             attribute)
+    """
+    while isinstance(action_sampling_fnc, partial):
+        action_sampling_fnc = action_sampling_fnc.func
+    return getattr(action_sampling_fnc, 'enumerates', False)
+
+
 def small_joint_state_sampling(_, world, locked_states):
     actions = []
     for j, joint in enumerate(world.joints):
@@ -124,40 +357,75 @@ def small_joint_state_sampling(_, world, locked_states):
     return actions
 
 
-def large_joint_state_sampling(N_samples, world, locked_states):
+small_joint_state_sampling.enumerates = True
+
+
+def large_joint_state_sampling(N_samples, world, locked_states,
+                               resolution=1.):
     actions = []
     for i in range(N_samples):
         pos = np.ndarray((len(world.joints),))
         for j, joint in enumerate(world.joints):
             if locked_states[j] == 1:
-                pos[j] = int(joint.get_q())
+                pos[j] = quantize(joint.get_q(), resolution)
             else:
-                pos[j] = np.random.randint(joint.min_limit, joint.max_limit)
+                pos[j] = np.random.randint(
+                    int(round(joint.min_limit / resolution)),
+                    int(round(joint.max_limit / resolution))) * resolution
         actions.append((j, deepcopy(pos)))
     return actions
 
 
 def large_joint_state_one_joint_moving_sampling(N_samples, world,
-                                                locked_state):
+                                                locked_state, resolution=1.):
     actions = []
     for i in range(N_samples):
-        pos = np.asarray([int(joint.get_q()) for joint in world.joints])
+        pos = quantize([joint.get_q() for joint in world.joints], resolution)
         joint_idx = np.random.choice(
             np.where(np.asarray(locked_state) == 0)[0])
         joint = world.joints[joint_idx]
-        pos[joint_idx] = np.random.randint(joint.min_limit, joint.max_limit)
+        pos[joint_idx] = np.random.randint(
+            int(round(joint.min_limit / resolution)),
+            int(round(joint.max_limit / resolution))) * resolution
         actions.append((joint_idx, deepcopy(pos)))
         #print((joint_idx, pos))
     return actions
 
 
-def get_probability_over_degree(P, qs):
-    probs = np.zeros((360,))
-    count = np.zeros((360,))
+def exhaustive_joint_state_sampling(_, world, locked_state, resolution=1.):
+    """
+    Enumerate every action which moves one joint, that is not known to be
+    locked, from the current joint positions to one of its position bins.
+
+    :param world: The world with the joints
+    :param locked_state: The locking states of the joints (1 for locked)
+    :param resolution: The size of the position bins in degrees
+    :return: The actions as list of (moved joint, joint positions) tuples,
+             ordered by joint and target position
+    """
+    current = quantize([joint.get_q() for joint in world.joints], resolution)
+    actions = []
+    for joint_idx in np.where(np.asarray(locked_state) != 1)[0]:
+        joint = world.joints[joint_idx]
+        for target in range(int(round(joint.min_limit / resolution)),
+                            int(round(joint.max_limit / resolution))):
+            pos = np.array(current)
+            pos[joint_idx] = target * resolution
+            actions.append((joint_idx, pos))
+    return actions
+
+
+exhaustive_joint_state_sampling.enumerates = True
+
+
+def get_probability_over_degree(P, qs, resolution=1.):
+    n = num_bins(resolution)
+    probs = np.zeros((n,))
+    count = np.zeros((n,))
     for i, pos in enumerate(qs[:-2]):
 
-        deg = int(pos)%360
-        
+        deg = int(pos / resolution) % n
+
         probs[deg] += P[i]
         count[deg] += 1
 
@@ -167,7 +435,8 @@ def get_probability_over_degree(P, qs):
     return probs, count
 
 
-def update_p_cp(world, use_ros):
+def update_p_cp(world, use_ros, resolution=1.):
+    bcd = changepoint_detection()
     P_cp = []
     pid = multiprocessing.current_process().pid
     for j, joint in enumerate(world.joints):
@@ -199,7 +468,8 @@ def update_p_cp(world, use_ros):
 
         p_cp, count = get_probability_over_degree(
             np.exp(Pcp).sum(0)[:1],
-            Record.records[pid]['q_' + str(j)][-1:].as_matrix())
+            Record.records[pid]['q_' + str(j)][-1:].as_matrix(),
+            resolution)
 
         P_cp.append(p_cp)
     return P_cp
@@ -223,32 +493,51 @@ def nan_helper(y):
     return np.isnan(y), lambda z: z.nonzero()[0]
 
 
-def calc_posteriors(world, experiences, P_same, alpha_prior, model_prior):
+def calc_posteriors(world, experiences, P_same, alpha_prior, model_prior,
+                    posterior_cache=None, resolution=1.):
+    if posterior_cache is not None:
+        # only the experiences made since the last call are added
+        posteriors = []
+        for i, joint in enumerate(world.joints):
+            posteriors.append(posterior_cache.joint_posterior(
+                i, experiences[i], P_same).posterior)
+        return posteriors
+
     posteriors = []
     for i, joint in enumerate(world.joints):
-        posteriors.append(model_posterior(experiences[i], np.asarray(P_same),
+        posteriors.append(model_posterior(experiences[i], as_p_same(P_same),
                                           alpha_prior,
-                                          np.asarray(model_prior[i])))
+                                          np.asarray(model_prior[i]),
+                                          resolution))
     return posteriors
 
 
 def dependency_learning(N_actions, N_samples, world, objective_fnc,
                         use_change_points, alpha_prior, model_prior,
                         action_machine, location, action_sampling_fnc,
-                        use_ros, use_joint_positions=False):
-    #writer = Writer(location)
-    widgets = [ Bar(), Percentage(),
-                " (Run #{}, PID {})".format(0,
-                                            multiprocessing.current_process().pid)]
-    progress = ProgressBar(maxval=N_actions+2, #fd=writer,
-                           widgets=widgets).start()
+                        use_ros, use_joint_positions=False, resolution=1.,
+                        dtype=np.float64, exhaustive=False, top_k=None,
+                        model_threshold=None, recheck=10, headless=False,
+                        run=None, scoring_workers=1, time_budget=None):
+    import pandas as pd
+
+    if headless:
+        progress = NullProgressBar()
+    else:
+        from progressbar import ProgressBar, Bar, Percentage
+        #writer = Writer(location)
+        widgets = [ Bar(), Percentage(),
+                    " (Run #{}, PID {})".format(0,
+                                                multiprocessing.current_process().pid)]
+        progress = ProgressBar(maxval=N_actions+2, #fd=writer,
+                               widgets=widgets).start()
     progress.update(0)
     # init phase
     # initialize the probability distributions
-    P_cp, experiences = init(world)
+    P_cp, experiences = init(world, resolution)
 
     # get locking state of all joints by actuating them once
-    jpos = np.array([int(j.get_q()) for j in world.joints])
+    jpos = quantize([j.get_q() for j in world.joints], resolution)
     locked_states = [None] * len(world.joints)
     locked_states_before = [None] * len(world.joints)
 
@@ -260,10 +549,10 @@ def dependency_learning(N_actions, N_samples, world, objective_fnc,
             action_machine.run_action(action_pos)
             action_pos[i] = world.joints[i].min_limit
             action_machine.run_action(action_pos)
-        P_cp = update_p_cp(world, use_ros)
-        P_same = compute_p_same(P_cp)
+        P_cp = update_p_cp(world, use_ros, resolution)
+        P_same = compute_p_same(P_cp, resolution, dtype)
     else:
-        P_same = compute_p_same(P_cp)
+        P_same = compute_p_same(P_cp, resolution, dtype)
 
     # for j, joint in enumerate(world.joints):
     #     locked_states[j] = action_machine.check_state(j)
@@ -285,102 +574,151 @@ def dependency_learning(N_actions, N_samples, world, objective_fnc,
                 #'World': world,
                 'ModelPrior': model_prior,
                 'AlphaPrior': alpha_prior,
+                'Resolution': resolution,
+                'Precision': np.dtype(dtype).name,
+                'Exhaustive': exhaustive,
+                'Backend': active_backend(),
+                'TopK': top_k,
+                'ModelThreshold': model_threshold,
+                'TimeBudget': time_budget,
                 'P_cp': P_cp,
                 'P_same': P_same}
+    if run is not None:
+        metadata['Run'] = run
 
     idx_last_successes = []
     idx_last_failures = []
 
+    # the p_same tensor and the model posteriors are computed once and
+    # updated incrementally after every action
+    posterior_cache = PosteriorCache(alpha_prior, model_prior, resolution,
+                                     top_k, model_threshold, recheck)
+
     # store empty data frame so file is available
     filename = generate_filename(metadata)
-    with open(filename, "w") as _file:
-        cPickle.dump((data, metadata), _file)
-
-    for idx in range(N_actions):
-        current_data = pd.DataFrame(index=[idx])
-        # get best action according to objective function
-        pos, checked_joint, moved_joint, value = \
-            get_best_point(objective_fnc,
-                           experiences,
-                           P_same,
-                           alpha_prior,
-                           model_prior,
-                           N_samples,
-                           world,
-                           locked_states,
-                           action_sampling_fnc,
-                           idx_last_successes,
-                           idx_last_failures,
-                           use_joint_positions)
-
-        if moved_joint is None:
-            print("We finished the exploration")
-            print("This usually happens when you use the heuristic_proximity "
-                  "that has as objective to estimate the dependency structure "
-                  "and not to reduce the entropy")
-            break
-
-        for n, p in enumerate(pos):
-            current_data["DesiredPos" + str(n)] = [p]
-        current_data["CheckedJoint"] = [checked_joint]
-
-        # save the joint and locked states before the action
-        locked_states_before = [joint.is_locked()
-                                for joint in world.joints]
-        jpos_before = np.array([int(j.get_q()) for j in world.joints])
-
-        action_outcome = True
-        if np.all(np.abs(pos - jpos_before) < .1):
-            # if we want a no-op don't actually call the robot
-            jpos = pos
-
-        else:
-            # run best action, i.e. move joints to desired position
-            action_outcome = action_machine.run_action(pos, moved_joint)
-
-            # get real position after action (PD-controllers aren't perfect)
-            jpos = np.array([int(j.get_q()) for j in world.joints])
-
-        for n, p in enumerate(jpos):
-            current_data["RealPos" + str(n)] = [p]
-
-        # save the locked states after the action
-        # test whether the joints are locked or not
-        locked_states = [joint.is_locked()
-                         for joint in world.joints]
-
-        for n, p in enumerate(locked_states):
-            current_data["LockingState" + str(n)] = [p]
-
-        # if the locked states changed the action was successful, if not,
-        # it was a failure
-        # CORRECTION: it could be that a joint moves but it does not unlock a
-        # mechanism. Then it won't be a failure nor a success. We just do not
-        # add it no any list
-        if action_outcome:
-            idx_last_failures = []
-            idx_last_successes.append(moved_joint)
+    dump((data, metadata), filename)
+
+    # the candidates of the all-joint objectives are scored in parallel,
+    # except in the daemonic workers of a campaign pool which can't start
+    # processes
+    scoring_pool = None
+    if scoring_workers > 1 and objective_fnc in all_joint_objectives:
+        if multiprocessing.current_process().daemon:
+            print("Scoring serially inside a pool worker.")
         else:
-            idx_last_failures.append(moved_joint)
-
-        # add new experience
-        new_experience = {'data': jpos, 'value': locked_states[moved_joint]}
-        experiences[moved_joint].append(new_experience)
-
-        # calculate model posterior
-        posteriors = calc_posteriors(world, experiences, P_same, alpha_prior,
-                                     model_prior)
-        for n, p in enumerate(posteriors):
-            current_data["Posterior" + str(n)] = [p]
-            current_data["Entropy" + str(n)] = [entropy(p)]
-
-        data = data.append(current_data)
-        progress.update(idx+1)
-
-        filename = generate_filename(metadata)
-        with open(filename, "w") as _file:
-            cPickle.dump((data, metadata), _file)
+            scoring_pool = ScoringPool(scoring_workers)
+
+    # the workers and the shared memory of the scoring pool are released
+    # even if a query fails
+    try:
+        for idx in range(N_actions):
+            current_data = pd.DataFrame(index=[idx])
+            selection = {}
+            # get best action according to objective function
+            pos, checked_joint, moved_joint, value = \
+                get_best_point(objective_fnc,
+                               experiences,
+                               P_same,
+                               alpha_prior,
+                               model_prior,
+                               N_samples,
+                               world,
+                               locked_states,
+                               action_sampling_fnc,
+                               idx_last_successes,
+                               idx_last_failures,
+                               use_joint_positions,
+                               posterior_cache,
+                               resolution,
+                               exhaustive,
+                               scoring_pool,
+                               time_budget,
+                               info=selection)
+
+            if moved_joint is None:
+                print("We finished the exploration")
+                print("This usually happens when you use the "
+                      "heuristic_proximity that has as objective to estimate "
+                      "the dependency structure and not to reduce the "
+                      "entropy")
+                break
+
+            for n, p in enumerate(pos):
+                current_data["DesiredPos" + str(n)] = [p]
+            current_data["CheckedJoint"] = [checked_joint]
+            current_data["Candidates"] = [selection['Candidates']]
+            current_data["SelectionTime"] = [selection['Time']]
+
+            # save the joint and locked states before the action
+            locked_states_before = [joint.is_locked()
+                                    for joint in world.joints]
+            jpos_before = quantize([j.get_q() for j in world.joints],
+                                   resolution)
+
+            action_outcome = True
+            if np.all(np.abs(pos - jpos_before) < .1 * resolution):
+                # if we want a no-op don't actually call the robot
+                jpos = pos
 
+            else:
+                # run best action, i.e. move joints to desired position
+                action_outcome = action_machine.run_action(pos, moved_joint)
+
+                # get real position after action (PD-controllers aren't
+                # perfect)
+                jpos = quantize([j.get_q() for j in world.joints], resolution)
+
+            for n, p in enumerate(jpos):
+                current_data["RealPos" + str(n)] = [p]
+
+            # save the locked states after the action
+            # test whether the joints are locked or not
+            locked_states = [joint.is_locked()
+                             for joint in world.joints]
+
+            for n, p in enumerate(locked_states):
+                current_data["LockingState" + str(n)] = [p]
+
+            # if the locked states changed the action was successful, if not,
+            # it was a failure
+            # CORRECTION: it could be that a joint moves but it does not
+            # unlock a mechanism. Then it won't be a failure nor a success. We
+            # just do not add it no any list
+            if action_outcome:
+                idx_last_failures = []
+                idx_last_successes.append(moved_joint)
+            else:
+                idx_last_failures.append(moved_joint)
+
+            # add new experience
+            new_experience = {'data': jpos,
+                              'value': locked_states[moved_joint]}
+            experiences[moved_joint].append(new_experience)
+
+            # calculate model posterior
+            posteriors = calc_posteriors(world, experiences, P_same,
+                                         alpha_prior, model_prior,
+                                         posterior_cache)
+            for n, p in enumerate(posteriors):
+                current_data["Posterior" + str(n)] = [p]
+                current_data["Entropy" + str(n)] = [
+                    np.sum(entr(p / np.sum(p)))]
+            if posterior_cache.pruning:
+                # the total variation distance of the posteriors to the ones of
+                # all models, as of the last model selection
+                for n, joint_experiences in enumerate(experiences):
+                    current_data["PrunedMass" + str(n)] = [
+                        posterior_cache.joint_posterior(
+                            n, joint_experiences).pruned_mass]
+
+            data = data.append(current_data)
+            progress.update(idx+1)
+
+            filename = generate_filename(metadata)
+            dump((data, metadata), filename)
+    finally:
+        if scoring_pool is not None:
+            scoring_pool.close()
     progress.finish()
     return data, metadata
 
@@ -422,16 +760,73 @@ def build_model_prior_3d(world, independent_prior):
     return model_prior
 
 
-def run_experiment(args):
+def prior_grid_posteriors(world, experiences, P_same, alpha_priors,
+                          independent_priors, resolution=1.,
+                          model_prior_fnc=build_model_prior_3d):
+    """
+    Evaluate the model posteriors of all joints for a grid of alpha priors
+    and independent priors over the same experiences, e.g. the experiences
+    of a finished run, instead of repeating the run for every prior.
+
+    The model priors are built by `model_prior_fnc`, like in `run_experiment`
+    by default.
+
+    :param world: The world with the joints
+    :param experiences: The experiences of every joint
+    :param P_same: The probabilities of two joint positions being in the same
+                   segment
+    :param alpha_priors: The priors over the joint states (alpha priors x
+                         values)
+    :param independent_priors: The prior probabilities of the independent
+                               model
+    :param resolution: The size of one bin of P_same in degrees
+    :param model_prior_fnc: The function building the model prior of a world
+                            from the independent prior
+    :return: The posteriors (alpha priors x independent priors x joints x
+             models)
+    """
+    P_same = as_p_same(P_same)
+    model_priors = np.array([model_prior_fnc(world, independent_prior)
+                             for independent_prior in independent_priors])
+    posteriors = np.zeros((len(alpha_priors), len(independent_priors)) +
+                          model_priors.shape[1:])
+    for j, joint_experiences in enumerate(experiences):
+        posteriors[:, :, j] = model_posterior_grid(
+            joint_experiences, P_same, alpha_priors, model_priors[:, j],
+            resolution)
+    return posteriors
+
+
+def run_experiment(args, run=0, seed=None):
+    """
+    Run one experiment and store its data and metadata in a file.
+
+    :param args: The parsed command line arguments
+    :param run: The number of the run in its campaign
+    :param seed: The seed of the random number generators (default: derived
+                 from the time)
+    :return: The summary of the run (see `summarize_run`)
+    """
     # reset all things for every new experiment
+    import pandas as pd
+
+    start = time.time()
+    use_backend(args.backend)
     pid = multiprocessing.current_process().pid
-    seed = time.gmtime()
+    if seed is None:
+        seed = seed_for_run(int(start * 1e6), pid)
     np.random.seed(seed)
-    if bcd:
-        bcd.offline_changepoint_detection.data = None
+    random.seed(seed)
+    if args.changepoint:
+        changepoint_detection().offline_changepoint_detection.data = None
+    # a pool worker runs one experiment after the other, the records of the
+    # previous ones are dropped
+    Record.records.clear()
     Record.records[pid] = pd.DataFrame()
 
     if args.use_ros:
+        from joint_dependency.ros_adapter import (RosActionMachine,
+                                                  create_ros_lockbox)
         world = create_ros_lockbox()
         action_machine = RosActionMachine(world)
     else:
@@ -472,13 +867,19 @@ def run_experiment(args):
     if args.joint_state == "small":
         action_sampling_fnc = small_joint_state_sampling
     elif args.joint_state == "large":
-        action_sampling_fnc = large_joint_state_one_joint_moving_sampling
+        action_sampling_fnc = partial(
+            large_joint_state_one_joint_moving_sampling,
+            resolution=args.resolution)
+    elif args.joint_state == "exhaustive":
+        action_sampling_fnc = partial(exhaustive_joint_state_sampling,
+                                      resolution=args.resolution)
     else:
         raise Exception("No proper action sampling function chosen.")
 
     data, metadata = dependency_learning(
         N_actions=args.queries,
-        N_samples=args.samples,
+        N_samples=(args.samples if args.samples is not None
+                   else default_samples(objective)),
         world=world,
         objective_fnc=objective,
         use_change_points=args.changepoint,
@@ -488,15 +889,137 @@ def run_experiment(args):
         location=None,
         action_sampling_fnc=action_sampling_fnc,
         use_ros=args.use_ros,
-        use_joint_positions=args.use_joint_positions)
+        use_joint_positions=args.use_joint_positions,
+        resolution=args.resolution,
+        dtype=precisions[args.precision],
+        exhaustive=args.joint_state == "exhaustive",
+        top_k=args.top_k,
+        model_threshold=args.model_threshold,
+        recheck=args.recheck,
+        headless=args.headless,
+        run=run,
+        scoring_workers=args.scoring_workers,
+        time_budget=args.time_budget)
 
     metadata['Seed'] = seed
     filename = generate_filename(metadata)
-    with open(filename, "wb") as _file:
-        cPickle.dump((data, metadata), _file)
+    dump((data, metadata), filename)
+    return summarize_run(data, metadata, filename, time.time() - start)
 
 
-def main():
+def summarize_run(data, metadata, filename, duration):
+    """
+    :param data: The data of the run (pandas DataFrame)
+    :param metadata: The metadata of the run (dictionary)
+    :param filename: The file the run is stored in
+    :param duration: The wall time of the run in seconds
+    :return: The summary of the run (dictionary), with the total entropy of
+             the model posteriors after the last action
+    """
+    entropies = [column for column in data.columns
+                 if str(column).startswith("Entropy")]
+    return {'Run': metadata.get('Run'),
+            'Seed': metadata.get('Seed'),
+            'Objective': metadata['Objective'],
+            'Actions': len(data),
+            'FinalEntropy': (float(np.sum(data[entropies].values[-1]))
+                             if len(data) and entropies else np.nan),
+            'Time': duration,
+            'Filename': filename}
+
+
+def run_specs(args):
+    """
+    Specify the runs of a campaign. Every run gets its own seed derived from
+    `args.seed` (see `seed_for_run`), so a campaign can be repeated.
+
+    :param args: The parsed command line arguments
+    :return: The specifications of the runs (list of dictionaries with the
+             command line options 'args' (dictionary), the number 'run' and
+             the 'seed' of every run)
+    """
+    base_seed = args.seed
+    if base_seed is None:
+        base_seed = int(np.random.SeedSequence().entropy % 2**32)
+    return [{'args': dict(vars(args)), 'run': run,
+             'seed': seed_for_run(base_seed, run)}
+            for run in range(args.runs)]
+
+
+def run_spec(spec, run_fnc=run_experiment):
+    """
+    :param spec: The specification of a run (see `run_specs`)
+    :param run_fnc: The function running one experiment, called with the
+                    arguments, the number of the run and its seed
+    :return: The summary of the run
+    """
+    return run_fnc(argparse.Namespace(**spec['args']), spec['run'],
+                   spec['seed'])
+
+
+def run_in_directory(spec, run_fnc=run_experiment):
+    """
+    Run an experiment in a temporary working directory and collect the files
+    it writes.
+
+    :param spec: The specification of the run (see `run_specs`)
+    :param run_fnc: The function running one experiment, called with the
+                    arguments, the number of the run and its seed
+    :return: A tuple of the summary of the run and its files (dictionary of
+             the file names and their content)
+    """
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix='joint_dependency_run')
+    try:
+        os.chdir(workdir)
+        result = run_spec(spec, run_fnc)
+        files = {}
+        for filename in os.listdir(workdir):
+            with open(filename, 'rb') as _file:
+                files[filename] = _file.read()
+        return result, files
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _run_one(job):
+    return run_spec(*job)
+
+
+def run_experiments(args, run_fnc=run_experiment):
+    """
+    Run all experiments of a campaign, `args.runs` runs in a pool of
+    `args.threads` processes.
+
+    The runs are specified by `run_specs`. Every worker process has its own
+    records, which `run_experiment` clears before each run.
+
+    :param args: The parsed command line arguments
+    :param run_fnc: The function running one experiment, called with the
+                    arguments, the number of the run and its seed
+    :return: The summaries of the runs (pandas DataFrame, one row per run)
+    """
+    import pandas as pd
+
+    jobs = [(spec, run_fnc) for spec in run_specs(args)]
+    processes = max(1, min(args.threads, args.runs))
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            summaries = pool.map(_run_one, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        summaries = [_run_one(job) for job in jobs]
+    return pd.DataFrame(summaries).set_index('Run')
+
+
+def build_parser():
+    """
+    :return: The parser of the command line options of an experiment
+    """
     parser = argparse.ArgumentParser()
     parser.add_argument("-o", "--objective", required=True,
                         help="The objective to optimize for exploration",
@@ -506,35 +1029,125 @@ def main():
                         help="Should change points used as prior")
     parser.add_argument("-t", "--threads", type=int,
                         default=multiprocessing.cpu_count(),
-                        help="Number of threads used")
+                        help="Number of runs executed in parallel, every "
+                             "run in its own process")
     parser.add_argument("-q", "--queries", type=int, default=20,
                         help="How many queries should the active learner make")
-    parser.add_argument("-s", "--samples", type=int, default=4000,
+    parser.add_argument("-s", "--samples", type=int, default=None,
                         help="How many samples should be drawn for "
-                             "optimization")
+                             "optimization. With the entropy objectives "
+                             "every sample is scored for every checked "
+                             "joint, they default to {} samples. The other "
+                             "objectives check one random joint per sample "
+                             "and default to {}.".format(
+                                 DEFAULT_ALL_JOINT_SAMPLES, DEFAULT_SAMPLES))
+    parser.add_argument("--time_budget", type=float, default=None,
+                        help="The seconds to spend on choosing an action. "
+                             "The candidates are scored in growing batches "
+                             "until the budget is used up, at most --samples "
+                             "of them.")
     parser.add_argument("-r", "--runs", type=int, default=20,
                         help="Number of runs")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="The seed of the campaign, every run derives "
+                             "its own seed from it (default: random)")
     parser.add_argument("-p", "--prob-file", type=str, default=None,
                         help="The file with the probability distributions")
     parser.add_argument("--use_ros", action='store_true',
                         help="Enable ROS/real robot usage.")
     parser.add_argument("--joint_state", type=str, default='large',
+                        choices=['small', 'large', 'exhaustive'],
                         help="Should we use a large or a small joint state "
-                             "(large/small).")
+                             "(large/small), or score every action moving "
+                             "one joint to any position (exhaustive).")
     parser.add_argument("--use_joint_positions", action='store_true',
                         help="Don't assume a linear sequence of joints but 3d "
                              "positions.")
     parser.add_argument("--use_simple_locking_state", action='store_true',
                         help="Don't randomize the locking configuration, but "
                              "have joint limits lock other joints")
+    parser.add_argument("--resolution", type=float, default=1.,
+                        help="The size of the joint position bins in degrees, "
+                             "e.g. 0.1 for precise latches or 5 for fast "
+                             "screening.")
+    parser.add_argument("--precision", type=str, default='double',
+                        choices=sorted(precisions),
+                        help="The floating point precision of p_same and the "
+                             "candidate scoring. Single precision halves the "
+                             "memory and stays within {} of the double "
+                             "precision posteriors.".format(
+                                 SINGLE_PRECISION_ATOL))
+    parser.add_argument("--top_k", type=int, default=None,
+                        help="Track only the k most probable dependency "
+                             "models of every joint, starting with the k "
+                             "most probable by prior.")
+    parser.add_argument("--model_threshold", type=float, default=None,
+                        help="Track only the dependency models with a "
+                             "posterior of at least this value.")
+    parser.add_argument("--recheck", type=int, default=10,
+                        help="Evaluate all dependency models of a joint "
+                             "again after this many new experiences, so "
+                             "pruned models can be re-admitted.")
+    parser.add_argument("--backend", type=str, default=None,
+                        choices=['auto'] + list(BACKENDS),
+                        help="The implementation of the inference, the "
+                             "compiled extension (cython) or pure NumPy "
+                             "(numpy). auto uses the compiled extension if "
+                             "it can be loaded. Defaults to the environment "
+                             "variable JOINT_DEPENDENCY_BACKEND, or auto.")
+    parser.add_argument("--scoring-workers", type=int, default=1,
+                        help="Number of processes scoring the candidates of "
+                             "every query (entropy objectives only). Use "
+                             "it for single runs, the runs of a campaign "
+                             "with several threads score serially.")
+    parser.add_argument("--headless", action='store_true',
+                        help="Don't clear the terminal and don't show "
+                             "progress bars, e.g. for batch jobs.")
+    parser.add_argument("--serve", type=str, default=None,
+                        metavar="HOST:PORT",
+                        help="Don't run the experiments here, but serve them "
+                             "to workers (scripts/joint_dep_worker.py) at "
+                             "this address and collect their result files. "
+                             "An empty HOST means localhost, 0.0.0.0 all "
+                             "interfaces.")
+    parser.add_argument("--authkey", type=str, default=None,
+                        help="The key the workers authenticate with, "
+                             "defaults to the environment variable "
+                             "JOINT_DEPENDENCY_AUTHKEY. Without either, a "
+                             "random key is generated and printed.")
+    parser.add_argument("--lease", type=float, default=60.,
+                        help="Seconds without a heartbeat after which a "
+                             "worker is considered lost and its run is "
+                             "given to another worker.")
+    parser.add_argument("--max_attempts", type=int, default=3,
+                        help="How often a run is tried before it is given "
+                             "up.")
+    return parser
 
-    args = parser.parse_args()
 
-    print(term.clear)
-
-    run_experiment(args)
-
-    print(term.clear)
+def main():
+    args = build_parser().parse_args()
+
+    if args.serve is not None:
+        from joint_dependency.distributed import serve_experiments
+        summary = serve_experiments(args)
+        print(summary)
+        dump(summary, generate_filename({'Date': datetime.datetime.now(),
+                                         'Objective': args.objective},
+                                        prefix="summary"))
+        return
+
+    if not args.headless:
+        print(terminal().clear)
+
+    summary = run_experiments(args)
+
+    if not args.headless:
+        print(terminal().clear)
+    print(summary)
+    dump(summary, generate_filename({'Date': datetime.datetime.now(),
+                                     'Objective': args.objective},
+                                    prefix="summary"))
 
 if __name__ == '__main__':
     main()
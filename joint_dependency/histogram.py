@@ -0,0 +1,172 @@
+# coding: utf-8
+
+from __future__ import division
+import numpy as np
+
+from joint_dependency import inference
+from joint_dependency.buffer import ExperienceBuffer, experience_arrays
+from joint_dependency.psame import as_p_same
+from joint_dependency.utils import to_bins
+
+
+class ExperienceHistogram(object):
+    """
+    The experiences of a joint aggregated into counts of the observed values
+    per joint and position bin.
+
+    The likelihoods only depend on the bins of the joint positions and on the
+    observed values, so all experiences in the same bin share their buckets.
+    Working over the occupied bins makes the cost quadratic in the number of
+    occupied bins instead of the number of experiences, which matters when
+    many queries land on the same positions (e.g. the joint limits proposed
+    by `small_joint_state_sampling`).
+
+    Like a list of experiences the histogram is append-only, `update` adds
+    the experiences which were not counted yet.
+    """
+    def __init__(self, num_joints, num_bins, num_values=2, resolution=1.,
+                 experiences=None):
+        """
+        :param num_joints: The number of joints of the experiences
+        :param num_bins: The number of position bins of p_same
+        :param num_values: The number of different values
+        :param resolution: The size of one bin in degrees
+        :param experiences: Experiences to start with (list of dictionaries
+                            or `ExperienceBuffer`)
+        """
+        self.num_joints = num_joints
+        self.num_bins = num_bins
+        self.num_values = num_values
+        self.resolution = resolution
+        self.num_experiences = 0
+        self.counts = np.zeros((num_joints, num_bins, num_values), dtype=int)
+        self.value_counts = np.zeros((num_values,), dtype=int)
+
+        if experiences is not None:
+            self.extend(experiences)
+
+    def __len__(self):
+        return self.num_experiences
+
+    def append(self, experience):
+        """
+        :param experience: The new experience (dictionary)
+        """
+        self.extend([experience])
+
+    def extend(self, experiences):
+        """
+        :param experiences: The new experiences (list of dictionaries or
+                            `ExperienceBuffer`)
+        """
+        if len(experiences) == 0:
+            return
+        positions, values = experience_arrays(experiences, self.resolution)
+        np.add.at(self.counts, (np.arange(self.num_joints)[None, :],
+                                positions, values[:, None]), 1)
+        self.value_counts += np.bincount(values, minlength=self.num_values)
+        self.num_experiences += values.shape[0]
+
+    def update(self, experiences):
+        """
+        Count all experiences of an append-only list that were not counted
+        yet.
+
+        :param experiences: All experiences made so far for this joint
+        """
+        self.extend(experiences[self.num_experiences:])
+
+    def occupied(self, joint_idx):
+        """
+        :param joint_idx: The joint whose position bins are used
+        :return: A tuple of the occupied bins of the joint (int array) and the
+                 counts of the values in them (bins x values)
+        """
+        counts = self.counts[joint_idx]
+        bins = np.flatnonzero(np.any(counts, axis=-1))
+        return bins, counts[bins]
+
+    def contributions(self, p_same, joints=None):
+        """
+        Compute the same-segment weighted counts of the values at every
+        position of every joint, i.e. `create_alpha` for all joints and
+        positions at once.
+
+        :param p_same: The probabilities of two joint positions being in the
+                       same segment
+        :param joints: The joints to compute the counts for, the rows of the
+                       other joints stay zero (default: all joints)
+        :return: The contribution table (joints x positions x values), in the
+                 precision of p_same
+        """
+        p_same = as_p_same(p_same)
+        if joints is None:
+            joints = range(self.num_joints)
+        positions = np.arange(self.num_bins)
+        table = np.zeros((self.num_joints, self.num_bins, self.num_values),
+                         dtype=p_same.dtype)
+        for joint in joints:
+            bins, counts = self.occupied(joint)
+            pairs = p_same[joint, positions[:, None], bins[None, :]]
+            table[joint] = np.dot(pairs, counts.astype(pairs.dtype))
+        return table
+
+    def log_likelihood_dependent(self, p_same, alpha_prior, joints):
+        """
+        Compute the log likelihood of the experiences for the dependency
+        models of some joints, over the occupied bins of these joints. This
+        is `_log_likelihood_dependent` of the active inference backend.
+
+        :param p_same: The probabilities of two joint positions being in the
+                       same segment
+        :param alpha_prior: The prior over the different joint states
+        :param joints: The joints defining the dependency models
+        :return: The log likelihood of the experiences for every dependency
+                 model
+        """
+        backend = inference.load_backend(inference.active_backend())
+        return backend._log_likelihood_dependent(
+            self, joints, as_p_same(p_same),
+            np.asarray(alpha_prior, dtype=float))
+
+def occupied_bins(experiences, joint_idx, num_values=2, resolution=1.):
+    """
+    Count the values of the experiences per occupied bin of one joint.
+
+    :param experiences: The experiences (list of dictionaries,
+                        `ExperienceBuffer` or `ExperienceHistogram`)
+    :param joint_idx: The joint whose position bins are used
+    :param num_values: The number of different values
+    :param resolution: The size of one bin in degrees
+    :return: A tuple of the occupied bins of the joint (int array) and the
+             counts of the values in them (bins x values)
+    """
+    if isinstance(experiences, ExperienceHistogram):
+        return experiences.occupied(joint_idx)
+    if isinstance(experiences, ExperienceBuffer):
+        positions, values = experience_arrays(experiences, resolution)
+        positions = positions[:, joint_idx]
+    else:
+        positions = to_bins([e['data'][joint_idx] for e in experiences],
+                            resolution)
+        values = np.array([e['value'] for e in experiences], dtype=int)
+    bins, inverse = np.unique(positions, return_inverse=True)
+    counts = np.zeros((bins.shape[0], num_values), dtype=int)
+    np.add.at(counts, (inverse.ravel(), values), 1)
+    return bins, counts
+
+
+def as_histogram(experiences, p_same, num_values=2, resolution=1.):
+    """
+    :param experiences: The experiences (list of dictionaries,
+                        `ExperienceBuffer` or `ExperienceHistogram`)
+    :param p_same: The probabilities of two joint positions being in the same
+                   segment, which define the number of joints and bins
+    :param num_values: The number of different values
+    :param resolution: The size of one bin in degrees
+    :return: The experiences as `ExperienceHistogram`
+    """
+    if isinstance(experiences, ExperienceHistogram):
+        return experiences
+    return ExperienceHistogram(p_same.shape[0], p_same.shape[-1], num_values,
+                               resolution, experiences)
@@ -1,5 +1,146 @@
-import numpy as np
-import pyximport
-pyximport.install(setup_args={"include_dirs": np.get_include()})
+"""
+The inference functions of the active backend.
 
-from .inference_cy import *
+Two backends implement the same functions: 'cython' is the compiled extension
+`inference_cy`, built ahead of time by setup.py, and 'numpy' is the pure NumPy
+module `inference_py`. The backend is chosen at import time by the environment
+variable JOINT_DEPENDENCY_BACKEND ('auto', 'cython' or 'numpy') and can be
+changed with `use_backend`. 'auto', the default, uses the compiled extension if
+it can be loaded and falls back to NumPy otherwise.
+
+The functions of this module forward to the active backend, so modules which
+imported them follow a later `use_backend`. The backend is loaded on the first
+call, so importing this module is cheap.
+"""
+from __future__ import division
+from collections import OrderedDict
+import importlib
+import os
+import warnings
+
+# the backends in the order 'auto' tries them
+BACKENDS = OrderedDict([('cython', 'joint_dependency.inference_cy'),
+                        ('numpy', 'joint_dependency.inference_py')])
+
+BACKEND_VARIABLE = 'JOINT_DEPENDENCY_BACKEND'
+
+__all__ = ['same_segment', 'log_likelihood', 'likelihood',
+           'log_likelihood_dependent', 'likelihood_dependent',
+           'log_likelihood_independent', 'likelihood_independent',
+           'log_model_posterior', 'model_posterior',
+           'log_model_posterior_grid', 'model_posterior_grid',
+           'create_alpha', 'contribution_table', 'prob_locked',
+           'random_objective', 'heuristic_proximity', 'exp_cross_entropy',
+           'exp_neg_entropy', 'dirichlet_mean', 'exp_cross_entropy_batch',
+           'exp_neg_entropy_batch', 'exp_cross_entropy_all_joints',
+           'exp_neg_entropy_all_joints']
+
+_modules = {}
+_active = None
+
+
+def _import_cython():
+    try:
+        return importlib.import_module(BACKENDS['cython'])
+    except ImportError:
+        pass
+    # a source checkout without the prebuilt extension compiles it on first
+    # use, which needs Cython and a compiler
+    import numpy as np
+    import pyximport
+    importers = pyximport.install(
+        setup_args={"include_dirs": np.get_include()})
+    try:
+        return importlib.import_module(BACKENDS['cython'])
+    finally:
+        pyximport.uninstall(*importers)
+
+
+def load_backend(name):
+    """
+    :param name: The name of the backend, one of `BACKENDS`
+    :return: The module of the backend
+    :raises ValueError: If there is no backend with this name
+    :raises ImportError: If the backend can't be loaded
+    """
+    if name not in BACKENDS:
+        raise ValueError("Unknown inference backend '{}', choose one of "
+                         "{}".format(name, list(BACKENDS)))
+    if name not in _modules:
+        if name == 'cython':
+            try:
+                _modules[name] = _import_cython()
+            except Exception as e:
+                raise ImportError("Can't load the compiled inference "
+                                  "backend: {}".format(e))
+        else:
+            _modules[name] = importlib.import_module(BACKENDS[name])
+    return _modules[name]
+
+
+def available_backends():
+    """
+    :return: The names of the backends which can be loaded
+    """
+    names = []
+    for name in BACKENDS:
+        try:
+            load_backend(name)
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def use_backend(name=None):
+    """
+    Select the backend of the inference functions.
+
+    :param name: The name of the backend, one of `BACKENDS`, or 'auto' for the
+                 first one which can be loaded (default: the value of
+                 JOINT_DEPENDENCY_BACKEND, or 'auto' if it is unset)
+    :return: The name of the active backend
+    :raises ImportError: If an explicitly requested backend can't be loaded
+    """
+    global _active
+    if name is None:
+        name = os.environ.get(BACKEND_VARIABLE) or 'auto'
+    if name != 'auto':
+        _active = name, load_backend(name)
+        return name
+    for candidate in BACKENDS:
+        try:
+            _active = candidate, load_backend(candidate)
+            return candidate
+        except ImportError as e:
+            warnings.warn("{}, falling back to the next inference "
+                          "backend".format(e))
+    raise ImportError("No inference backend can be loaded")
+
+
+def active_backend():
+    """
+    :return: The name of the active backend, which is selected by
+             `use_backend` if no backend is active yet
+    """
+    if _active is None:
+        use_backend()
+    return _active[0]
+
+
+def _forward(name):
+    def function(*args, **kwargs):
+        if _active is None:
+            use_backend()
+        return getattr(_active[1], name)(*args, **kwargs)
+    function.__name__ = name
+    function.__module__ = __name__
+    function.__doc__ = "`{}` of the active inference backend.".format(name)
+    if hasattr(function, '__qualname__'):
+        function.__qualname__ = name
+    return function
+
+
+for _name in __all__:
+    globals()[_name] = _forward(_name)
+del _name
@@ -4,77 +4,191 @@ from __future__ import division
 import numpy as np
 
 
-from scipy.special import gammaln
-from scipy.stats import dirichlet, entropy
+from scipy.special import gammaln, logsumexp
+
+from joint_dependency.buffer import experience_arrays
+from joint_dependency.histogram import as_histogram, occupied_bins
+from joint_dependency.posterior import (JointPosterior, augment_all,
+                                        _log_likelihood_counts)
+from joint_dependency.psame import PSame, as_p_same
+from joint_dependency.utils import to_bins
 
 
 def same_segment(probabilities):
     """
-    Compute a 2D-Array of probabilities, stating whether two degrees are in the
-    same segment or not.
+    Compute a 2D-Array of probabilities, stating whether two positions are in
+    the same segment or not.
+
+    This is the dense form of `PSame`, see there for how the probabilities are
+    computed.
 
     :param probabilities The change point probabilities for each position
+                         (one entry per bin, the bins define the resolution)
     :return: The probabilities that two joint states are in the same segment
              (I.e. no change points in between)
 
     """
-    pr = np.ones((360, 360))
-    for s in range(360):
-        for t in range(s+1, 360):
-            pr[s, t] = pr[t, s] = pr[s, t-1] * (1-probabilities[t-1])
-    return pr
+    return PSame([probabilities]).toarray()[0]
 
-    # p = np.zeros((360,360))
-    # for s in range(360):
-    #     for t in range(s+1, 360):
-    #         p[s][t] = np.prod(1-probabilities[s:t])
-    # for s in range(360):
-    #     p[s][s] = 1
-    #     for t in range(s):
-    #         p[s][t] = p[t][s]
-    # return p
 
+def _experience_arrays(experiences, resolution=1.):
+    """
+    Stack the experiences into arrays.
 
-def likelihood(experiences, alpha_prior):
+    :param experiences: Experiences made so far (list of dictionaries or
+                        `ExperienceBuffer`)
+    :param resolution: The size of one bin of p_same in degrees
+    :return: A tuple of the bins of the joint positions (N x joints int array)
+             and the observed values (N int array)
     """
-    Compute the likelihood of a list of experiences for a given Dirichlet
+    return experience_arrays(experiences, resolution)
+
+
+def log_likelihood(experiences, alpha_prior):
+    """
+    Compute the log likelihood of a list of experiences for a given Dirichlet
     prior.
 
     :param experiences: Experiences made so far (dictionary)
     :param alpha_prior: The prior over the different joint states
-    :return: The likelihood of the experiences. (float)
+    :return: The log likelihood of the experiences. (float)
     """
     A = np.sum(alpha_prior)
-    n = np.zeros((alpha_prior.shape[0], ))
-    for e in experiences:
-        n[e['value']] += 1
+    _, values = _experience_arrays(experiences)
+    n = np.bincount(values, minlength=alpha_prior.shape[0])
     N = len(experiences)
     lnp = gammaln(A) - gammaln(N+A) + np.sum(gammaln(n + alpha_prior) -
                                              gammaln(alpha_prior))
-    return np.exp(lnp)
+    return lnp
 
 
-def likelihood_dependent(experiences, dependent_joint, p_same, alpha_prior):
+def likelihood(experiences, alpha_prior):
     """
-    Compute the likelihood of the experiences for a specific dependency model.
+    Compute the likelihood of a list of experiences for a given Dirichlet
+    prior.
 
     :param experiences: Experiences made so far (dictionary)
+    :param alpha_prior: The prior over the different joint states
+    :return: The likelihood of the experiences. (float)
+    """
+    return np.exp(log_likelihood(experiences, alpha_prior))
+
+
+def _log_likelihood_dependent(histogram, dependent_joints, p_same,
+                              alpha_prior):
+    """
+    Compute the log likelihood of the experiences for several dependency
+    models at once.
+
+    All experiences in the same bin of the dependent joint share their
+    buckets, so the buckets are built once per occupied bin by a single
+    product of the same-segment probabilities among the occupied bins with
+    their counts. The likelihood of a single observation under its Dirichlet
+    buckets reduces to the observed bucket over the sum of the buckets, so
+    no gammaln differences are needed. The cost is quadratic in the number
+    of occupied bins instead of the number of experiences.
+
+    The buckets are in the precision of p_same, the log likelihoods are
+    summed up in double precision.
+
+    :param histogram: The experiences as `ExperienceHistogram`
+    :param dependent_joints: The joints defining the dependency models
+    :param p_same: The probabilities of two joint positions being in the same
+                   segment (joints x positions x positions)
+    :param alpha_prior: The prior over the different joint states
+    :return: The log likelihood of the experiences for every dependency model
+    """
+    return _log_likelihood_dependent_grid(histogram, dependent_joints, p_same,
+                                          alpha_prior[None])[0]
+
+
+def _log_likelihood_dependent_grid(histogram, dependent_joints, p_same,
+                                   alpha_priors):
+    """
+    Compute `_log_likelihood_dependent` for several alpha priors at once. The
+    same-segment probabilities among the occupied bins are gathered and
+    multiplied with the counts once per model, only the buckets differ
+    between the priors.
+
+    :param histogram: The experiences as `ExperienceHistogram`
+    :param dependent_joints: The joints defining the dependency models
+    :param p_same: The probabilities of two joint positions being in the same
+                   segment (joints x positions x positions)
+    :param alpha_priors: The priors over the different joint states (priors
+                         x values)
+    :return: The log likelihood of the experiences for every prior and
+             dependency model (priors x models)
+    """
+    dependent_joints = np.asarray(dependent_joints, dtype=int)
+    lnp = np.zeros((alpha_priors.shape[0],) + dependent_joints.shape)
+    for m, joint in enumerate(dependent_joints):
+        bins, counts = histogram.occupied(joint)
+        pairs = p_same[joint, bins[:, None], bins[None, :]]
+        buckets = (alpha_priors.astype(pairs.dtype)[:, None, :] +
+                   np.dot(pairs, counts.astype(pairs.dtype)))
+        log_total = np.log(np.sum(buckets, axis=-1))
+        lnp[:, m] = np.sum(counts * (np.log(buckets) - log_total[..., None]),
+                           axis=(1, 2), dtype=np.float64)
+    return lnp
+
+
+def log_likelihood_dependent(experiences, dependent_joint, p_same,
+                             alpha_prior, resolution=1.):
+    """
+    Compute the log likelihood of the experiences for a specific dependency
+    model.
+
+    :param experiences: Experiences made so far (list of dictionaries or
+                        `ExperienceHistogram`)
     :param dependent_joint: The joint defining the dependency model (i.e.
                             condition on this joint being the (un-) locking
                             joint)
     :param alpha_prior: The prior over the different joint states
+    :param resolution: The size of one bin of p_same in degrees
+    :return: The log likelihood of the experiences conditioned on the current
+             joint being locked by `dependent_joint`
+    """
+    p_same = as_p_same(p_same)
+    histogram = as_histogram(experiences, p_same, alpha_prior.shape[0],
+                             resolution)
+    lnp = _log_likelihood_dependent(histogram, [dependent_joint], p_same,
+                                    alpha_prior)
+    return lnp[0]
+
+
+def likelihood_dependent(experiences, dependent_joint, p_same, alpha_prior,
+                         resolution=1.):
+    """
+    Compute the likelihood of the experiences for a specific dependency model.
+
+    :param experiences: Experiences made so far (list of dictionaries or
+                        `ExperienceHistogram`)
+    :param dependent_joint: The joint defining the dependency model (i.e.
+                            condition on this joint being the (un-) locking
+                            joint)
+    :param alpha_prior: The prior over the different joint states
+    :param resolution: The size of one bin of p_same in degrees
     :return: The likelihood of the experiences conditioned on the current joint
              joint being locked by `dependent_joint`
     """
-    p = 1.
-    for e in experiences:
-        buckets = np.array(alpha_prior)
-        pos = e['data'][dependent_joint]
-        for e2 in experiences:
-            pos2 = e2['data'][dependent_joint]
-            buckets[e2['value']] += p_same[dependent_joint][pos][pos2]
-        p *= likelihood([e], buckets)
-    return p
+    return np.exp(log_likelihood_dependent(experiences, dependent_joint,
+                                           p_same, alpha_prior, resolution))
+
+
+def log_likelihood_independent(experiences, alpha_prior):
+    """
+    Compute the log likelihood of the experiences for the dependency model,
+    where no dependency to the current joint exists.
+
+    :param experiences: Experiences made so far (dictionary)
+    :param alpha_prior: The prior over the different joint states
+    :return: The log likelihood of the experiences conditioned on no joint
+             dependency
+    """
+    _, values = _experience_arrays(experiences)
+    buckets = alpha_prior + np.bincount(values,
+                                        minlength=alpha_prior.shape[0])
+    return log_likelihood(experiences, buckets)
 
 
 def likelihood_independent(experiences, alpha_prior):
@@ -87,85 +201,208 @@ def likelihood_independent(experiences, alpha_prior):
     :return: The likelihood of the experiences conditioned on no joint
              dependency
     """
-    buckets = np.array(alpha_prior)
-    for e in experiences:
-        buckets[e['value']] += 1
-    return likelihood(experiences, buckets)
+    return np.exp(log_likelihood_independent(experiences, alpha_prior))
 
 
-def model_posterior(experiences, p_same, alpha_prior, model_prior):
+def log_model_posterior(experiences, p_same, alpha_prior, model_prior,
+                        resolution=1.):
+    """
+    Compute the logarithm of the posterior over the different joint
+    dependency models.
+
+    All likelihoods are kept in log space and normalized with log-sum-exp,
+    so the posterior stays well defined for thousands of experiences, where
+    the plain likelihoods underflow.
+
+    :param experiences: The experiences made so far (list of dictionaries or
+                        `ExperienceHistogram`)
+    :param p_same: The probabilities of two joint positions being in the same
+                   segment. (I.e. no change point in between)
+    :param alpha_prior: The prior over the different joint states
+    :param model_prior: The prior over the different dependency models
+    :param resolution: The size of one bin of p_same in degrees
+    :return: An array with the log probability of every model, ordered as in
+             `model_posterior`. Models without prior mass are -inf.
+    """
+    num_models = model_prior.shape[0]
+    p_same = as_p_same(p_same)
+    histogram = as_histogram(experiences, p_same, alpha_prior.shape[0],
+                             resolution)
+    lnp = np.zeros((num_models,))
+    lnp[-1] = _log_likelihood_counts(histogram.value_counts, alpha_prior)
+    lnp[:-1] = _log_likelihood_dependent(histogram, np.arange(num_models - 1),
+                                         p_same, alpha_prior)
+    with np.errstate(divide='ignore'):
+        lnp += np.log(model_prior)
+    return lnp - logsumexp(lnp)
+
+
+def model_posterior(experiences, p_same, alpha_prior, model_prior,
+                    resolution=1.):
     """
     Compute the posterior over the different joint dependency models.
 
-    :param experiences: The experiences made so far (dictionary)
+    :param experiences: The experiences made so far (list of dictionaries or
+                        `ExperienceHistogram`)
     :param p_same: The probabilities of two joint positions being in the same
                    segment. (I.e. no change point in between)
     :param alpha_prior: The prior over the different joint states
     :param model_prior: The prior over the different dependency models
+    :param resolution: The size of one bin of p_same in degrees
     :return: An array where the each entry gives the probability for the
              according model, where the $n$-th model is that where the $n$-th
              joint (un-) locks the observed joint. The last entry give the
              probability of an independent model.
     """
-    num_models = model_prior.shape[0]
-    _likelihood = np.zeros((model_prior.shape[0],))
-    _likelihood[-1] = model_prior[-1] * likelihood_independent(experiences,
-                                                              alpha_prior)
-    for dep_joint in range(num_models - 1):
-        _likelihood[dep_joint] = model_prior[dep_joint] * \
-                                likelihood_dependent(experiences, dep_joint,
-                                                     p_same, alpha_prior)
-    
-    p = _likelihood/np.sum(_likelihood)
-    return p
+    return np.exp(log_model_posterior(experiences, p_same, alpha_prior,
+                                      model_prior, resolution))
+
+
+def log_model_posterior_grid(experiences, p_same, alpha_priors, model_priors,
+                             resolution=1.):
+    """
+    Compute `log_model_posterior` for every combination of a grid of alpha
+    priors and model priors over the same experiences.
+
+    The likelihoods only depend on the alpha prior, and the gathers of the
+    same-segment probabilities are shared by all alpha priors. The model
+    priors are added in log space, so the whole grid costs little more than
+    a single posterior.
+
+    :param experiences: The experiences made so far (list of dictionaries or
+                        `ExperienceHistogram`)
+    :param p_same: The probabilities of two joint positions being in the same
+                   segment. (I.e. no change point in between)
+    :param alpha_priors: The priors over the different joint states (alpha
+                         priors x values)
+    :param model_priors: The priors over the different dependency models
+                         (model priors x models)
+    :param resolution: The size of one bin of p_same in degrees
+    :return: The log posteriors (alpha priors x model priors x models)
+    """
+    alpha_priors = np.atleast_2d(np.asarray(alpha_priors, dtype=float))
+    model_priors = np.atleast_2d(np.asarray(model_priors, dtype=float))
+    num_models = model_priors.shape[-1]
+    p_same = as_p_same(p_same)
+    histogram = as_histogram(experiences, p_same, alpha_priors.shape[-1],
+                             resolution)
+    log_likelihood = np.zeros((alpha_priors.shape[0], num_models))
+    log_likelihood[:, -1] = _log_likelihood_counts(histogram.value_counts,
+                                                   alpha_priors)
+    log_likelihood[:, :-1] = _log_likelihood_dependent_grid(
+        histogram, np.arange(num_models - 1), p_same, alpha_priors)
+    with np.errstate(divide='ignore'):
+        lnp = log_likelihood[:, None, :] + np.log(model_priors)
+    return lnp - logsumexp(lnp, axis=-1)[..., None]
+
+
+def model_posterior_grid(experiences, p_same, alpha_priors, model_priors,
+                         resolution=1.):
+    """
+    Compute `model_posterior` for every combination of a grid of alpha priors
+    and model priors, see `log_model_posterior_grid`.
 
+    :return: The posteriors (alpha priors x model priors x models)
+    """
+    return np.exp(log_model_posterior_grid(experiences, p_same, alpha_priors,
+                                           model_priors, resolution))
 
-def create_alpha(current_pos, experiences, joint_idx, p_same):
+
+def create_alpha(current_pos, experiences, joint_idx, p_same, resolution=1.):
     """
     Compute the hyperparameters for a Dirichlet distribution given the
     probabilities of the experiences being tin the same segment. (I.e. no
     change point between the current position and the experience)
 
+    The experiences are counted per occupied bin, so the cost depends on the
+    number of occupied bins, not on the number of experiences.
+
     :param current_pos: The current position to compute the hyperparameters for
-    :param experiences: The experiences made so far (dictionary)
+    :param experiences: The experiences made so far (list of dictionaries or
+                        `ExperienceHistogram`)
     :param joint_idx: The joint to compute the hyperparameters for
     :param p_same: The probabilities of two joint states being in the same
                    segment. (I.e. no change point in between)
+    :param resolution: The size of one bin of p_same in degrees
     :return: A vector holding the weighted counts for each value. To be used as
              hyperparameters of a Dirichlet distribution.
     """
-    alpha = np.array([0., 0.])
-
-    for exp_pos, exp_value in [(e['data'][joint_idx], e['value'])
-                               for e in experiences]:
-        p = p_same[exp_pos][current_pos]
-        alpha[exp_value] += p
+    current_bin = to_bins(current_pos, resolution)
+    bins, counts = occupied_bins(experiences, joint_idx, 2, resolution)
+    alpha = np.dot(np.asarray(p_same[current_bin, bins], dtype=float),
+                   counts)
     return alpha
 
 
+def contribution_table(experiences, p_same, num_values=2, resolution=1.):
+    """
+    Compute the hyperparameters of `create_alpha` for every joint and
+    position at once.
+
+    With the table the Dirichlet distribution of `prob_locked` at any joint
+    positions is a lookup per joint and a sum weighted by the model
+    posterior, so it only has to be rebuilt (or updated, see
+    `JointPosterior.table`) once per query instead of once per candidate.
+
+    :param experiences: The experiences made so far (list of dictionaries or
+                        `ExperienceHistogram`)
+    :param p_same: The probabilities of two joint states being in the same
+                   segment. (I.e. no change point in between)
+    :param num_values: The number of different values
+    :param resolution: The size of one bin of p_same in degrees
+    :return: The weighted counts for each joint, position bin and value
+             (joints x positions x values)
+    """
+    p_same = as_p_same(p_same)
+    histogram = as_histogram(experiences, p_same, num_values, resolution)
+    return histogram.contributions(p_same)
+
+
 def prob_locked(experiences, joint_pos, p_same, alpha_prior, model_prior,
-                model_post=None):
+                model_post=None, resolution=1., table=None):
     """
     Computes the Dirichlet distribution over the possible joint state
     distributions.
 
-    :param experiences: The experiences so far
+    The experiences are aggregated into an `ExperienceHistogram` once, which
+    is shared by the model posterior and the hyperparameters of every joint.
+
+    :param experiences: The experiences so far (list of dictionaries or
+                        `ExperienceHistogram`)
     :param joint_pos: The joint positions of all joints (array-like)
     :param p_same: The probability of two joint states being in the same
                    segment. (I.e. no change point in between)
     :param alpha_prior: The prior over the different joint locking states
     :param model_prior: The prior over the different joint dependency models
+    :param model_post: The posterior over the joint dependency models, computed
+                       from the experiences if not given
+    :param resolution: The size of one bin of p_same in degrees
+    :param table: The `contribution_table` of the experiences, if given the
+                  hyperparameters are looked up in it
     :return: A Dirichlet distribution object giving the probability for the
              different locking state distributions
     """
+    # scipy.stats is slow to import and only needed here
+    from scipy.stats import dirichlet
+
     alpha = np.array(alpha_prior)
+    p_same = as_p_same(p_same)
+    if table is None or model_post is None:
+        histogram = as_histogram(experiences, p_same, alpha_prior.shape[0],
+                                 resolution)
     if model_post is None:
-        model_post = model_posterior(experiences, p_same, alpha_prior,
-                                     model_prior)
+        model_post = np.exp(log_model_posterior(histogram, p_same,
+                                                alpha_prior, model_prior,
+                                                resolution))
+    if table is not None:
+        bins = to_bins(joint_pos, resolution)
+        alpha += np.dot(model_post[:len(bins)],
+                        table[np.arange(len(bins)), bins])
+        return dirichlet(alpha)
     for joint_idx, pos in enumerate(joint_pos):
-        c = create_alpha(pos,  experiences,
+        c = create_alpha(pos,  histogram,
                          joint_idx,
-                         p_same[joint_idx])
+                         p_same[joint_idx], resolution)
 
         a = model_post[joint_idx] * c
         if np.min(a) < 0:
@@ -182,16 +419,49 @@ def prob_locked(experiences, joint_pos, p_same, alpha_prior, model_prior,
     return d
 
 
-def random_objective(exp, joint_pos, p_same, alpha_prior, model_prior):
+def random_objective(exp, joint_pos, p_same, alpha_prior, model_prior,
+                     model_post=None, idx_last_successes=None,
+                     idx_next_joint=None, idx_last_failures=None,
+                     world=None, use_joint_positions=False):
     return np.random.uniform()
 
 
+def heuristic_proximity(exp, joint_pos, p_same, alpha_prior, model_prior,
+                        model_post=None, idx_last_successes=None,
+                        idx_next_joint=None, idx_last_failures=None,
+                        world=None, use_joint_positions=False):
+    if not idx_last_successes:
+        return np.random.uniform()
+
+    if not idx_last_failures:
+        idx_last_failures = []
+
+    if use_joint_positions:
+        distance = np.linalg.norm(
+            world.joints[idx_last_successes[-1]].position -
+            world.joints[idx_next_joint].position)
+    else:
+        distance = abs(idx_last_successes[-1] - idx_next_joint)
+
+    if (idx_next_joint not in idx_last_failures and
+            idx_next_joint not in idx_last_successes):
+        return -distance  # distance between next joint and last joint
+    else:
+        return -np.inf
+
+
 def exp_cross_entropy(experiences, joint_pos, p_same, alpha_prior, model_prior,
-                      model_post=None):
+                      model_post=None, idx_last_successes=None,
+                      idx_next_joint=None, idx_last_failures=None,
+                      world=None, use_joint_positions=False,
+                      joint_posterior=None, resolution=1.):
     """
     Compute the expected cross entropy between the current and the augmented
     model posterior, if we would make the next experience at joint_pos.
 
+    The candidate is scored in closed form by `exp_cross_entropy_batch`,
+    without building a frozen Dirichlet distribution or augmented experiences.
+
     :param experiences: The experiences made so far (dictionary)
     :param joint_pos: The positions of all joints (array-like), where the
                     expected cross entropy should be computed.
@@ -199,46 +469,217 @@ def exp_cross_entropy(experiences, joint_pos, p_same, alpha_prior, model_prior,
                    segment. (I.e. no change point in between)
     :param alpha_prior: The prior over the different joint locking states
     :param model_prior: The prior over the different joint dependency models
+    :param joint_posterior: The `JointPosterior` of the experiences, if
+                            already available
+    :param resolution: The size of one bin of p_same in degrees
     :return: The expected cross entropy (float)
     """
-    ce = 0.
+    return exp_cross_entropy_batch(experiences, np.atleast_2d(joint_pos),
+                                   p_same, alpha_prior, model_prior,
+                                   model_post, joint_posterior, resolution)[0]
+
+
+def exp_neg_entropy(experiences, joint_pos, p_same, alpha_prior, model_prior,
+                    model_post=None, idx_last_successes=None,
+                    idx_next_joint=None, idx_last_failures=None,
+                    world=None, use_joint_positions=False,
+                    joint_posterior=None, resolution=1.):
+    return exp_neg_entropy_batch(experiences, np.atleast_2d(joint_pos),
+                                 p_same, alpha_prior, model_prior,
+                                 model_post, joint_posterior, resolution)[0]
+
+
+def dirichlet_mean(alpha, out=None):
+    """
+    Compute the mean of Dirichlet distributions in closed form, i.e. what the
+    `mean()` of the distribution of `prob_locked` returns, without creating
+    the frozen distribution.
+
+    :param alpha: The hyperparameters (... x values)
+    :param out: The array to write the means to (same shape as alpha)
+    :return: The means (... x values)
+    """
+    return np.divide(alpha, np.sum(alpha, axis=-1)[..., None], out=out)
+
+
+def _expected_values(model_post, alpha_prior, counts):
+    """
+    Compute the mean of the Dirichlet distribution of `prob_locked` for every
+    candidate from the same-segment weighted counts of `JointPosterior.augment`.
+    """
+    alpha = np.einsum('j,jcv->cv', model_post[:-1], counts)
+    alpha += alpha_prior
+    return dirichlet_mean(alpha, out=alpha)
+
+
+def _expected_kl(probs, model_post, log_post, augmented, out=None):
+    """
+    Compute the expected KL divergence between the current and the augmented
+    model posteriors in closed form.
+
+    On the support S of the current posterior p, the divergence to the
+    augmented posterior q of an outcome is sum_S p log p - sum_S p log q, so
+    a single product of the augmented log posteriors with p is needed.
+
+    :param probs: The probabilities of the outcomes (candidates x values)
+    :param model_post: The current posterior p (models)
+    :param log_post: The logarithm of p (models)
+    :param augmented: The augmented log posteriors (candidates x values x
+                      models)
+    :param out: The array to write the results to (candidates)
+    :return: The expected KL divergence of every candidate (candidates)
+    """
+    support = model_post > 0
+    kl = np.dot(augmented[..., support], model_post[support])
+    np.subtract(np.dot(model_post[support], log_post[support]), kl, out=kl)
+    return np.einsum('cv,cv->c', probs, kl, out=out)
+
+
+def _expected_entropy(probs, augmented, out=None):
+    """
+    Compute the expected entropy of the augmented model posteriors in closed
+    form. Models with a log probability of -inf do not contribute.
+
+    :param probs: The probabilities of the outcomes (candidates x values)
+    :param augmented: The augmented log posteriors (candidates x values x
+                      models)
+    :param out: The array to write the results to (candidates)
+    :return: The expected entropy of every candidate (candidates)
+    """
+    log_q = np.maximum(augmented, np.finfo(augmented.dtype).min)
+    q = np.exp(log_q)
+    q *= log_q
+    neg_entropy = np.sum(q, axis=-1)
+    out = np.einsum('cv,cv->c', probs, neg_entropy, out=out)
+    return np.negative(out, out=out)
+
+
+def exp_cross_entropy_batch(experiences, joint_positions, p_same, alpha_prior,
+                            model_prior, model_post=None,
+                            joint_posterior=None, resolution=1., out=None):
+    """
+    Compute the expected cross entropy of `exp_cross_entropy` for a whole
+    matrix of candidates at once.
+
+    The Dirichlet means, the entropies and the KL divergences are computed in
+    closed form on the arrays of all candidates, no objects are created per
+    candidate.
+
+    :param experiences: The experiences made so far (dictionary)
+    :param joint_positions: The positions of all joints for every candidate
+                            (candidates x joints)
+    :param p_same: The probability of two joint states being in the same
+                   segment. (I.e. no change point in between)
+    :param alpha_prior: The prior over the different joint locking states
+    :param model_prior: The prior over the different joint dependency models
+    :param joint_posterior: The `JointPosterior` of the experiences, if
+                            already available
+    :param resolution: The size of one bin of p_same in degrees
+    :param out: A preallocated array to write the values to (candidates)
+    :return: The expected cross entropy of every candidate (array)
+    """
+    if joint_posterior is None:
+        joint_posterior = JointPosterior(p_same, alpha_prior, model_prior,
+                                         experiences, resolution)
+    augmented, counts = joint_posterior.augment(
+        np.atleast_2d(joint_positions))
 
     if model_post is None:
-        model_post = model_posterior(experiences,
-                                     p_same, alpha_prior,
-                                     model_prior)
+        log_post = joint_posterior.log_posterior
+        model_post = np.exp(log_post)
+    else:
+        with np.errstate(divide='ignore'):
+            log_post = np.log(model_post)
 
-    output_likelihood = prob_locked(experiences, joint_pos, p_same,
-                                    alpha_prior, model_prior,
-                                    model_post=model_post)
+    probs = _expected_values(model_post, alpha_prior, counts)
+    return _expected_kl(probs, model_post, log_post, augmented, out)
 
-    for i, prob in enumerate(output_likelihood.mean()):
-        exp = {'data': joint_pos, 'value': i}
-        
-        augmented_exp = list(experiences)  # copy the list!
-        augmented_exp.append(exp)  # add the 'new' experience
 
-        augmented_post = model_posterior(augmented_exp, p_same, alpha_prior,
-                                         model_prior)
+def exp_neg_entropy_batch(experiences, joint_positions, p_same, alpha_prior,
+                          model_prior, model_post=None, joint_posterior=None,
+                          resolution=1., out=None):
+    """
+    Compute the expected negative entropy of `exp_neg_entropy` for a whole
+    matrix of candidates at once, in closed form like
+    `exp_cross_entropy_batch`.
 
-        ce += prob * entropy(model_post, augmented_post)
-    return ce
+    :param experiences: The experiences made so far (dictionary)
+    :param joint_positions: The positions of all joints for every candidate
+                            (candidates x joints)
+    :param p_same: The probability of two joint states being in the same
+                   segment. (I.e. no change point in between)
+    :param alpha_prior: The prior over the different joint locking states
+    :param model_prior: The prior over the different joint dependency models
+    :param joint_posterior: The `JointPosterior` of the experiences, if
+                            already available
+    :param resolution: The size of one bin of p_same in degrees
+    :param out: A preallocated array to write the values to (candidates)
+    :return: The expected negative entropy of every candidate (array)
+    """
+    if joint_posterior is None:
+        joint_posterior = JointPosterior(p_same, alpha_prior, model_prior,
+                                         experiences, resolution)
+    augmented, counts = joint_posterior.augment(
+        np.atleast_2d(joint_positions))
 
+    if model_post is None:
+        model_post = joint_posterior.posterior
 
-def exp_neg_entropy(experiences, joint_pos, p_same, alpha_prior, model_prior):
-    ce = 0.
+    probs = _expected_values(model_post, alpha_prior, counts)
+    out = _expected_entropy(probs, augmented, out)
+    return np.negative(out, out=out)
 
-    output_likelihood = prob_locked(experiences, joint_pos, p_same,
-                                    alpha_prior, model_prior)
 
-    for i, prob in enumerate(output_likelihood.mean()):
-        exp = {'data': joint_pos, 'value': i}
+def exp_cross_entropy_all_joints(joint_posteriors, joint_positions,
+                                 alpha_prior, out=None):
+    """
+    Compute the expected cross entropy of `exp_cross_entropy` for a whole
+    matrix of candidates and every checked joint at once.
 
-        augmented_exp = list(experiences)  # copy the list!
-        augmented_exp.append(exp)  # add the 'new' experience
+    The augmented posteriors of all checked joints are computed in one pass
+    by `augment_all`, which shares the work on the candidates.
 
-        augmented_post = model_posterior(augmented_exp, p_same, alpha_prior,
-                                         model_prior)
+    :param joint_posteriors: The `JointPosterior` of every checked joint
+    :param joint_positions: The positions of all joints for every candidate
+                            (candidates x joints)
+    :param alpha_prior: The prior over the different joint locking states
+    :param out: A preallocated array to write the values to (checked joints
+                x candidates)
+    :return: The expected cross entropy of every candidate for every checked
+             joint (checked joints x candidates)
+    """
+    augmented, counts = augment_all(joint_posteriors, joint_positions)
+    if out is None:
+        out = np.empty(augmented.shape[:2])
+    for k, joint_posterior in enumerate(joint_posteriors):
+        log_post = joint_posterior.log_posterior
+        model_post = np.exp(log_post)
+        probs = _expected_values(model_post, alpha_prior, counts[k])
+        _expected_kl(probs, model_post, log_post, augmented[k], out[k])
+    return out
+
+
+def exp_neg_entropy_all_joints(joint_posteriors, joint_positions, alpha_prior,
+                               out=None):
+    """
+    Compute the expected negative entropy of `exp_neg_entropy` for a whole
+    matrix of candidates and every checked joint at once, like
+    `exp_cross_entropy_all_joints`.
 
-        ce += prob * entropy(augmented_post)
-    return -ce
+    :param joint_posteriors: The `JointPosterior` of every checked joint
+    :param joint_positions: The positions of all joints for every candidate
+                            (candidates x joints)
+    :param alpha_prior: The prior over the different joint locking states
+    :param out: A preallocated array to write the values to (checked joints
+                x candidates)
+    :return: The expected negative entropy of every candidate for every
+             checked joint (checked joints x candidates)
+    """
+    augmented, counts = augment_all(joint_posteriors, joint_positions)
+    if out is None:
+        out = np.empty(augmented.shape[:2])
+    for k, joint_posterior in enumerate(joint_posteriors):
+        probs = _expected_values(joint_posterior.posterior, alpha_prior,
+                                 counts[k])
+        _expected_entropy(probs, augmented[k], out[k])
+    return np.negative(out, out=out)
@@ -0,0 +1,596 @@
+# coding: utf-8
+
+from __future__ import division
+import numpy as np
+
+from scipy.special import gammaln, logsumexp
+
+from joint_dependency.buffer import ExperienceBuffer
+from joint_dependency.histogram import ExperienceHistogram
+from joint_dependency.psame import as_p_same
+from joint_dependency.utils import to_bins
+
+
+class JointPosterior(object):
+    """
+    The posterior over the dependency models of a single joint, which is
+    updated incrementally while experiences are added.
+
+    For every dependency model the object keeps the pairwise bucket sums
+    `sums[d, i, k] = sum_j p_same[d][pos_i, pos_j] * [value_j == k]`, i.e. the
+    buckets of every experience without the alpha prior. Appending an
+    experience adds one row and one column to these sums, which is linear in
+    the number of experiences instead of the quadratic rebuild done by
+    `model_posterior`.
+
+    It also keeps the contribution table
+    `table[j, b, k] = sum_i p_same[j][b, pos_ij] * [value_i == k]`, i.e.
+    `create_alpha` for every joint and position. Appending an experience
+    adds one row of p_same per joint to it, and the counts of a candidate
+    are a lookup in it.
+
+    With many joints the dependency models can be pruned: only the models in
+    `models` are tracked, the others have a posterior of zero. See
+    `select_models` for choosing and re-admitting them.
+
+    The bucket sums and the arrays of the candidates in `augment` are in the
+    precision of p_same, i.e. single precision for a float32 p_same. The log
+    likelihoods and the posteriors are accumulated in double precision. The
+    experiences themselves are kept in an `ExperienceBuffer`, i.e. as int16
+    bins and uint8 values.
+    """
+    def __init__(self, p_same, alpha_prior, model_prior, experiences=None,
+                 resolution=1., models=None):
+        """
+        :param p_same: The probabilities of two joint positions being in the
+                       same segment (joints x positions x positions, dense or
+                       `PSame`)
+        :param alpha_prior: The prior over the different joint states
+        :param model_prior: The prior over the different dependency models of
+                            this joint
+        :param experiences: Experiences of this joint to start with
+        :param resolution: The size of one bin of p_same in degrees
+        :param models: The dependency models to track, i.e. the indices of
+                       their locking joints (default: all)
+        """
+        self.p_same = as_p_same(p_same)
+        self.alpha_prior = np.asarray(alpha_prior, dtype=float)
+        self.model_prior = np.asarray(model_prior, dtype=float)
+        self.resolution = resolution
+        self.dtype = np.dtype(self.p_same.dtype)
+        # the alpha prior in the precision of the buckets
+        self._alpha = self.alpha_prior.astype(self.dtype)
+
+        self.num_joints = self.model_prior.shape[0] - 1
+        self.num_values = self.alpha_prior.shape[0]
+        self.num_experiences = 0
+
+        if models is None:
+            models = np.arange(self.num_joints)
+        self.models = np.unique(np.asarray(models, dtype=int))
+        # the posterior mass of the models which are not tracked, when they
+        # were last evaluated by `select_models`
+        self.pruned_mass = 0.
+
+        self._experiences = ExperienceBuffer(self.num_joints, resolution)
+        self._sums = np.zeros((self.models.shape[0], 0, self.num_values),
+                              dtype=self.dtype)
+        self._histogram = ExperienceHistogram(
+            self.num_joints, self.p_same.shape[-1], self.num_values,
+            resolution)
+        self._counts = np.zeros((self.num_values,))
+        self._table = np.zeros((self.num_joints, self.p_same.shape[-1],
+                                self.num_values), dtype=self.dtype)
+        self._log_posterior = None
+
+        if experiences is not None:
+            self.update(experiences)
+
+    @property
+    def positions(self):
+        """
+        The bins of the joint positions of all experiences (int16).
+        """
+        return self._experiences.bins
+
+    @property
+    def values(self):
+        """
+        The observed values of all experiences (uint8).
+        """
+        return self._experiences.values
+
+    @property
+    def sums(self):
+        """
+        The bucket sums of the tracked models (models x experiences x
+        values).
+        """
+        return self._sums[:, :self.num_experiences]
+
+    @property
+    def table(self):
+        """
+        The contribution table of the experiences (joints x positions x
+        values), see `contribution_table`.
+        """
+        return self._table
+
+    def _reserve(self, n):
+        capacity = self._sums.shape[1]
+        if n <= capacity:
+            return
+        capacity = max(n, 2 * capacity, 16)
+
+        sums = np.zeros((self.models.shape[0], capacity, self.num_values),
+                        dtype=self.dtype)
+        sums[:, :self.num_experiences] = self.sums
+        self._sums = sums
+
+    def append(self, experience):
+        """
+        Add a new experience and update the bucket sums of the tracked
+        dependency models.
+
+        :param experience: The new experience (dictionary)
+        """
+        self.extend([experience])
+
+    def extend(self, experiences):
+        """
+        Add several new experiences and update the bucket sums of the
+        tracked dependency models.
+
+        :param experiences: The new experiences (list of dictionaries or
+                            `ExperienceBuffer`)
+        """
+        if len(experiences) == 0:
+            return
+        n = self.num_experiences
+        self._experiences.extend(experiences)
+        positions, new_pos = self.positions[:n], self.positions[n:]
+        values, new_values = self.values[:n], self.values[n:]
+        m = new_values.shape[0]
+        self._reserve(n + m)
+        joints = self.models[:, None, None]
+        new_bins = new_pos.T[self.models]
+        onehot = np.eye(self.num_values, dtype=self.dtype)
+
+        # the same-segment probabilities of the new experiences to all
+        # experiences made so far (models x m x n) and among each other
+        # (models x m x m)
+        cross = self.p_same[joints, new_bins[:, :, None],
+                            positions.T[self.models][:, None, :]]
+        inner = self.p_same[joints, new_bins[:, :, None],
+                            new_bins[:, None, :]]
+        self._sums[:, :n] += np.dot(cross.transpose(0, 2, 1),
+                                    onehot[new_values])
+        self._sums[:, n:n + m] = (np.dot(cross, onehot[values]) +
+                                  np.dot(inner, onehot[new_values]))
+
+        # the new experiences as a view of the buffer, so they are binned
+        # only once
+        new = self._experiences[n:]
+        self._table += ExperienceHistogram(
+            self.num_joints, self._table.shape[1], self.num_values,
+            self.resolution, new).contributions(self.p_same, self.models)
+        self._histogram.extend(new)
+
+        self._counts += np.bincount(new_values, minlength=self.num_values)
+        self.num_experiences += m
+        self._log_posterior = None
+
+    def update(self, experiences):
+        """
+        Append all experiences of an append-only list that were not added yet.
+
+        :param experiences: All experiences made so far for this joint
+        """
+        self.extend(experiences[self.num_experiences:])
+
+    def log_likelihood_dependent(self):
+        """
+        :return: The log likelihood of the experiences for every tracked
+                 dependency model
+        """
+        n = np.arange(self.num_experiences)
+        buckets = self._alpha + self.sums
+        return np.sum(np.log(buckets[:, n, self.values]) -
+                      np.log(np.sum(buckets, axis=-1)), axis=-1,
+                      dtype=np.float64)
+
+    def log_likelihood_independent(self):
+        """
+        :return: The log likelihood of the experiences for the model without
+                 a dependency
+        """
+        return _log_likelihood_counts(self._counts, self.alpha_prior)
+
+    @property
+    def log_posterior(self):
+        """
+        The logarithm of the posterior over the different dependency models,
+        see `log_model_posterior`.
+        """
+        if self._log_posterior is None:
+            lnp = np.full(self.model_prior.shape, -np.inf)
+            lnp[-1] = self.log_likelihood_independent()
+            lnp[self.models] = self.log_likelihood_dependent()
+            with np.errstate(divide='ignore'):
+                lnp += np.log(self.model_prior)
+            self._log_posterior = lnp - logsumexp(lnp)
+        return self._log_posterior
+
+    @property
+    def posterior(self):
+        """
+        The posterior over the different dependency models, see
+        `model_posterior`.
+        """
+        return np.exp(self.log_posterior)
+
+    def select_models(self, top_k=None, threshold=None):
+        """
+        Choose the tracked dependency models from the exact posterior of all
+        models.
+
+        The models which are not tracked are evaluated on the occupied bins
+        of the experiences, so models whose posterior grew since they were
+        pruned are re-admitted. Without experiences the posterior is the
+        prior, i.e. the first selection is by prior.
+
+        The tracked posterior is the full posterior restricted to the tracked
+        models and renormalized, so its total variation distance to the full
+        posterior is `pruned_mass`. This is exact when the models are selected
+        and is not updated in between.
+
+        :param top_k: Track at most the k most probable models
+        :param threshold: Track only models with a posterior of at least
+                          `threshold`
+        :return: The full posterior over all models
+        """
+        untracked = np.setdiff1d(np.arange(self.num_joints), self.models)
+        lnp = np.full(self.model_prior.shape, -np.inf)
+        lnp[-1] = self.log_likelihood_independent()
+        lnp[self.models] = self.log_likelihood_dependent()
+        lnp[untracked] = self._histogram.log_likelihood_dependent(
+            self.p_same, self.alpha_prior, untracked)
+        with np.errstate(divide='ignore'):
+            lnp += np.log(self.model_prior)
+        posterior = np.exp(lnp - logsumexp(lnp))
+
+        dependent = posterior[:-1]
+        keep = dependent > 0
+        if threshold is not None:
+            keep &= dependent >= threshold
+        if top_k is not None:
+            top = np.zeros(keep.shape, dtype=bool)
+            top[np.argsort(-dependent, kind='mergesort')[:top_k]] = True
+            keep &= top
+        self.pruned_mass = np.sum(dependent[~keep])
+        self._track(np.flatnonzero(keep))
+        return posterior
+
+    def _track(self, models):
+        """
+        Track another set of dependency models. The bucket sums and the
+        contribution table of models which were tracked before are kept, the
+        ones of new models are computed from the experiences.
+        """
+        n = self.num_experiences
+        kept = np.isin(models, self.models)
+        added = models[~kept]
+        onehot = np.eye(self.num_values, dtype=self.dtype)
+
+        sums = np.zeros((models.shape[0],) + self._sums.shape[1:],
+                        dtype=self.dtype)
+        sums[kept] = self._sums[np.searchsorted(self.models, models[kept])]
+        if n > 0 and added.shape[0] > 0:
+            bins = self.positions.T[added]
+            pairs = self.p_same[added[:, None, None], bins[:, :, None],
+                                bins[:, None, :]]
+            sums[~kept, :n] = np.dot(pairs, onehot[self.values])
+
+        table = np.zeros_like(self._table)
+        table[models[kept]] = self._table[models[kept]]
+        table += self._histogram.contributions(self.p_same, added)
+
+        self.models, self._sums, self._table = models, sums, table
+        self._log_posterior = None
+
+    def log_sums(self, candidates):
+        """
+        Compute the sums over the experiences of the log buckets of their
+        observed values and of the log sums of their buckets, after adding a
+        candidate to the bucket sums of every tracked model.
+
+        :param candidates: The bins of the candidates at the tracked models
+                           (models x candidates)
+        :return: A tuple of the sums of the observed log buckets if the
+                 candidate has a value (values x models x candidates) and of
+                 the log sums of the buckets (models x candidates), in double
+                 precision
+        """
+        buckets = self._alpha + self.sums
+        observed = buckets[:, np.arange(self.num_experiences), self.values]
+        total = np.sum(buckets, axis=-1)
+
+        # the same-segment probabilities of the candidates to all
+        # experiences (models x candidates x N)
+        rows = self.p_same[self.models[:, None, None], candidates[:, :, None],
+                           self.positions.T[self.models][:, None, :]]
+        log_total = np.sum(np.log(total[:, None, :] + rows), axis=-1,
+                           dtype=np.float64)
+        log_observed = np.array([
+            np.sum(np.log(observed[:, None, :] + rows * (self.values == value)),
+                   axis=-1, dtype=np.float64)
+            for value in range(self.num_values)])
+        return log_observed, log_total
+
+    def augment(self, joint_positions, log_sums=None):
+        """
+        Compute the log posterior after adding one more experience at
+        `joint_positions`, for every value this experience could have,
+        without adding it.
+
+        The new experience only adds one row and one column to the bucket
+        sums, so this is O(N) per candidate, instead of the O(N^2) of
+        rebuilding the posterior from the augmented experiences.
+
+        :param joint_positions: The positions of all joints (joints) or of
+                                several candidates (candidates x joints)
+        :param log_sums: A function of the posterior and the candidates which
+                         computes the sums over the experiences like
+                         `JointPosterior.log_sums` (the default), e.g. a
+                         compiled kernel
+        :return: A tuple of the augmented log posteriors (values x models,
+                 or candidates x values x models) and the same-segment
+                 weighted counts of the experiences at the positions of every
+                 joint (joints x values, or joints x candidates x values),
+                 i.e. what `create_alpha` computes, looked up in the
+                 contribution table
+        """
+        if log_sums is None:
+            log_sums = JointPosterior.log_sums
+        joint_positions = to_bins(joint_positions, self.resolution)
+        single = joint_positions.ndim == 1
+        candidates = np.atleast_2d(joint_positions).T
+        tracked = candidates[self.models]
+        onehot = np.eye(self.num_values, dtype=self.dtype)
+
+        log_observed, log_total = log_sums(self, tracked)
+        diagonal = self.p_same[self.models[:, None], tracked, tracked]
+        counts = self._table[np.arange(self.num_joints)[:, None], candidates]
+
+        augmented = np.full((candidates.shape[1], self.num_values,
+                             self.model_prior.shape[0]), -np.inf)
+        for value in range(self.num_values):
+            new_buckets = self._alpha + counts[self.models]
+            new_buckets[..., value] += diagonal
+            lnp = (log_observed[value] - log_total +
+                   np.log(new_buckets[..., value]) -
+                   np.log(np.sum(new_buckets, axis=-1)))
+            augmented[:, value, self.models] = lnp.T
+            augmented[:, value, -1] = _log_likelihood_counts(
+                self._counts + onehot[value], self.alpha_prior)
+        with np.errstate(divide='ignore'):
+            augmented += np.log(self.model_prior)
+        augmented -= logsumexp(augmented, axis=-1)[..., None]
+
+        if single:
+            return augmented[0], counts[:, 0]
+        return augmented, counts
+
+    def augmented_log_posterior(self, joint_positions):
+        """
+        Compute the log posterior for both outcomes of a new experience at
+        `joint_positions`, see `augment`.
+
+        :param joint_positions: The positions of all joints (joints) or of
+                                several candidates (candidates x joints)
+        :return: The augmented log posteriors (values x models, or candidates
+                 x values x models)
+        """
+        return self.augment(joint_positions)[0]
+
+
+def augment_all(joint_posteriors, joint_positions):
+    """
+    Compute `JointPosterior.augment` for the posteriors of all checked joints
+    at once.
+
+    The candidates are the same for every checked joint, so their bins and
+    their same-segment probabilities to themselves are computed once. The
+    probabilities to the experiences of all checked joints are gathered in a
+    single pass over the concatenated experiences and summed per checked
+    joint with one matrix product. The posteriors may track different
+    dependency models, the union of them is computed.
+
+    :param joint_posteriors: The `JointPosterior` of every checked joint, all
+                             built on the same p_same
+    :param joint_positions: The positions of all joints of every candidate
+                            (candidates x joints)
+    :return: A tuple of the augmented log posteriors (checked joints x
+             candidates x values x models) and the same-segment weighted
+             counts (checked joints x joints x candidates x values)
+    """
+    first = joint_posteriors[0]
+    models = np.unique(np.concatenate([jp.models for jp in joint_posteriors]))
+    candidates = to_bins(np.atleast_2d(joint_positions), first.resolution).T
+    onehot = np.eye(first.num_values, dtype=first.dtype)
+
+    # the experiences of all checked joints one after the other, and the
+    # matrix summing the terms of the experiences of every checked joint
+    positions = np.concatenate([jp.positions for jp in joint_posteriors])
+    values = np.concatenate([jp.values for jp in joint_posteriors])
+    segments = np.repeat(np.eye(len(joint_posteriors)),
+                         [jp.num_experiences for jp in joint_posteriors],
+                         axis=0)
+    # the models a posterior does not track get neutral buckets, their
+    # augmented posteriors are masked out below
+    tracked = np.zeros((len(joint_posteriors), models.shape[0]), dtype=bool)
+    observed = []
+    total = []
+    for k, jp in enumerate(joint_posteriors):
+        idx = np.searchsorted(models, jp.models)
+        tracked[k, idx] = True
+        buckets = jp._alpha + jp.sums
+        observed.append(np.ones((models.shape[0], jp.num_experiences),
+                                dtype=first.dtype))
+        observed[-1][idx] = buckets[:, np.arange(jp.num_experiences),
+                                    jp.values]
+        total.append(np.ones_like(observed[-1]))
+        total[-1][idx] = np.sum(buckets, axis=-1)
+    observed = np.concatenate(observed, axis=1)
+    total = np.concatenate(total, axis=1)
+
+    bins = candidates[models]
+    rows = first.p_same[models[:, None, None], bins[:, :, None],
+                        positions.T[models][:, None, :]]
+    diagonal = first.p_same[models[:, None], bins, bins]
+    counts = np.array([jp.table[np.arange(first.num_joints)[:, None],
+                                candidates]
+                       for jp in joint_posteriors])
+
+    augmented = np.full((len(joint_posteriors), candidates.shape[1],
+                         first.num_values, first.model_prior.shape[0]),
+                        -np.inf)
+    log_total = np.dot(np.log(total[:, None, :] + rows), segments)
+    for value in range(first.num_values):
+        hit = values == value
+        new_buckets = first._alpha + counts[:, models]
+        new_buckets[..., value] += diagonal
+        lnp = np.dot(np.log(observed[:, None, :] + rows * hit), segments)
+        lnp -= log_total
+        lnp = (lnp.transpose(2, 0, 1) + np.log(new_buckets[..., value]) -
+               np.log(np.sum(new_buckets, axis=-1)))
+        lnp[~tracked] = -np.inf
+        augmented[:, :, value, models] = lnp.transpose(0, 2, 1)
+        for k, jp in enumerate(joint_posteriors):
+            augmented[k, :, value, -1] = _log_likelihood_counts(
+                jp._counts + onehot[value], jp.alpha_prior)
+    with np.errstate(divide='ignore'):
+        augmented += np.log([jp.model_prior
+                             for jp in joint_posteriors])[:, None, None, :]
+    augmented -= logsumexp(augmented, axis=-1)[..., None]
+    return augmented, counts
+
+
+def _log_likelihood_counts(counts, alpha_prior):
+    """
+    Compute the log likelihood of the independent model from the counts of
+    the values, see `log_likelihood_independent`. Several alpha priors
+    (priors x values) give one log likelihood each.
+    """
+    buckets = alpha_prior + counts
+    A = np.sum(buckets, axis=-1)
+    return (gammaln(A) - gammaln(np.sum(counts, axis=-1) + A) +
+            np.sum(gammaln(counts + buckets) - gammaln(buckets), axis=-1))
+
+
+class PosteriorCache(object):
+    """
+    Keeps the p_same tensor and the `JointPosterior` of every joint of a run,
+    so that they are computed once and shared by all candidate evaluations
+    and `calc_posteriors`.
+
+    The p_same tensor is rebuilt when a different list of p_same matrices is
+    passed. A joint posterior is updated incrementally as long as its
+    experiences are the same append-only list, and rebuilt otherwise.
+
+    With `top_k` or `threshold` the joint posteriors only track some of their
+    dependency models, which makes the updates linear in the number of
+    tracked models instead of the number of joints. The models are selected
+    by prior first, and by the exact posterior after every `recheck` new
+    experiences of a joint (see `JointPosterior.select_models`).
+    """
+    def __init__(self, alpha_prior, model_prior, resolution=1., top_k=None,
+                 threshold=None, recheck=10):
+        """
+        :param alpha_prior: The prior over the different joint states
+        :param model_prior: The prior over the different dependency models of
+                            every joint (joints x models)
+        :param resolution: The size of one bin of p_same in degrees
+        :param top_k: Track at most the k most probable dependency models of
+                      every joint (default: all)
+        :param threshold: Track only the dependency models with a posterior
+                          of at least `threshold`
+        :param recheck: The number of new experiences of a joint after which
+                        its models are selected again
+        """
+        self.alpha_prior = alpha_prior
+        self.model_prior = model_prior
+        self.resolution = resolution
+        self.top_k = top_k
+        self.threshold = threshold
+        self.recheck = recheck
+        self._p_same_source = None
+        self._p_same = None
+        self._posteriors = {}
+        self._experiences = {}
+        self._selected_at = {}
+
+    @property
+    def pruning(self):
+        return self.top_k is not None or self.threshold is not None
+
+    def p_same(self, p_same):
+        """
+        :param p_same: The probabilities of two joint positions being in the
+                       same segment (`PSame`, list of matrices or tensor)
+        :return: The p_same tensor (joints x positions x positions) or the
+                 `PSame`
+        """
+        if p_same is not self._p_same_source:
+            self._p_same_source = p_same
+            self._p_same = as_p_same(p_same)
+            self._posteriors = {}
+            self._experiences = {}
+            self._selected_at = {}
+        return self._p_same
+
+    def joint_posterior(self, joint_idx, experiences, p_same=None):
+        """
+        :param joint_idx: The joint to get the posterior for
+        :param experiences: The experiences made so far for this joint
+        :param p_same: The probabilities of two joint positions being in the
+                       same segment, if it might have changed since the last
+                       call
+        :return: The `JointPosterior` of the joint, up to date with the
+                 experiences
+        """
+        if p_same is not None:
+            self.p_same(p_same)
+        posterior = self._posteriors.get(joint_idx)
+        if (posterior is None or
+                self._experiences[joint_idx] is not experiences or
+                posterior.num_experiences > len(experiences)):
+            # with pruning no model is tracked until the first selection
+            posterior = JointPosterior(self._p_same, self.alpha_prior,
+                                       self.model_prior[joint_idx],
+                                       resolution=self.resolution,
+                                       models=[] if self.pruning else None)
+            self._posteriors[joint_idx] = posterior
+            self._experiences[joint_idx] = experiences
+            self._selected_at[joint_idx] = None
+        posterior.update(experiences)
+
+        selected_at = self._selected_at[joint_idx]
+        if self.pruning and (selected_at is None or
+                             posterior.num_experiences >=
+                             selected_at + self.recheck):
+            posterior.select_models(self.top_k, self.threshold)
+            self._selected_at[joint_idx] = posterior.num_experiences
+        return posterior
+
+    def joint_posteriors(self, experiences, p_same=None):
+        """
+        :param experiences: The experiences made so far for every joint
+        :param p_same: The probabilities of two joint positions being in the
+                       same segment, if it might have changed since the last
+                       call
+        :return: The `JointPosterior` of every joint, up to date with the
+                 experiences
+        """
+        return [self.joint_posterior(joint_idx, joint_experiences, p_same)
+                for joint_idx, joint_experiences in enumerate(experiences)]
@@ -0,0 +1,212 @@
+# coding: utf-8
+
+from __future__ import division
+import numpy as np
+
+
+# the absolute tolerance of posteriors and objective values computed in single
+# precision against double precision, for up to a few thousand experiences
+SINGLE_PRECISION_ATOL = 1e-4
+
+
+def _cumulative_log(probabilities):
+    """
+    Compute the cumulative log probabilities of no change point from the
+    first position to every position.
+
+    Change points with probability one would make the logarithm -inf, so they
+    are counted separately instead.
+
+    :param probabilities: The change point probabilities for each position
+    :return: A tuple of the cumulative sums of log(1 - p) and the cumulative
+             number of certain change points (both of the length of
+             `probabilities`)
+    """
+    q = 1 - np.asarray(probabilities, dtype=float)
+    certain = q <= 0
+    log_q = np.log(np.where(certain, 1., q))
+
+    n = q.shape[0]
+    log_prod = np.zeros((n,))
+    log_prod[1:] = np.cumsum(log_q[:-1])
+    num_certain = np.zeros((n,), dtype=int)
+    num_certain[1:] = np.cumsum(certain[:-1])
+    return log_prod, num_certain
+
+
+def _is_all(index):
+    return isinstance(index, slice) and index == slice(None)
+
+
+class PSame(object):
+    """
+    The probabilities of two joint positions being in the same segment,
+    stored implicitly.
+
+    `p_same[j, s, t]` is the product of `1 - p_cp[j]` between s and t, i.e.
+    the ratio of the cumulative products at t and s. Only the cumulative
+    log vectors are stored, which is linear instead of quadratic in the
+    number of positions, and the probabilities are computed on demand.
+    Joints with identical change point probabilities (e.g. the default prior)
+    share their vectors.
+
+    With `dtype=np.float32` the vectors and all probabilities computed from
+    them are single precision, and so are the buckets of a `JointPosterior`
+    built on them. The relative error of a single probability is about the
+    float32 epsilon times the cumulative log at that position, the posteriors
+    and objective values stay within `SINGLE_PRECISION_ATOL` of the double
+    precision results.
+
+    The object is indexed like the dense (joints x positions x positions)
+    array:
+
+    - `p_same[j]` is a lazy (positions x positions) view of one joint
+    - `p_same[j, s]` (or `p_same[j][s]`) is the row of position s
+    - `p_same[j, s, t]` with integers or broadcastable index arrays gathers
+      single entries
+
+    `np.asarray(p_same)` builds the dense array.
+    """
+    def __init__(self, p_cp, dtype=np.float64):
+        """
+        :param p_cp: The change point probabilities of every joint (list of
+                     vectors with one entry per bin)
+        :param dtype: The floating point type of the probabilities
+        """
+        profiles = {}
+        log_prod = []
+        num_certain = []
+        index = []
+        for pcp in p_cp:
+            pcp = np.asarray(pcp, dtype=float)
+            key = pcp.tobytes()
+            if key not in profiles:
+                profiles[key] = len(log_prod)
+                lp, nc = _cumulative_log(pcp)
+                log_prod.append(lp)
+                num_certain.append(nc)
+            index.append(profiles[key])
+
+        self._log_prod = np.array(log_prod, dtype=dtype)
+        self._num_certain = np.array(num_certain)
+        self._profile = np.array(index, dtype=int)
+
+    @classmethod
+    def _view(cls, parent, profile):
+        view = cls.__new__(cls)
+        view._log_prod = parent._log_prod
+        view._num_certain = parent._num_certain
+        view._profile = profile
+        return view
+
+    @property
+    def dtype(self):
+        return self._log_prod.dtype
+
+    @property
+    def num_positions(self):
+        return self._log_prod.shape[1]
+
+    @property
+    def num_profiles(self):
+        """
+        The number of distinct change point profiles that are stored.
+        """
+        return self._log_prod.shape[0]
+
+    @property
+    def ndim(self):
+        return self._profile.ndim + 2
+
+    @property
+    def shape(self):
+        return self._profile.shape + (self.num_positions, self.num_positions)
+
+    @property
+    def nbytes(self):
+        return (self._log_prod.nbytes + self._num_certain.nbytes +
+                self._profile.nbytes)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _gather(self, profile, s, t):
+        lp = self._log_prod
+        nc = self._num_certain
+        pr = np.exp(-np.abs(lp[profile, s] - lp[profile, t]))
+        return np.where(nc[profile, s] == nc[profile, t], pr,
+                        self.dtype.type(0))[()]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        num_lead = self._profile.ndim
+        if len(key) > self.ndim:
+            raise IndexError("too many indices for PSame")
+        key = key + (slice(None),) * (self.ndim - len(key))
+        profile = self._profile[key[:num_lead]] if num_lead else self._profile
+        s, t = key[num_lead:]
+
+        if isinstance(s, slice) or isinstance(t, slice):
+            if _is_all(s) and _is_all(t) and np.ndim(profile) == 0:
+                return PSame._view(self, profile)
+            if _is_all(t) and not isinstance(s, slice):
+                # rows of the positions s
+                s = np.asarray(s)
+                return self._gather(np.asarray(profile)[..., None],
+                                    s[..., None],
+                                    np.arange(self.num_positions))
+            raise IndexError("PSame only supports integers and integer arrays "
+                             "for the positions, or whole rows")
+        return self._gather(profile, s, t)
+
+    def log_vectors(self, joints=None):
+        """
+        :param joints: The joints to get the vectors of (default: all joints,
+                       or the joint of a view)
+        :return: A tuple of the cumulative log probabilities of no change
+                 point and the cumulative numbers of certain change points
+                 (... x positions each). `p_same[j, s, t]` is
+                 `exp(-|log_prod[s] - log_prod[t]|)` where the numbers of
+                 certain change points at s and t are equal, and 0 otherwise.
+        """
+        profile = self._profile if joints is None else self._profile[joints]
+        return self._log_prod[profile], self._num_certain[profile]
+
+    def astype(self, dtype):
+        """
+        :param dtype: The floating point type of the new probabilities
+        :return: A `PSame` of the same probabilities in another precision
+        """
+        p_same = PSame._view(self, self._profile)
+        p_same._log_prod = self._log_prod.astype(dtype)
+        return p_same
+
+    def toarray(self):
+        """
+        :return: The dense array of the probabilities (joints x positions x
+                 positions, or positions x positions for a single joint)
+        """
+        positions = np.arange(self.num_positions)
+        profile = np.asarray(self._profile)[..., None, None]
+        return self._gather(profile, positions[:, None], positions[None, :])
+
+    def __array__(self, dtype=None, copy=None):
+        dense = self.toarray()
+        if dtype is not None:
+            dense = dense.astype(dtype)
+        return dense
+
+
+def as_p_same(p_same):
+    """
+    Bring p_same into a form which supports the fancy indexing of the
+    inference functions.
+
+    :param p_same: The probabilities of two joint positions being in the same
+                   segment (`PSame`, list of matrices or tensor)
+    :return: `p_same` if it is a `PSame`, the dense tensor otherwise
+    """
+    if isinstance(p_same, PSame):
+        return p_same
+    return np.asarray(p_same)
@@ -1,5 +1,4 @@
 import multiprocessing
-import pandas as pd
 
 __author__ = 'johannes'
 
@@ -14,6 +13,8 @@ class Record(object):
     def __call__(self, f):
 
         def wrapped_f(*args, **kwargs):
+            import pandas as pd
+
             data = f(*args, **kwargs)
 
             if data is None:
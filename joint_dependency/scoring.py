@@ -0,0 +1,181 @@
+# coding: utf-8
+"""
+Score the candidate actions of a query in a pool of worker processes.
+
+The candidates are split into one chunk per worker. The state every worker
+needs, i.e. the `JointPosterior`s with their p_same and experience arrays, is
+published once per query in shared memory: the objects are pickled with their
+numpy arrays out-of-band (pickle protocol 5) and the arrays are copied into
+shared memory blocks. The tasks only carry the names of the blocks, and the
+workers unpickle the objects with arrays that are views of the blocks
+instead of copies.
+
+Every worker scores its chunk with one OpenMP thread, the pool is the
+parallelism. The workers are started by a fork server (or spawned), so they
+don't inherit the OpenMP thread pool of a process which already ran the
+compiled kernels, which isn't fork-safe.
+"""
+from __future__ import division
+import multiprocessing
+import os
+import pickle
+
+import numpy as np
+
+from joint_dependency import inference
+
+
+class SharedState(object):
+    """
+    Objects pickled into shared memory, see the module documentation.
+    """
+    def __init__(self, obj):
+        """
+        :param obj: The objects to share (picklable)
+        """
+        from multiprocessing import shared_memory
+        buffers = []
+        self.payload = pickle.dumps(obj, protocol=5,
+                                    buffer_callback=buffers.append)
+        self._blocks = []
+        sizes = []
+        for buffer in buffers:
+            raw = buffer.raw()
+            block = shared_memory.SharedMemory(create=True,
+                                               size=max(raw.nbytes, 1))
+            block.buf[:raw.nbytes] = raw
+            self._blocks.append(block)
+            sizes.append(raw.nbytes)
+        self.handle = (self.payload, [block.name for block in self._blocks],
+                       sizes)
+
+    @property
+    def nbytes(self):
+        """
+        The size of the arrays in shared memory.
+        """
+        return sum(self.handle[2])
+
+    def close(self):
+        """
+        Release the shared memory. Processes which attached to the state keep
+        their mapping until they detach.
+        """
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+
+def attach(handle):
+    """
+    Unpickle the objects of a `SharedState` with arrays that are views of its
+    shared memory.
+
+    :param handle: The `handle` of the state
+    :return: A tuple of the objects and the attached shared memory blocks,
+             which have to stay open as long as the objects are used
+    """
+    from multiprocessing import shared_memory
+    payload, names, sizes = handle
+    blocks = [shared_memory.SharedMemory(name=name) for name in names]
+    obj = pickle.loads(payload, buffers=[block.buf[:size]
+                                         for block, size in zip(blocks,
+                                                                sizes)])
+    return obj, blocks
+
+
+# the state a worker attached to last, reused by the other chunks of the same
+# query
+_attached = {'names': None, 'obj': None, 'blocks': []}
+
+
+def _detach():
+    _attached['obj'] = None
+    for block in _attached['blocks']:
+        try:
+            block.close()
+        except BufferError:
+            # views of the block are still referenced, it is closed when they
+            # are garbage collected
+            pass
+    _attached.update(names=None, blocks=[])
+
+
+def _init_worker():
+    # before the compiled backend and its OpenMP runtime are loaded
+    os.environ['OMP_NUM_THREADS'] = '1'
+
+
+def _score_chunk(task):
+    handle, backend, all_joint_fnc, joint_positions, alpha_prior = task
+    if inference.active_backend() != backend:
+        inference.use_backend(backend)
+    if _attached['names'] != handle[1]:
+        _detach()
+        obj, blocks = attach(handle)
+        _attached.update(names=handle[1], obj=obj, blocks=blocks)
+    return all_joint_fnc(_attached['obj'], joint_positions, alpha_prior)
+
+
+class ScoringPool(object):
+    """
+    A pool of worker processes scoring the candidates of the all-joint
+    objectives (e.g. `exp_cross_entropy_all_joints`) in parallel.
+    """
+    def __init__(self, workers):
+        """
+        :param workers: The number of worker processes
+        """
+        from multiprocessing import resource_tracker
+        self.workers = workers
+        # the workers have to share the resource tracker of this process,
+        # which forgets the shared memory blocks when they are unlinked here
+        resource_tracker.ensure_running()
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('forkserver')
+        else:
+            context = multiprocessing.get_context('spawn')
+        self._pool = context.Pool(workers, initializer=_init_worker)
+
+    def score(self, all_joint_fnc, joint_posteriors, joint_positions,
+              alpha_prior):
+        """
+        Compute `all_joint_fnc(joint_posteriors, joint_positions,
+        alpha_prior)` with the candidates split across the workers.
+
+        :param all_joint_fnc: The objective scoring all checked joints, a
+                              module level function
+        :param joint_posteriors: The `JointPosterior` of every checked joint
+        :param joint_positions: The candidate joint positions (candidates x
+                                joints)
+        :param alpha_prior: The prior over the different joint states
+        :return: The objective values (checked joints x candidates)
+        """
+        joint_positions = np.atleast_2d(joint_positions)
+        chunks = [chunk for chunk in np.array_split(joint_positions,
+                                                    self.workers)
+                  if chunk.shape[0] > 0]
+        state = SharedState(list(joint_posteriors))
+        try:
+            values = self._pool.map(
+                _score_chunk,
+                [(state.handle, inference.active_backend(), all_joint_fnc,
+                  chunk, alpha_prior) for chunk in chunks],
+                chunksize=1)
+        finally:
+            state.close()
+        return np.concatenate(values, axis=1)
+
+    def close(self):
+        """
+        Stop the worker processes.
+        """
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,6 +1,5 @@
 from __future__ import division
 import numpy as np
-import pandas as pd
 import random
 from enum import Enum
 from joint_dependency.recorder import Record
@@ -100,6 +99,7 @@ class World(object):
         self._inform_listeners(dt)
 
     def get_index(self):
+        import pandas as pd
         return [pd.to_datetime(self.time, unit="s")]
 
     def register(self, listener):
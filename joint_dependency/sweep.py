@@ -0,0 +1,290 @@
+# coding: utf-8
+"""
+Resumable parameter sweeps over the options of the experiments.
+
+A sweep is specified by a JSON file like
+
+    {"base": {"queries": 20, "headless": true},
+     "grid": {"objective": ["random", "entropy", "cross_entropy"],
+              "samples": [500, 1000],
+              "joint_state": ["small", "large"]},
+     "runs": 5,
+     "seed": 42}
+
+The keys of "base" and "grid" are the command line options of
+joint_dep_exp.py (with underscores, e.g. "joint_state"). Every combination of
+the grid values is a configuration, and every configuration is run "runs"
+times. Run r of every configuration uses the same seed, derived from the
+sweep seed with `seed_for_run`, so all configurations explore the same worlds
+with the same change point prior.
+
+Every run is stored in the output directory under the hash of its options
+and its seed: the directory `<hash>` holds the files the run wrote and
+`<hash>.json` its summary, which is written last and marks the run as
+finished. Finished runs
+are skipped, so a killed sweep resumes where it stopped, and extending the
+grid only runs the new cells.
+"""
+from __future__ import division
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import traceback
+
+# options which don't change the results of a run
+NON_RESULT_OPTIONS = ('threads', 'runs', 'seed', 'headless', 'backend',
+                      'scoring_workers', 'serve', 'authkey', 'lease',
+                      'max_attempts')
+
+
+def load_sweep(filename):
+    """
+    :param filename: The JSON file specifying the sweep
+    :return: The sweep (dictionary)
+    """
+    with open(filename) as _file:
+        return json.load(_file)
+
+
+def _argv(parser, configuration):
+    # the command line of a configuration, so the parser converts and checks
+    # its values like those of joint_dep_exp.py
+    actions = {action.dest: action for action in parser._actions}
+    unknown = [name for name in configuration
+               if name not in actions or name == 'help']
+    if unknown:
+        raise ValueError("Unknown options of the sweep: {}".format(
+            ", ".join(sorted(unknown))))
+    configuration = dict(configuration)
+    configuration.setdefault('objective', 'random')
+    argv = []
+    for name, value in sorted(configuration.items()):
+        action = actions[name]
+        option = max(action.option_strings, key=len)
+        if action.nargs == 0:
+            if value not in (True, False):
+                raise ValueError("The option {} of the sweep is a flag, not "
+                                 "{!r}".format(name, value))
+            if value:
+                argv.append(option)
+        elif value is not None:
+            argv.extend([option, str(value)])
+    return argv
+
+
+def _raise_value_error(message):
+    raise ValueError("Invalid options of the sweep: {}".format(message))
+
+
+def expand(sweep):
+    """
+    Expand a sweep into the specifications of its runs.
+
+    :param sweep: The sweep (dictionary with the optional keys 'base', 'grid',
+                  'runs' and 'seed', see the module documentation)
+    :return: The specifications of the runs (see `experiments.run_specs`),
+             every configuration with all its runs
+    :raises ValueError: If an option of the sweep is unknown or has an
+                        invalid value
+    """
+    from joint_dependency.experiments import build_parser, seed_for_run
+
+    base = dict(sweep.get('base', {}))
+    grid = sweep.get('grid', {})
+    names = sorted(grid)
+    configurations = [dict(base, **dict(zip(names, values)))
+                      for values in itertools.product(*[grid[name]
+                                                        for name in names])]
+    parser = build_parser()
+    parser.error = _raise_value_error
+    specs = []
+    for configuration in configurations:
+        args = vars(parser.parse_args(_argv(parser, configuration)))
+        args['threads'] = 1
+        for run in range(sweep.get('runs', 1)):
+            specs.append({'args': args, 'run': run,
+                          'seed': seed_for_run(sweep.get('seed', 0), run)})
+    return specs
+
+
+def run_hash(spec):
+    """
+    :param spec: The specification of a run
+    :return: The hash of the options which determine the results of the run
+             and of its seed (hex string)
+    """
+    # options at None are left out, so a new option with the default None
+    # doesn't change the hashes of the finished runs
+    key = {name: value for name, value in spec['args'].items()
+           if name not in NON_RESULT_OPTIONS and value is not None}
+    key['seed'] = spec['seed']
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode(
+        'utf-8')).hexdigest()[:16]
+
+
+def is_finished(spec, output_dir):
+    return os.path.exists(os.path.join(output_dir,
+                                       run_hash(spec) + '.json'))
+
+
+def _write(path, content):
+    # write to a temporary file first, so a killed sweep leaves no partial
+    # files behind
+    with open(path + '.tmp', 'wb') as _file:
+        _file.write(content)
+    os.replace(path + '.tmp', path)
+
+
+def _json_value(value):
+    if hasattr(value, 'item'):
+        return value.item()
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+
+def _run_cell(job):
+    from joint_dependency.experiments import run_in_directory
+    spec, output_dir, run_fnc = job
+    key = run_hash(spec)
+    error_path = os.path.join(output_dir, key + '.error.json')
+    try:
+        result, files = run_in_directory(spec, run_fnc)
+    except Exception:
+        # the other runs go on, the run is tried again by the next sweep
+        record = {'Hash': key, 'Spec': spec,
+                  'Error': traceback.format_exc()}
+        _write(error_path, json.dumps(record, sort_keys=True,
+                                      indent=1).encode('utf-8'))
+        return key, False
+    run_dir = os.path.join(output_dir, key)
+    if not os.path.isdir(run_dir):
+        os.makedirs(run_dir)
+    paths = []
+    for name in sorted(files):
+        _write(os.path.join(run_dir, name), files[name])
+        paths.append(os.path.join(key, name))
+    record = {'Hash': key, 'Spec': spec, 'Files': paths,
+              'Summary': {name: _json_value(value)
+                          for name, value in result.items()
+                          if name != 'Filename'}}
+    _write(os.path.join(output_dir, key + '.json'),
+           json.dumps(record, sort_keys=True, indent=1).encode('utf-8'))
+    if os.path.exists(error_path):
+        os.remove(error_path)
+    return key, True
+
+
+def run_sweep(sweep, output_dir, threads=1, run_fnc=None):
+    """
+    Run all runs of a sweep which are not finished yet.
+
+    :param sweep: The sweep (dictionary, see the module documentation)
+    :param output_dir: The directory the runs are stored in
+    :param threads: The number of runs executed in parallel
+    :param run_fnc: The function running one experiment, called with the
+                    arguments, the number of the run and its seed (default:
+                    `experiments.run_experiment`)
+    :return: The summaries of all runs of the sweep (see `collect`). A run
+             which raises an error doesn't stop the others, its error is
+             stored in `<hash>.error.json` and it is tried again by the next
+             sweep.
+    """
+    from joint_dependency.experiments import run_experiment
+    if run_fnc is None:
+        run_fnc = run_experiment
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    specs = expand(sweep)
+    pending = []
+    keys = set()
+    for spec in specs:
+        key = run_hash(spec)
+        if key not in keys and not is_finished(spec, output_dir):
+            pending.append(spec)
+        keys.add(key)
+    print("{} of {} runs are finished, running {}".format(
+        len(keys) - len(pending), len(keys), len(pending)))
+
+    jobs = [(spec, output_dir, run_fnc) for spec in pending]
+    if threads > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(min(threads, len(jobs)))
+        try:
+            outcomes = list(pool.imap_unordered(_run_cell, jobs))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        outcomes = [_run_cell(job) for job in jobs]
+    failed = [key for key, finished in outcomes if not finished]
+    if failed:
+        print("{} runs failed, see {}".format(len(failed), ", ".join(
+            os.path.join(output_dir, key + '.error.json')
+            for key in failed)))
+    return collect(sweep, output_dir)
+
+
+def collect(sweep, output_dir):
+    """
+    :param sweep: The sweep (dictionary, see the module documentation)
+    :param output_dir: The directory the runs are stored in
+    :return: The summaries of the finished runs of the sweep and the errors
+             of the failed ones, with the grid options as columns (pandas
+             DataFrame)
+    """
+    import pandas as pd
+
+    names = sorted(sweep.get('grid', {}))
+    rows = []
+    for spec in expand(sweep):
+        key = run_hash(spec)
+        row = {name: spec['args'][name] for name in names}
+        path = os.path.join(output_dir, key + '.json')
+        error_path = os.path.join(output_dir, key + '.error.json')
+        if os.path.exists(path):
+            with open(path) as _file:
+                record = json.load(_file)
+            row.update(record['Summary'])
+            row.update(Files=record['Files'])
+        elif os.path.exists(error_path):
+            with open(error_path) as _file:
+                row.update(Error=json.load(_file)['Error'])
+        else:
+            continue
+        row.update(Run=spec['run'], Hash=key)
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def sweep_main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Run a resumable sweep over the options of "
+                    "joint_dep_exp.py")
+    parser.add_argument("sweep", type=str,
+                        help="The JSON file specifying the sweep")
+    parser.add_argument("-d", "--output_dir", type=str, default="sweep",
+                        help="The directory the runs are stored in")
+    parser.add_argument("-t", "--threads", type=int,
+                        default=multiprocessing.cpu_count(),
+                        help="Number of runs executed in parallel")
+    parser.add_argument("--dry_run", action='store_true',
+                        help="Only list the runs and whether they are "
+                             "finished")
+    args = parser.parse_args()
+
+    sweep = load_sweep(args.sweep)
+    if args.dry_run:
+        names = sorted(sweep.get('grid', {}))
+        for spec in expand(sweep):
+            print("{} run {} {}: {}".format(
+                run_hash(spec), spec['run'],
+                ", ".join("{}={}".format(name, spec['args'][name])
+                          for name in names),
+                "finished" if is_finished(spec, args.output_dir)
+                else "pending"))
+        return
+    summary = run_sweep(sweep, args.output_dir, args.threads)
+    print(summary)
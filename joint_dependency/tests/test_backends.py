@@ -0,0 +1,181 @@
+import unittest
+import warnings
+import numpy as np
+
+from joint_dependency import inference
+from joint_dependency.posterior import JointPosterior
+from joint_dependency.psame import PSame
+from joint_dependency.tests.test_inference import random_experiences
+
+
+class TestBackendRegistry(unittest.TestCase):
+    def tearDown(self):
+        inference.use_backend()
+
+    def test_unknown_backend(self):
+        self.assertRaises(ValueError, inference.load_backend, 'fortran')
+        self.assertRaises(ValueError, inference.use_backend, 'fortran')
+
+    def test_forwarding_follows_backend(self):
+        self.assertEqual(inference.use_backend('numpy'), 'numpy')
+        self.assertEqual(inference.active_backend(), 'numpy')
+        p_same = np.ones((2, 360, 360))
+        experiences = random_experiences(5, 2, np.random.RandomState(0))
+        np.testing.assert_allclose(
+            inference.model_posterior(experiences, p_same,
+                                      np.array([.1, .1]),
+                                      np.array([.3, .3, .4])),
+            inference.load_backend('numpy').model_posterior(
+                experiences, p_same, np.array([.1, .1]),
+                np.array([.3, .3, .4])))
+        self.assertEqual(inference.model_posterior.__module__,
+                         inference.__name__)
+
+    def test_fallback(self):
+        import_cython = inference._import_cython
+        module = inference._modules.pop('cython', None)
+
+        def broken():
+            raise RuntimeError("no compiler")
+        inference._import_cython = broken
+        try:
+            self.assertRaises(ImportError, inference.use_backend, 'cython')
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                self.assertEqual(inference.use_backend('auto'), 'numpy')
+            self.assertEqual(len(caught), 1)
+            self.assertNotIn('cython', inference.available_backends())
+        finally:
+            inference._import_cython = import_cython
+            if module is not None:
+                inference._modules['cython'] = module
+
+
+@unittest.skipUnless('cython' in inference.available_backends(),
+                     "the compiled backend can't be loaded")
+class TestBackendEquivalence(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.RandomState(21)
+        self.num_joints = 4
+        p_cp = [self.rng.uniform(0, .05, size=360)
+                for _ in range(self.num_joints)]
+        p_cp[2][[60, 120]] = 1.
+        self.p_same = PSame(p_cp)
+        self.alpha_prior = np.array([.1, .1])
+        self.model_prior = np.array([.1, .2, 0., .05, .65])
+        self.experiences = random_experiences(30, self.num_joints, self.rng)
+        self.candidates = self.rng.randint(0, 180,
+                                           size=(12, self.num_joints))
+        self.backends = [inference.load_backend(name)
+                         for name in ('cython', 'numpy')]
+
+    def assertBackendsAgree(self, name, *args, **kwargs):
+        cython, numpy = [getattr(backend, name)(*args, **kwargs)
+                         for backend in self.backends]
+        np.testing.assert_allclose(cython, numpy, rtol=1e-9, atol=1e-12,
+                                   err_msg=name)
+
+    def test_posteriors(self):
+        for p_same in (self.p_same, np.asarray(self.p_same)):
+            self.assertBackendsAgree('model_posterior', self.experiences,
+                                     p_same, self.alpha_prior,
+                                     self.model_prior)
+            self.assertBackendsAgree('log_model_posterior', self.experiences,
+                                     p_same, self.alpha_prior,
+                                     self.model_prior)
+            self.assertBackendsAgree(
+                'model_posterior_grid', self.experiences, p_same,
+                np.array([[.1, .1], [1., 1.], [.5, 2.]]),
+                np.array([self.model_prior, np.ones(5) / 5]))
+            self.assertBackendsAgree('log_likelihood_dependent',
+                                     self.experiences, 2, p_same,
+                                     self.alpha_prior)
+            self.assertBackendsAgree('contribution_table', self.experiences,
+                                     p_same)
+            self.assertBackendsAgree('create_alpha', 33, self.experiences, 1,
+                                     p_same[1])
+        self.assertBackendsAgree('log_likelihood_independent',
+                                 self.experiences, self.alpha_prior)
+
+    def test_objectives(self):
+        for p_same in (self.p_same, np.asarray(self.p_same)):
+            for objective in ('exp_cross_entropy', 'exp_neg_entropy'):
+                self.assertBackendsAgree(objective, self.experiences,
+                                         self.candidates[0], p_same,
+                                         self.alpha_prior, self.model_prior)
+                self.assertBackendsAgree(objective + '_batch',
+                                         self.experiences, self.candidates,
+                                         p_same, self.alpha_prior,
+                                         self.model_prior)
+
+            joint_posteriors = [
+                JointPosterior(p_same, self.alpha_prior, self.model_prior,
+                               self.experiences[:n])
+                for n in (0, 5, 17, 30)]
+            for objective in ('exp_cross_entropy_all_joints',
+                              'exp_neg_entropy_all_joints'):
+                self.assertBackendsAgree(objective, joint_posteriors,
+                                         self.candidates, self.alpha_prior)
+
+    def test_single_precision_kernels(self):
+        # the compiled kernels compute in the precision of p_same, like the
+        # numpy backend, instead of silently in double precision
+        cython = self.backends[0]
+        p_same32 = self.p_same.astype(np.float32)
+        bins = np.arange(0, 180, 7)
+        counts = self.rng.uniform(size=(bins.shape[0], 2))
+        self.assertEqual(cython._weighted_counts(p_same32[1], np.arange(9),
+                                                 bins, counts).dtype,
+                         np.float32)
+
+        candidates = self.rng.randint(0, 180, size=(1, 12))
+        posterior = JointPosterior(self.p_same, self.alpha_prior,
+                                   self.model_prior, self.experiences)
+        posterior32 = JointPosterior(p_same32, self.alpha_prior,
+                                     self.model_prior, self.experiences)
+        candidates = np.repeat(candidates, posterior.models.shape[0], axis=0)
+        for kernel, reference, double in zip(
+                cython._log_sums(posterior32, candidates),
+                posterior32.log_sums(candidates),
+                posterior.log_sums(candidates)):
+            np.testing.assert_allclose(kernel, reference, rtol=1e-6)
+            self.assertFalse(np.allclose(kernel, double, rtol=1e-12,
+                                         atol=0))
+
+    def test_objective_signatures(self):
+        import inspect
+        for objective in ('random_objective', 'heuristic_proximity',
+                          'exp_cross_entropy', 'exp_neg_entropy'):
+            cython, numpy = [inspect.signature(getattr(backend, objective))
+                             for backend in self.backends]
+            self.assertEqual(list(cython.parameters),
+                             list(numpy.parameters), objective)
+
+
+class TestObjectiveCalls(unittest.TestCase):
+    def tearDown(self):
+        inference.use_backend()
+
+    def test_called_like_get_best_point(self):
+        from joint_dependency.simulation import create_world
+        rng = np.random.RandomState(5)
+        world = create_world(3)
+        p_same = PSame([rng.uniform(0, .05, size=360) for _ in range(3)])
+        alpha_prior = np.array([.1, .1])
+        model_prior = np.array([.2, .1, .1, .6])
+        experiences = random_experiences(10, 3, rng)
+        joint_posterior = JointPosterior(p_same, alpha_prior, model_prior,
+                                         experiences)
+        for name in inference.available_backends():
+            inference.use_backend(name)
+            for objective in (inference.random_objective,
+                              inference.heuristic_proximity,
+                              inference.exp_cross_entropy,
+                              inference.exp_neg_entropy):
+                # the positional arguments of `experiments._score_actions`
+                value = objective(experiences, rng.randint(0, 180, size=3),
+                                  p_same, alpha_prior, model_prior,
+                                  joint_posterior.posterior, [1], 2, [], world,
+                                  False)
+                self.assertFalse(np.isnan(value),
+                                 "{} {}".format(name, objective.__name__))
@@ -0,0 +1,124 @@
+import pickle
+import unittest
+import numpy as np
+
+from joint_dependency import inference, inference_py
+from joint_dependency.buffer import ExperienceBuffer, experience_arrays
+from joint_dependency.histogram import ExperienceHistogram
+from joint_dependency.posterior import JointPosterior
+from joint_dependency.tests.test_inference import (random_p_same,
+                                                   random_experiences,
+                                                   skip_unless_compiled)
+
+
+class TestExperienceBuffer(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.RandomState(13)
+        self.num_joints = 3
+        self.experiences = random_experiences(40, self.num_joints, self.rng)
+        self.buffer = ExperienceBuffer(self.num_joints,
+                                       experiences=self.experiences,
+                                       capacity=1)
+
+    def test_list_interface(self):
+        self.assertEqual(len(self.buffer), 40)
+        for e, b in zip(self.experiences, self.buffer):
+            np.testing.assert_array_equal(b['data'], e['data'])
+            self.assertEqual(b['value'], bool(e['value']))
+        np.testing.assert_array_equal(self.buffer[-1]['data'],
+                                      self.experiences[-1]['data'])
+        self.assertRaises(IndexError, self.buffer.__getitem__, 40)
+        self.assertEqual(len(self.buffer[35:]), 5)
+        self.assertEqual(len(self.buffer[40:]), 0)
+        self.assertEqual(len(self.buffer[::2]), 20)
+
+        bins, values = experience_arrays(self.buffer)
+        list_bins, list_values = experience_arrays(self.experiences)
+        np.testing.assert_array_equal(bins, list_bins)
+        np.testing.assert_array_equal(values, list_values)
+
+        copy = pickle.loads(pickle.dumps(self.buffer))
+        np.testing.assert_array_equal(copy.bins, self.buffer.bins)
+
+    def test_compact(self):
+        self.assertEqual(self.buffer.bins.dtype, np.int16)
+        self.assertEqual(self.buffer.values.dtype, np.uint8)
+        self.assertEqual(self.buffer.nbytes, 40 * (2 * self.num_joints + 1))
+
+    def test_resolution(self):
+        buffer = ExperienceBuffer(2, resolution=.5)
+        buffer.add([10.3, 179.9], True)
+        np.testing.assert_array_equal(buffer.bins, [[20, 359]])
+        np.testing.assert_allclose(buffer[0]['data'], [10., 179.5])
+        np.testing.assert_array_equal(experience_arrays(buffer, 5.)[0],
+                                      [[2, 35]])
+        self.assertRaises(ValueError, ExperienceBuffer, 2, .001)
+
+    def test_snapshots(self):
+        snapshot = self.buffer.snapshot()
+        self.assertTrue(np.shares_memory(snapshot.bins, self.buffer.bins))
+
+        # a hypothetical experience only changes the snapshot
+        snapshot.add([1, 2, 3], True)
+        self.assertEqual(len(snapshot), 41)
+        self.assertEqual(len(self.buffer), 40)
+
+        # new experiences of the buffer don't change older snapshots
+        older = self.buffer[:20]
+        self.buffer.add([4, 5, 6], False)
+        self.buffer.add([7, 8, 9], True)
+        self.assertEqual(len(older), 20)
+        np.testing.assert_array_equal(older.bins,
+                                      experience_arrays(
+                                          self.experiences[:20])[0])
+        np.testing.assert_array_equal(snapshot[-1]['data'], [1, 2, 3])
+        np.testing.assert_array_equal(self.buffer[40]['data'], [4, 5, 6])
+
+    def check_inference_accepts_buffer(self, backend, p_same, alpha_prior,
+                                       model_prior):
+        candidates = self.rng.randint(0, 180, size=(5, self.num_joints))
+        for name, args in [
+                ('model_posterior', (p_same, alpha_prior, model_prior)),
+                ('log_likelihood_independent', (alpha_prior,)),
+                ('contribution_table', (p_same,)),
+                ('exp_cross_entropy_batch',
+                 (candidates, p_same, alpha_prior, model_prior)),
+                ('exp_neg_entropy',
+                 (candidates[0], p_same, alpha_prior, model_prior))]:
+            np.testing.assert_allclose(
+                getattr(backend, name)(self.buffer, *args),
+                getattr(backend, name)(self.experiences, *args),
+                rtol=1e-12, err_msg=name)
+        np.testing.assert_allclose(
+            backend.prob_locked(self.buffer, candidates[0], p_same,
+                                alpha_prior, model_prior).alpha,
+            backend.prob_locked(self.experiences, candidates[0], p_same,
+                                alpha_prior, model_prior).alpha, rtol=1e-12)
+
+    @skip_unless_compiled
+    def test_compiled_inference_accepts_buffer(self):
+        self.check_inference_accepts_buffer(
+            inference.load_backend('cython'),
+            random_p_same(self.num_joints, self.rng), np.array([.1, .1]),
+            np.array([.2, .1, .1, .6]))
+
+    def test_inference_accepts_buffer(self):
+        p_same = random_p_same(self.num_joints, self.rng)
+        alpha_prior = np.array([.1, .1])
+        model_prior = np.array([.2, .1, .1, .6])
+        self.check_inference_accepts_buffer(inference_py, p_same, alpha_prior,
+                                            model_prior)
+
+        posterior = JointPosterior(p_same, alpha_prior, model_prior,
+                                   self.buffer[:25])
+        posterior.update(self.buffer)
+        np.testing.assert_allclose(
+            posterior.posterior,
+            inference_py.model_posterior(self.experiences, p_same,
+                                         alpha_prior, model_prior),
+            rtol=1e-12)
+        np.testing.assert_array_equal(
+            ExperienceHistogram(self.num_joints, 360,
+                                experiences=self.buffer).counts,
+            ExperienceHistogram(self.num_joints, 360,
+                                experiences=self.experiences).counts)
@@ -0,0 +1,149 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+from joint_dependency.distributed import (AUTHKEY_VARIABLE, Coordinator,
+                                          JobBoard, DONE, parse_address,
+                                          run_worker)
+
+
+def fake_run(args, run, seed):
+    # the first attempt of some runs kills its worker or fails
+    marker = os.path.join(args.marker_dir, str(run))
+    if run in (args.crash_run, args.fail_run) and not os.path.exists(marker):
+        open(marker, 'w').close()
+        if run == args.crash_run:
+            os._exit(1)
+        raise RuntimeError("the run failed")
+    with open("data_run{}.pkl".format(run), 'wb') as _file:
+        _file.write(str(seed).encode())
+    return {'Run': run, 'Seed': seed, 'Pid': os.getpid()}
+
+
+class TestJobBoard(unittest.TestCase):
+    def setUp(self):
+        self.specs = [{'args': {}, 'run': run, 'seed': run} for run in
+                      range(2)]
+
+    def test_leases(self):
+        board = JobBoard(self.specs, lease=60., max_attempts=2)
+        self.assertEqual(board.take('a')[0], 0)
+        self.assertEqual(board.take('b')[0], 1)
+        self.assertIsNone(board.take('c'))
+        self.assertTrue(board.heartbeat(0, 'a'))
+        self.assertFalse(board.heartbeat(0, 'b'))
+
+        board.fail(1, 'b', "error")
+        self.assertEqual(board.take('c')[0], 1)
+        board.fail(1, 'c', "error")
+        self.assertIsNone(board.take('c'))
+        self.assertFalse(board.finished())
+        self.assertTrue(board.complete(0, 'a', {'Run': 0}, {}))
+        self.assertEqual(board.take('c'), DONE)
+        self.assertEqual(board.status(), {'pending': 0, 'running': 0,
+                                          'finished': 1, 'failed': 1})
+        results = board.results()
+        self.assertEqual(results[0]['Worker'], 'a')
+        self.assertEqual(results[1]['Error'], "error")
+
+    def test_lost_worker(self):
+        board = JobBoard(self.specs[:1], lease=0., max_attempts=3)
+        board.take('a')
+        # the lease expired, the run is given to the next worker
+        self.assertEqual(board.take('b')[0], 0)
+        self.assertFalse(board.heartbeat(0, 'a'))
+        self.assertTrue(board.complete(0, 'b', {'Run': 0}, {}))
+        # a late result of the lost worker is ignored
+        self.assertFalse(board.complete(0, 'a', {'Run': 0}, {}))
+        self.assertEqual(board.results()[0]['Attempts'], 2)
+
+    def test_late_result_during_retry(self):
+        board = JobBoard(self.specs[:1], lease=0., max_attempts=3)
+        board.take('a')
+        self.assertEqual(board.take('b')[0], 0)
+        board.lease = 60.
+        self.assertTrue(board.heartbeat(0, 'b'))
+        # the lost worker delivers while the retry is still running
+        self.assertFalse(board.complete(0, 'a', {'Run': 0}, {}))
+        self.assertTrue(board.heartbeat(0, 'b'))
+        self.assertEqual(board.status()['running'], 1)
+        self.assertFalse(board.finished())
+        self.assertTrue(board.complete(0, 'b', {'Run': 0}, {}))
+        self.assertEqual(board.results()[0]['Worker'], 'b')
+
+    def test_late_result_before_retry(self):
+        board = JobBoard(self.specs[:1], lease=0., max_attempts=3)
+        board.take('a')
+        # nobody took the run again, so the result is still used
+        self.assertTrue(board.complete(0, 'a', {'Run': 0}, {}))
+        self.assertEqual(board.take('b'), DONE)
+
+    def test_parse_address(self):
+        self.assertEqual(parse_address("localhost:5000"), ("localhost", 5000))
+        # only localhost unless all interfaces are asked for
+        self.assertEqual(parse_address(":5000"), ("127.0.0.1", 5000))
+        self.assertEqual(parse_address("0.0.0.0:5000"), ("0.0.0.0", 5000))
+
+    def test_authkey(self):
+        environ = os.environ.pop(AUTHKEY_VARIABLE, None)
+        try:
+            # there is no default key, without one a random key is generated
+            first, second = [Coordinator([], authkey=None) for _ in range(2)]
+            self.assertTrue(first.generated_authkey)
+            self.assertGreaterEqual(len(first.authkey), 32)
+            self.assertNotEqual(first.authkey, second.authkey)
+            self.assertRaises(ValueError, run_worker, first.address)
+
+            os.environ[AUTHKEY_VARIABLE] = 'secret'
+            coordinator = Coordinator([])
+            self.assertFalse(coordinator.generated_authkey)
+            self.assertEqual(coordinator.authkey, 'secret')
+            for coordinator in (first, second, coordinator):
+                coordinator.stop()
+        finally:
+            os.environ.pop(AUTHKEY_VARIABLE, None)
+            if environ is not None:
+                os.environ[AUTHKEY_VARIABLE] = environ
+
+
+class TestDistributed(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.marker_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+        shutil.rmtree(self.marker_dir)
+
+    def test_localhost_workers(self):
+        args = {'marker_dir': self.marker_dir, 'crash_run': 2, 'fail_run': 4}
+        specs = [{'args': args, 'run': run, 'seed': 100 + run}
+                 for run in range(6)]
+        with Coordinator(specs, self.output_dir, lease=1.,
+                         authkey='test') as coordinator:
+            workers = [multiprocessing.Process(
+                target=run_worker,
+                args=(coordinator.address, 'test', fake_run,
+                      'worker{}'.format(i), .1))
+                for i in range(3)]
+            for worker in workers:
+                worker.start()
+            summary = coordinator.wait(poll=.1, timeout=60)
+            for worker in workers:
+                worker.join(10)
+
+        self.assertEqual(list(summary.index), list(range(6)))
+        self.assertNotIn('Error', summary.columns)
+        self.assertEqual(list(summary['Seed']), [100 + run
+                                                 for run in range(6)])
+        self.assertEqual(summary.loc[2, 'Attempts'], 2)
+        self.assertEqual(summary.loc[4, 'Attempts'], 2)
+        self.assertEqual(summary.loc[0, 'Attempts'], 1)
+        for run in range(6):
+            path = os.path.join(self.output_dir,
+                                "data_run{}.pkl".format(run))
+            self.assertEqual(summary.loc[run, 'Files'], [path])
+            with open(path, 'rb') as _file:
+                self.assertEqual(_file.read(), str(100 + run).encode())
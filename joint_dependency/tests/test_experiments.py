@@ -0,0 +1,296 @@
+import argparse
+from functools import partial
+import multiprocessing
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+
+import joint_dependency
+from joint_dependency import experiments
+
+from joint_dependency.experiments import (
+    large_joint_state_one_joint_moving_sampling, small_joint_state_sampling,
+    enumerates_actions)
+from joint_dependency.experiments import (resample_p_cp, compute_p_same,
+                                          init, build_model_prior_simple,
+                                          get_best_point,
+                                          exhaustive_joint_state_sampling,
+                                          exp_cross_entropy,
+                                          prior_grid_posteriors,
+                                          run_experiments, seed_for_run,
+                                          dependency_learning,
+                                          default_samples, build_parser)
+from joint_dependency.inference import (same_segment, exp_cross_entropy_batch,
+                                        model_posterior)
+from joint_dependency.scoring import ScoringPool
+from joint_dependency.simulation import (create_world, ActionMachine,
+                                         Controller)
+from joint_dependency.utils import quantize
+
+
+class TestResolution(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.RandomState(1)
+        self.p_cp = self.rng.uniform(0, .1, size=360)
+
+    def test_same_resolution_is_unchanged(self):
+        self.assertIs(resample_p_cp(self.p_cp, 1.), self.p_cp)
+
+    def test_coarse_bins_combine_probabilities(self):
+        coarse = resample_p_cp(self.p_cp, 5.)
+        self.assertEqual(coarse.shape, (72,))
+        expected = 1 - np.prod(1 - self.p_cp.reshape(72, 5), axis=1)
+        np.testing.assert_allclose(coarse, expected, rtol=1e-10)
+
+    def test_fine_bins_split_probabilities(self):
+        fine = resample_p_cp(self.p_cp, .1)
+        self.assertEqual(fine.shape, (3600,))
+        np.testing.assert_allclose(
+            np.prod(1 - fine.reshape(360, 10), axis=1), 1 - self.p_cp,
+            rtol=1e-10)
+
+    def test_compute_p_same(self):
+        p_same = compute_p_same([self.p_cp], .5)
+        self.assertEqual(p_same[0].shape, (720, 720))
+        # positions in the same degree at 1 and .5 degree resolution
+        np.testing.assert_allclose(p_same[0][20, 100],
+                                   same_segment(self.p_cp)[10, 50],
+                                   rtol=1e-10)
+
+    def test_compute_p_same_single_precision(self):
+        p_same = compute_p_same([self.p_cp], dtype=np.float32)
+        self.assertEqual(p_same.dtype, np.float32)
+        np.testing.assert_allclose(np.asarray(p_same)[0],
+                                   same_segment(self.p_cp), rtol=1e-5)
+
+
+class TestExhaustive(unittest.TestCase):
+    def setUp(self):
+        random.seed(4)
+        self.rng = np.random.RandomState(4)
+        self.world = create_world(2)
+        self.num_joints = len(self.world.joints)
+        p_cp, self.experiences = init(self.world)
+        self.p_same = compute_p_same(p_cp)
+        for joint_experiences in self.experiences:
+            for _ in range(10):
+                joint_experiences.append({
+                    'data': self.rng.randint(0, 120, size=self.num_joints),
+                    'value': bool(self.rng.randint(2))})
+        self.alpha_prior = np.array([.1, .1])
+        self.model_prior = build_model_prior_simple(self.world, .7)
+
+    def test_sampling_covers_action_space(self):
+        locked = [0] * self.num_joints
+        locked[0] = 1
+        actions = exhaustive_joint_state_sampling(None, self.world, locked)
+        current = [joint.get_q() for joint in self.world.joints]
+        expected = sum(int(joint.max_limit - joint.min_limit)
+                       for joint in self.world.joints[1:])
+        self.assertEqual(len(actions), expected)
+        self.assertNotIn(0, [joint_idx for joint_idx, _ in actions])
+        for joint_idx, pos in actions:
+            others = np.arange(self.num_joints) != joint_idx
+            np.testing.assert_allclose(pos[others],
+                                       quantize(current)[others])
+
+    def test_best_action_is_deterministic(self):
+        locked = [0] * self.num_joints
+        best = [get_best_point(exp_cross_entropy, self.experiences,
+                               self.p_same, self.alpha_prior,
+                               self.model_prior, None, self.world, locked,
+                               exhaustive_joint_state_sampling,
+                               exhaustive=True)
+                for _ in range(2)]
+        self.assertEqual(best[0][1:], best[1][1:])
+        np.testing.assert_array_equal(best[0][0], best[1][0])
+
+        actions = exhaustive_joint_state_sampling(None, self.world, locked)
+        positions = np.array([pos for _, pos in actions])
+        values = [exp_cross_entropy_batch(self.experiences[check_joint],
+                                          positions, self.p_same,
+                                          self.alpha_prior,
+                                          self.model_prior[check_joint])
+                  for check_joint in range(self.num_joints)]
+        self.assertAlmostEqual(best[0][3], np.max(values))
+
+    def test_time_budget(self):
+        locked = [0] * self.num_joints
+        args = (exp_cross_entropy, self.experiences, self.p_same,
+                self.alpha_prior, self.model_prior, None, self.world, locked,
+                exhaustive_joint_state_sampling)
+        num_actions = len(exhaustive_joint_state_sampling(None, self.world,
+                                                          locked))
+        info = {}
+        best = get_best_point(*args, exhaustive=True, info=info)
+        self.assertEqual(info['Candidates'], num_actions)
+
+        # with enough time every action is scored in growing batches
+        info = {}
+        anytime = get_best_point(*args, exhaustive=True, time_budget=60.,
+                                 info=info)
+        self.assertEqual(info['Candidates'], num_actions)
+        self.assertGreater(info['Batches'], 1)
+        self.assertEqual(anytime[1:], best[1:])
+        np.testing.assert_array_equal(anytime[0], best[0])
+
+        # without time only the first batch is scored
+        info = {}
+        first = get_best_point(*args, exhaustive=True, time_budget=0.,
+                               batch_size=5, info=info)
+        self.assertEqual((info['Candidates'], info['Batches']), (5, 1))
+        self.assertLessEqual(first[3], best[3])
+
+    def test_time_budget_enumeration_of_batch_size(self):
+        # the enumerated actions are scored once, even if there are exactly
+        # as many as the first batch
+        locked = [0] * self.num_joints
+        actions = small_joint_state_sampling(None, self.world, locked)
+        for sampling in (small_joint_state_sampling,
+                         partial(small_joint_state_sampling)):
+            info = {}
+            get_best_point(exp_cross_entropy, self.experiences, self.p_same,
+                           self.alpha_prior, self.model_prior, None,
+                           self.world, locked, sampling, time_budget=60.,
+                           batch_size=len(actions), info=info)
+            self.assertEqual((info['Candidates'], info['Batches']),
+                             (len(actions), 1))
+            self.assertLess(info['Time'], 10.)
+        self.assertTrue(enumerates_actions(
+            partial(exhaustive_joint_state_sampling, resolution=2.)))
+        self.assertFalse(enumerates_actions(
+            large_joint_state_one_joint_moving_sampling))
+
+    def test_time_budget_samples(self):
+        locked = [0] * self.num_joints
+        sampling = large_joint_state_one_joint_moving_sampling
+        info = {}
+        get_best_point(exp_cross_entropy, self.experiences, self.p_same,
+                       self.alpha_prior, self.model_prior, 100, self.world,
+                       locked, sampling, time_budget=60., batch_size=8,
+                       info=info)
+        # at most N_samples candidates
+        self.assertEqual(info['Candidates'], 100)
+        self.assertEqual(info['Batches'], 4)
+
+    def test_prior_grid(self):
+        alpha_priors = np.array([[.1, .1], [.5, .5], [1., 2.]])
+        independent_priors = [.3, .7]
+        posteriors = prior_grid_posteriors(
+            self.world, self.experiences, self.p_same, alpha_priors,
+            independent_priors, model_prior_fnc=build_model_prior_simple)
+        self.assertEqual(posteriors.shape, (3, 2, self.num_joints,
+                                            self.num_joints + 1))
+        for a, alpha_prior in enumerate(alpha_priors):
+            for i, independent_prior in enumerate(independent_priors):
+                model_prior = build_model_prior_simple(self.world,
+                                                       independent_prior)
+                for j in range(self.num_joints):
+                    np.testing.assert_allclose(
+                        posteriors[a, i, j],
+                        model_posterior(self.experiences[j], self.p_same,
+                                        alpha_prior, model_prior[j]),
+                        rtol=1e-9, atol=1e-300)
+
+
+def fake_run(args, run, seed):
+    np.random.seed(seed)
+    return {'Run': run, 'Seed': seed, 'Value': np.random.uniform(),
+            'Pid': os.getpid()}
+
+
+class TestRunExperiments(unittest.TestCase):
+    def test_seeds(self):
+        seeds = [seed_for_run(7, run) for run in range(50)]
+        self.assertEqual(len(set(seeds)), 50)
+        self.assertEqual(seeds, [seed_for_run(7, run) for run in range(50)])
+        self.assertNotEqual(seeds[0], seed_for_run(8, 0))
+
+    def test_default_samples(self):
+        from joint_dependency.inference import (random_objective,
+                                                heuristic_proximity,
+                                                exp_neg_entropy)
+        args = build_parser().parse_args(['--objective', 'random'])
+        self.assertIsNone(args.samples)
+        # one random checked joint per sample
+        self.assertEqual(default_samples(random_objective), 4000)
+        self.assertEqual(default_samples(heuristic_proximity), 4000)
+        # every sample for every checked joint
+        self.assertEqual(default_samples(exp_cross_entropy), 1000)
+        self.assertEqual(default_samples(exp_neg_entropy), 1000)
+
+    def test_pool(self):
+        args = argparse.Namespace(runs=5, threads=2, seed=3)
+        summary = run_experiments(args, fake_run)
+        self.assertEqual(list(summary.index), list(range(5)))
+        self.assertEqual(list(summary['Seed']),
+                         [seed_for_run(3, run) for run in range(5)])
+        self.assertNotIn(os.getpid(), list(summary['Pid']))
+
+        # the same campaign in this process gives the same results
+        args.threads = 1
+        serial = run_experiments(args, fake_run)
+        np.testing.assert_array_equal(serial['Value'], summary['Value'])
+        self.assertEqual(set(serial['Pid']), {os.getpid()})
+
+
+def failing_sampling(N_samples, world, locked_states):
+    raise RuntimeError("the sampling failed")
+
+
+class RecordingScoringPool(ScoringPool):
+    closed = []
+
+    def close(self):
+        RecordingScoringPool.closed.append(self)
+        super(RecordingScoringPool, self).close()
+
+
+class TestDependencyLearning(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.workdir = tempfile.mkdtemp()
+        os.chdir(self.workdir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.workdir)
+
+    def test_failing_query_closes_scoring_pool(self):
+        world = create_world(2)
+        controllers = [Controller(world, j)
+                       for j in range(len(world.joints))]
+        action_machine = ActionMachine(world, controllers, .1)
+        with mock.patch.object(experiments, 'ScoringPool',
+                               RecordingScoringPool):
+            self.assertRaises(RuntimeError, dependency_learning, 2, 10,
+                              world, exp_cross_entropy, False,
+                              np.array([.1, .1]),
+                              build_model_prior_simple(world, .7),
+                              action_machine, None, failing_sampling, False,
+                              headless=True, scoring_workers=2)
+        self.assertEqual(len(RecordingScoringPool.closed), 1)
+        self.assertEqual(multiprocessing.active_children(), [])
+
+
+class TestStartup(unittest.TestCase):
+    def test_heavy_imports_are_lazy(self):
+        # the command line interface and the pool workers only pay for the
+        # heavy dependencies when a feature needs them
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.path.dirname(
+            os.path.dirname(os.path.abspath(joint_dependency.__file__)))
+        code = ("import sys, joint_dependency.experiments; "
+                "print(' '.join(sys.modules))")
+        modules = subprocess.check_output([sys.executable, '-c', code],
+                                          env=env).decode().split()
+        for heavy in ('pandas', 'scipy.stats', 'pyximport', 'progressbar',
+                      'blessings', 'dill', 'joint_dependency.inference_cy',
+                      'joint_dependency.inference_py'):
+            self.assertNotIn(heavy, modules)
@@ -0,0 +1,147 @@
+import unittest
+import numpy as np
+
+from joint_dependency import inference, inference_py
+from joint_dependency.histogram import ExperienceHistogram, occupied_bins
+from joint_dependency.tests.test_inference import (random_p_same,
+                                                   random_experiences,
+                                                   reference_model_posterior,
+                                                   skip_unless_compiled)
+
+
+class TestExperienceHistogram(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.RandomState(11)
+        self.num_joints = 3
+        self.p_same = random_p_same(self.num_joints, self.rng)
+        self.alpha_prior = np.array([.1, .1])
+        self.model_prior = np.array([.2, .1, 0., .7])
+        # queries at the joint limits only, as small_joint_state_sampling
+        # proposes them
+        self.experiences = [
+            {'data': self.rng.choice([0, 90, 180], size=self.num_joints),
+             'value': bool(self.rng.randint(2))}
+            for _ in range(30)]
+
+    def test_counts(self):
+        histogram = ExperienceHistogram(self.num_joints, 360,
+                                        experiences=self.experiences)
+        self.assertEqual(len(histogram), 30)
+        self.assertEqual(np.sum(histogram.counts), 30 * self.num_joints)
+        np.testing.assert_array_equal(
+            histogram.value_counts,
+            np.bincount([int(e['value']) for e in self.experiences],
+                        minlength=2))
+        for joint in range(self.num_joints):
+            bins, counts = histogram.occupied(joint)
+            self.assertTrue(set(bins) <= {0, 90, 180})
+            list_bins, list_counts = occupied_bins(self.experiences, joint)
+            np.testing.assert_array_equal(bins, list_bins)
+            np.testing.assert_array_equal(counts, list_counts)
+
+    def test_update_only_counts_new_experiences(self):
+        histogram = ExperienceHistogram(self.num_joints, 360,
+                                        experiences=self.experiences[:10])
+        histogram.update(self.experiences)
+        histogram.update(self.experiences)
+        expected = ExperienceHistogram(self.num_joints, 360,
+                                       experiences=self.experiences)
+        np.testing.assert_array_equal(histogram.counts, expected.counts)
+
+    def check_inference_over_occupied_bins(self, backend):
+        histogram = ExperienceHistogram(self.num_joints, 360,
+                                        experiences=self.experiences)
+        expected = reference_model_posterior(self.experiences, self.p_same,
+                                             self.alpha_prior,
+                                             self.model_prior)
+        joint_pos = np.array([90, 0, 180])
+        for experiences in (self.experiences, histogram):
+            np.testing.assert_allclose(
+                backend.model_posterior(experiences, self.p_same,
+                                        self.alpha_prior,
+                                        self.model_prior),
+                expected, rtol=1e-10)
+        for joint in range(self.num_joints):
+            np.testing.assert_allclose(
+                backend.create_alpha(joint_pos[joint], histogram,
+                                     joint, self.p_same[joint]),
+                backend.create_alpha(joint_pos[joint],
+                                     self.experiences, joint,
+                                     self.p_same[joint]))
+        np.testing.assert_allclose(
+            backend.prob_locked(histogram, joint_pos, self.p_same,
+                                self.alpha_prior,
+                                self.model_prior).alpha,
+            backend.prob_locked(self.experiences, joint_pos,
+                                self.p_same, self.alpha_prior,
+                                self.model_prior).alpha)
+
+    def test_inference_over_occupied_bins(self):
+        self.check_inference_over_occupied_bins(inference_py)
+
+    @skip_unless_compiled
+    def test_compiled_inference_over_occupied_bins(self):
+        self.check_inference_over_occupied_bins(
+            inference.load_backend('cython'))
+
+    def test_log_likelihood_dependent(self):
+        histogram = ExperienceHistogram(self.num_joints, 360,
+                                        experiences=self.experiences)
+        expected = [inference_py.log_likelihood_dependent(
+            self.experiences, joint, self.p_same, self.alpha_prior)
+            for joint in range(self.num_joints)]
+        try:
+            # the histogram computes it with the active backend
+            for name in inference.available_backends():
+                inference.use_backend(name)
+                np.testing.assert_allclose(
+                    histogram.log_likelihood_dependent(
+                        self.p_same, self.alpha_prior, [2, 0, 1]),
+                    [expected[2], expected[0], expected[1]], rtol=1e-10,
+                    err_msg=name)
+        finally:
+            inference.use_backend()
+
+    def check_contribution_table(self, backend):
+        experiences = random_experiences(25, self.num_joints, self.rng)
+        joint_pos = np.array([17, 90, 143])
+        table = backend.contribution_table(experiences, self.p_same)
+        self.assertEqual(table.shape, (self.num_joints, 360, 2))
+        for joint in range(self.num_joints):
+            for pos in (0, 42, 359):
+                np.testing.assert_allclose(
+                    table[joint, pos],
+                    backend.create_alpha(pos, experiences, joint,
+                                         self.p_same[joint]),
+                    rtol=1e-12)
+
+        model_post = backend.model_posterior(
+            experiences, self.p_same, self.alpha_prior, self.model_prior)
+        for post in (None, model_post):
+            np.testing.assert_allclose(
+                backend.prob_locked(experiences, joint_pos, self.p_same,
+                                    self.alpha_prior, self.model_prior,
+                                    post, table=table).alpha,
+                backend.prob_locked(experiences, joint_pos, self.p_same,
+                                    self.alpha_prior,
+                                    self.model_prior).alpha,
+                rtol=1e-12)
+
+    def test_contribution_table(self):
+        self.check_contribution_table(inference_py)
+
+    @skip_unless_compiled
+    def test_compiled_contribution_table(self):
+        self.check_contribution_table(inference.load_backend('cython'))
+
+    def test_create_alpha(self):
+        experiences = random_experiences(25, self.num_joints, self.rng)
+        joint = 1
+        expected = np.zeros((2,))
+        for e in experiences:
+            expected[int(e['value'])] += self.p_same[joint][e['data'][joint],
+                                                            42]
+        np.testing.assert_allclose(
+            inference_py.create_alpha(42, experiences, joint,
+                                      self.p_same[joint]),
+            expected, rtol=1e-12)
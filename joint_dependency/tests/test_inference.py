@@ -0,0 +1,295 @@
+import unittest
+import numpy as np
+from scipy.special import gammaln
+from scipy.stats import entropy
+
+from joint_dependency import inference, inference_py
+from joint_dependency.posterior import JointPosterior
+
+
+def reference_same_segment(probabilities):
+    n = len(probabilities)
+    pr = np.ones((n, n))
+    for s in range(n):
+        for t in range(s+1, n):
+            pr[s, t] = pr[t, s] = pr[s, t-1] * (1-probabilities[t-1])
+    return pr
+
+
+def reference_likelihood(values, alpha_prior):
+    A = np.sum(alpha_prior)
+    n = np.bincount(values, minlength=alpha_prior.shape[0])
+    lnp = gammaln(A) - gammaln(len(values) + A) + np.sum(
+        gammaln(n + alpha_prior) - gammaln(alpha_prior))
+    return np.exp(lnp)
+
+
+def reference_likelihood_dependent(experiences, dependent_joint, p_same,
+                                   alpha_prior):
+    p = 1.
+    for e in experiences:
+        buckets = np.array(alpha_prior)
+        pos = e['data'][dependent_joint]
+        for e2 in experiences:
+            pos2 = e2['data'][dependent_joint]
+            buckets[int(e2['value'])] += p_same[dependent_joint][pos][pos2]
+        p *= reference_likelihood(np.array([int(e['value'])]), buckets)
+    return p
+
+
+def reference_model_posterior(experiences, p_same, alpha_prior, model_prior):
+    values = np.array([e['value'] for e in experiences], dtype=int)
+    buckets = alpha_prior + np.bincount(values,
+                                        minlength=alpha_prior.shape[0])
+    _likelihood = np.zeros(model_prior.shape)
+    _likelihood[-1] = model_prior[-1] * reference_likelihood(values, buckets)
+    for dep_joint in range(model_prior.shape[0] - 1):
+        _likelihood[dep_joint] = model_prior[dep_joint] * \
+            reference_likelihood_dependent(experiences, dep_joint, p_same,
+                                           alpha_prior)
+    return _likelihood / np.sum(_likelihood)
+
+
+def reference_objectives(experiences, joint_pos, p_same, alpha_prior,
+                         model_prior):
+    # the expected cross entropy and negative entropy as they were defined
+    # originally, with a frozen Dirichlet and augmented experience lists
+    model_post = reference_model_posterior(experiences, p_same, alpha_prior,
+                                           model_prior)
+    output_likelihood = inference_py.prob_locked(experiences, joint_pos,
+                                                 p_same, alpha_prior,
+                                                 model_prior, model_post)
+    ce = ne = 0.
+    for value, prob in enumerate(output_likelihood.mean()):
+        augmented = experiences + [{'data': joint_pos, 'value': value}]
+        augmented_post = reference_model_posterior(augmented, p_same,
+                                                   alpha_prior, model_prior)
+        ce += prob * entropy(model_post, augmented_post)
+        ne -= prob * entropy(augmented_post)
+    return ce, ne
+
+
+def random_p_same(num_joints, rng):
+    p_same = []
+    for _ in range(num_joints):
+        p_cp = rng.uniform(0, .05, size=360)
+        p_same.append(inference_py.same_segment(p_cp))
+    return np.asarray(p_same)
+
+
+def random_experiences(num_experiences, num_joints, rng, max_pos=180):
+    return [{'data': rng.randint(0, max_pos, size=num_joints),
+             'value': bool(rng.randint(2))}
+            for _ in range(num_experiences)]
+
+
+# for the tests of the compiled backend, which load it with
+# `inference.load_backend('cython')` instead of using the forwarders of the
+# active backend
+skip_unless_compiled = unittest.skipUnless(
+    'cython' in inference.available_backends(),
+    "the compiled backend can't be loaded")
+
+
+class InferenceTestMixin(object):
+    inference = None
+
+    def setUp(self):
+        self.rng = np.random.RandomState(4)
+        self.num_joints = 4
+        self.p_same = random_p_same(self.num_joints, self.rng)
+        self.alpha_prior = np.array([.1, .1])
+        self.model_prior = np.array([.1, 0., .1, .1, .7])
+        self.experiences = random_experiences(12, self.num_joints, self.rng)
+
+    def test_same_segment(self):
+        p_cp = self.rng.uniform(0, .3, size=360)
+        p_cp[[20, 200]] = 1.
+        expected = reference_same_segment(p_cp)
+        actual = self.inference.same_segment(p_cp)
+        np.testing.assert_allclose(actual, expected, rtol=1e-10, atol=1e-300)
+        self.assertEqual(actual[20, 21], 0.)
+        self.assertGreater(actual[21, 200], 0.)
+        self.assertEqual(actual[21, 201], 0.)
+
+        p_cp = self.rng.uniform(0, .01, size=720)
+        np.testing.assert_allclose(self.inference.same_segment(p_cp),
+                                   reference_same_segment(p_cp), rtol=1e-10)
+
+    def test_resolution(self):
+        resolution = .5
+        p_same = np.asarray([self.inference.same_segment(
+            self.rng.uniform(0, .02, size=720))
+            for _ in range(self.num_joints)])
+        bins = random_experiences(12, self.num_joints, self.rng, 360)
+        degrees = [{'data': e['data'] * resolution, 'value': e['value']}
+                   for e in bins]
+        expected = reference_model_posterior(bins, p_same, self.alpha_prior,
+                                             self.model_prior)
+        actual = self.inference.model_posterior(degrees, p_same,
+                                                self.alpha_prior,
+                                                self.model_prior, resolution)
+        np.testing.assert_allclose(actual, expected, rtol=1e-10)
+
+        candidate = self.rng.randint(0, 360, size=self.num_joints)
+        for objective in (self.inference.exp_cross_entropy,
+                          self.inference.exp_cross_entropy_batch):
+            expected = objective(bins, candidate, p_same, self.alpha_prior,
+                                 self.model_prior)
+            actual = objective(degrees, candidate * resolution, p_same,
+                               self.alpha_prior, self.model_prior,
+                               resolution=resolution)
+            np.testing.assert_allclose(actual, expected, rtol=1e-10)
+
+    def test_likelihood_dependent(self):
+        for dep_joint in range(self.num_joints):
+            expected = reference_likelihood_dependent(
+                self.experiences, dep_joint, self.p_same, self.alpha_prior)
+            actual = self.inference.likelihood_dependent(
+                self.experiences, dep_joint, self.p_same, self.alpha_prior)
+            np.testing.assert_allclose(actual, expected, rtol=1e-10)
+
+    def test_model_posterior(self):
+        expected = reference_model_posterior(self.experiences, self.p_same,
+                                             self.alpha_prior,
+                                             self.model_prior)
+        actual = self.inference.model_posterior(self.experiences, self.p_same,
+                                                self.alpha_prior,
+                                                self.model_prior)
+        np.testing.assert_allclose(actual, expected, rtol=1e-10)
+        self.assertEqual(actual[1], 0.)
+
+    def test_model_posterior_without_experiences(self):
+        actual = self.inference.model_posterior([], self.p_same,
+                                                self.alpha_prior,
+                                                self.model_prior)
+        np.testing.assert_allclose(actual, self.model_prior /
+                                   np.sum(self.model_prior))
+
+
+    def test_model_posterior_long_session(self):
+        experiences = random_experiences(1500, self.num_joints, self.rng)
+        log_post = self.inference.log_model_posterior(
+            experiences, self.p_same, self.alpha_prior, self.model_prior)
+        self.assertEqual(log_post[1], -np.inf)
+        post = self.inference.model_posterior(
+            experiences, self.p_same, self.alpha_prior, self.model_prior)
+        self.assertTrue(np.all(np.isfinite(post)))
+        self.assertAlmostEqual(np.sum(post), 1.)
+        np.testing.assert_allclose(post, np.exp(log_post))
+
+    def test_objectives_long_session(self):
+        experiences = random_experiences(400, self.num_joints, self.rng)
+        joint_pos = self.rng.randint(0, 180, size=self.num_joints)
+        ce = self.inference.exp_cross_entropy(experiences, joint_pos,
+                                              self.p_same, self.alpha_prior,
+                                              self.model_prior)
+        ne = self.inference.exp_neg_entropy(experiences, joint_pos,
+                                            self.p_same, self.alpha_prior,
+                                            self.model_prior)
+        self.assertTrue(np.isfinite(ce))
+        self.assertGreaterEqual(ce, 0.)
+        self.assertTrue(np.isfinite(ne))
+        self.assertLessEqual(ne, 0.)
+
+    def test_objectives(self):
+        for num_experiences in (0, 1, 10):
+            experiences = random_experiences(num_experiences,
+                                             self.num_joints, self.rng)
+            joint_pos = self.rng.randint(0, 180, size=self.num_joints)
+            ce, ne = reference_objectives(experiences, joint_pos, self.p_same,
+                                          self.alpha_prior, self.model_prior)
+            self.assertAlmostEqual(
+                self.inference.exp_cross_entropy(experiences, joint_pos,
+                                                 self.p_same,
+                                                 self.alpha_prior,
+                                                 self.model_prior), ce)
+            self.assertAlmostEqual(
+                self.inference.exp_neg_entropy(experiences, joint_pos,
+                                               self.p_same, self.alpha_prior,
+                                               self.model_prior), ne)
+
+    def test_batch_objectives_out(self):
+        experiences = random_experiences(10, self.num_joints, self.rng)
+        candidates = self.rng.randint(0, 180, size=(6, self.num_joints))
+        out = np.zeros((10,))
+        values = self.inference.exp_neg_entropy_batch(
+            experiences, candidates, self.p_same, self.alpha_prior,
+            self.model_prior, out=out[2:8])
+        self.assertIs(values.base, out)
+        np.testing.assert_allclose(
+            out[2:8], self.inference.exp_neg_entropy_batch(
+                experiences, candidates, self.p_same, self.alpha_prior,
+                self.model_prior))
+
+    def test_batch_objectives(self):
+        for num_experiences in (0, 1, 15):
+            experiences = random_experiences(num_experiences,
+                                             self.num_joints, self.rng)
+            candidates = self.rng.randint(0, 180, size=(8, self.num_joints))
+            for objective, batch_objective in [
+                    (self.inference.exp_cross_entropy,
+                     self.inference.exp_cross_entropy_batch),
+                    (self.inference.exp_neg_entropy,
+                     self.inference.exp_neg_entropy_batch)]:
+                expected = [objective(experiences, candidate, self.p_same,
+                                      self.alpha_prior, self.model_prior)
+                            for candidate in candidates]
+                actual = batch_objective(experiences, candidates, self.p_same,
+                                         self.alpha_prior, self.model_prior)
+                self.assertEqual(actual.shape, (8,))
+                np.testing.assert_allclose(actual, expected, rtol=1e-9,
+                                           atol=1e-12)
+
+    def test_model_posterior_grid(self):
+        alpha_priors = np.array([[.1, .1], [.3, 1.], [2., 2.]])
+        model_priors = np.array([self.model_prior, [.3, 0., .3, .3, .1]])
+        grid = self.inference.model_posterior_grid(
+            self.experiences, self.p_same, alpha_priors, model_priors)
+        self.assertEqual(grid.shape, (3, 2, 5))
+        for a, alpha_prior in enumerate(alpha_priors):
+            for m, model_prior in enumerate(model_priors):
+                np.testing.assert_allclose(
+                    grid[a, m],
+                    self.inference.model_posterior(self.experiences,
+                                                   self.p_same, alpha_prior,
+                                                   model_prior),
+                    rtol=1e-10)
+
+    def test_all_joint_objectives(self):
+        model_priors = self.rng.dirichlet(np.ones(self.num_joints + 1),
+                                          size=self.num_joints)
+        model_priors[np.arange(self.num_joints),
+                     np.arange(self.num_joints)] = 0.
+        experiences = [random_experiences(n, self.num_joints, self.rng)
+                       for n in (0, 9, 3, 14)]
+        joint_posteriors = [JointPosterior(self.p_same, self.alpha_prior,
+                                           model_priors[k], experiences[k])
+                            for k in range(self.num_joints)]
+        candidates = self.rng.randint(0, 180, size=(7, self.num_joints))
+        for batch_objective, all_joint_objective in [
+                (self.inference.exp_cross_entropy_batch,
+                 self.inference.exp_cross_entropy_all_joints),
+                (self.inference.exp_neg_entropy_batch,
+                 self.inference.exp_neg_entropy_all_joints)]:
+            actual = all_joint_objective(joint_posteriors, candidates,
+                                         self.alpha_prior)
+            self.assertEqual(actual.shape, (self.num_joints, 7))
+            for k in range(self.num_joints):
+                np.testing.assert_allclose(
+                    actual[k],
+                    batch_objective(experiences[k], candidates, self.p_same,
+                                    self.alpha_prior, model_priors[k]),
+                    rtol=1e-9, atol=1e-12)
+
+
+class TestInferencePy(InferenceTestMixin, unittest.TestCase):
+    inference = inference_py
+
+
+@skip_unless_compiled
+class TestInferenceCy(InferenceTestMixin, unittest.TestCase):
+    def setUp(self):
+        # the compiled backend itself, not the forwarders of the active one
+        self.inference = inference.load_backend('cython')
+        super(TestInferenceCy, self).setUp()
@@ -0,0 +1,249 @@
+import unittest
+import numpy as np
+
+from joint_dependency import inference_py
+from joint_dependency.posterior import (JointPosterior, PosteriorCache,
+                                        augment_all)
+from joint_dependency.psame import PSame
+from joint_dependency.tests.test_inference import (random_p_same,
+                                                   random_experiences)
+
+
+class TestJointPosterior(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.RandomState(7)
+        self.num_joints = 4
+        self.p_same = random_p_same(self.num_joints, self.rng)
+        self.alpha_prior = np.array([.1, .1])
+        self.model_prior = np.array([.1, .1, 0., .1, .7])
+        self.experiences = random_experiences(40, self.num_joints, self.rng)
+
+    def test_empty(self):
+        jp = JointPosterior(self.p_same, self.alpha_prior, self.model_prior)
+        np.testing.assert_allclose(jp.posterior, self.model_prior /
+                                   np.sum(self.model_prior))
+
+    def test_append_matches_model_posterior(self):
+        jp = JointPosterior(self.p_same, self.alpha_prior, self.model_prior)
+        for n, experience in enumerate(self.experiences):
+            jp.append(experience)
+            expected = inference_py.model_posterior(
+                self.experiences[:n + 1], self.p_same, self.alpha_prior,
+                self.model_prior)
+            np.testing.assert_allclose(jp.posterior, expected, rtol=1e-9)
+
+    def test_update_only_adds_new_experiences(self):
+        jp = JointPosterior(self.p_same, self.alpha_prior, self.model_prior,
+                            self.experiences[:10])
+        self.assertEqual(jp.num_experiences, 10)
+        jp.update(self.experiences)
+        self.assertEqual(jp.num_experiences, len(self.experiences))
+        jp.update(self.experiences)
+        self.assertEqual(jp.num_experiences, len(self.experiences))
+
+        expected = inference_py.model_posterior(
+            self.experiences, self.p_same, self.alpha_prior, self.model_prior)
+        np.testing.assert_allclose(jp.posterior, expected, rtol=1e-9)
+
+    def test_long_session(self):
+        experiences = random_experiences(1500, self.num_joints, self.rng)
+        jp = JointPosterior(self.p_same, self.alpha_prior, self.model_prior,
+                            experiences)
+        expected = inference_py.log_model_posterior(
+            experiences, self.p_same, self.alpha_prior, self.model_prior)
+        self.assertTrue(np.all(np.isfinite(jp.posterior)))
+        np.testing.assert_allclose(jp.log_posterior[[0, 1, 3, 4]],
+                                   expected[[0, 1, 3, 4]], rtol=1e-9)
+
+    def test_extend_matches_append(self):
+        appended = JointPosterior(self.p_same, self.alpha_prior,
+                                  self.model_prior)
+        for experience in self.experiences:
+            appended.append(experience)
+        extended = JointPosterior(self.p_same, self.alpha_prior,
+                                  self.model_prior, self.experiences[:5])
+        extended.extend(self.experiences[5:])
+        np.testing.assert_allclose(extended.sums, appended.sums)
+        np.testing.assert_allclose(extended.posterior, appended.posterior)
+
+    def test_compact_experiences(self):
+        jp = JointPosterior(self.p_same, self.alpha_prior, self.model_prior,
+                            self.experiences[:10])
+        jp.extend(self.experiences[10:])
+        self.assertEqual(jp.positions.dtype, np.int16)
+        self.assertEqual(jp.values.dtype, np.uint8)
+        self.assertEqual(jp.positions.shape, (40, self.num_joints))
+        np.testing.assert_array_equal(
+            jp.values, [e['value'] for e in self.experiences])
+
+    def test_table_follows_experiences(self):
+        jp = JointPosterior(self.p_same, self.alpha_prior, self.model_prior,
+                            self.experiences[:15])
+        jp.update(self.experiences)
+        expected = inference_py.contribution_table(self.experiences,
+                                                   self.p_same)
+        self.assertEqual(jp.table.shape, (self.num_joints, 360, 2))
+        np.testing.assert_allclose(jp.table, expected, rtol=1e-10)
+
+    def test_augmented_log_posterior(self):
+        jp = JointPosterior(self.p_same, self.alpha_prior, self.model_prior,
+                            self.experiences)
+        candidates = self.rng.randint(0, 180, size=(5, self.num_joints))
+        batch = jp.augmented_log_posterior(candidates)
+        self.assertEqual(batch.shape, (5, 2, 5))
+        for c, joint_pos in enumerate(candidates):
+            single = jp.augmented_log_posterior(joint_pos)
+            np.testing.assert_allclose(single, batch[c])
+            for value in range(2):
+                augmented = self.experiences + [{'data': joint_pos,
+                                                 'value': value}]
+                expected = inference_py.log_model_posterior(
+                    augmented, self.p_same, self.alpha_prior,
+                    self.model_prior)
+                np.testing.assert_allclose(np.exp(single[value]),
+                                           np.exp(expected), atol=1e-12)
+        # augmenting does not change the state
+        self.assertEqual(jp.num_experiences, len(self.experiences))
+
+
+class TestPosteriorCache(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.RandomState(3)
+        self.num_joints = 3
+        self.p_same = list(random_p_same(self.num_joints, self.rng))
+        self.alpha_prior = np.array([.1, .1])
+        self.model_prior = np.array([[0., .2, .1, .7],
+                                     [.2, 0., .1, .7],
+                                     [.1, .2, 0., .7]])
+        self.experiences = [random_experiences(10, self.num_joints, self.rng)
+                            for _ in range(self.num_joints)]
+        self.cache = PosteriorCache(self.alpha_prior, self.model_prior)
+
+    def test_p_same_built_once(self):
+        tensor = self.cache.p_same(self.p_same)
+        self.assertEqual(tensor.shape, (self.num_joints, 360, 360))
+        self.assertIs(self.cache.p_same(self.p_same), tensor)
+        self.assertIsNot(self.cache.p_same(list(self.p_same)), tensor)
+
+    def test_joint_posterior_follows_experiences(self):
+        self.cache.p_same(self.p_same)
+        first = self.cache.joint_posterior(1, self.experiences[1])
+        self.assertIs(self.cache.joint_posterior(1, self.experiences[1]),
+                      first)
+
+        self.experiences[1].extend(
+            random_experiences(3, self.num_joints, self.rng))
+        updated = self.cache.joint_posterior(1, self.experiences[1])
+        self.assertIs(updated, first)
+        self.assertEqual(updated.num_experiences, 13)
+        expected = inference_py.model_posterior(
+            self.experiences[1], np.asarray(self.p_same), self.alpha_prior,
+            self.model_prior[1])
+        np.testing.assert_allclose(updated.posterior, expected, rtol=1e-9)
+
+        # a different list of experiences invalidates the posterior
+        other = self.cache.joint_posterior(1, self.experiences[1][:5])
+        self.assertIsNot(other, first)
+        self.assertEqual(other.num_experiences, 5)
+
+    def test_new_p_same_invalidates_posteriors(self):
+        first = self.cache.joint_posterior(0, self.experiences[0],
+                                           self.p_same)
+        second = self.cache.joint_posterior(0, self.experiences[0],
+                                            list(self.p_same))
+        self.assertIsNot(first, second)
+
+
+class TestModelPruning(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.RandomState(12)
+        self.num_joints = 6
+        p_cp = [np.full(360, .01) for _ in range(self.num_joints)]
+        # joint 4 locks joint 5 below 90 degrees
+        p_cp[4][90] = 1.
+        self.p_same = PSame(p_cp)
+        self.alpha_prior = np.array([.1, .1])
+        self.model_prior = np.array([.2, .15, .1, .1, .05, 0., .4])
+        self.experiences = [{'data': data, 'value': data[4] < 90}
+                            for data in self.rng.randint(
+                                0, 180, size=(30, self.num_joints))]
+
+    def test_tracked_posterior_is_restricted(self):
+        full = JointPosterior(self.p_same, self.alpha_prior, self.model_prior,
+                              self.experiences)
+        pruned = JointPosterior(self.p_same, self.alpha_prior,
+                                self.model_prior, self.experiences,
+                                models=[1, 4])
+        expected = np.zeros(self.model_prior.shape)
+        expected[[1, 4, 6]] = full.posterior[[1, 4, 6]]
+        np.testing.assert_allclose(pruned.posterior,
+                                   expected / np.sum(expected), rtol=1e-9)
+
+        candidates = self.rng.randint(0, 180, size=(5, self.num_joints))
+        full_augmented, full_counts = full.augment(candidates)
+        augmented, counts = pruned.augment(candidates)
+        expected = np.zeros(full_augmented.shape)
+        expected[..., [1, 4, 6]] = np.exp(full_augmented[..., [1, 4, 6]])
+        np.testing.assert_allclose(
+            np.exp(augmented),
+            expected / np.sum(expected, axis=-1)[..., None], rtol=1e-9)
+        np.testing.assert_allclose(counts[[1, 4]], full_counts[[1, 4]])
+
+    def test_select_models(self):
+        jp = JointPosterior(self.p_same, self.alpha_prior, self.model_prior,
+                            models=[])
+        np.testing.assert_allclose(jp.select_models(top_k=2),
+                                   self.model_prior)
+        np.testing.assert_array_equal(jp.models, [0, 1])
+        self.assertAlmostEqual(jp.pruned_mass, .25)
+
+        jp.extend(self.experiences)
+        expected = inference_py.model_posterior(
+            self.experiences, np.asarray(self.p_same), self.alpha_prior,
+            self.model_prior)
+        np.testing.assert_allclose(jp.select_models(top_k=2), expected,
+                                   rtol=1e-9)
+        # the locking joint is re-admitted
+        self.assertIn(4, jp.models)
+        self.assertAlmostEqual(
+            jp.pruned_mass,
+            np.sum(np.delete(expected[:-1], jp.models)))
+
+        full = JointPosterior(self.p_same, self.alpha_prior, self.model_prior,
+                              self.experiences, models=jp.models)
+        np.testing.assert_allclose(jp.sums, full.sums, rtol=1e-12)
+        np.testing.assert_allclose(jp.table, full.table, rtol=1e-12)
+        np.testing.assert_allclose(jp.posterior, full.posterior, rtol=1e-12)
+
+    def test_threshold(self):
+        jp = JointPosterior(self.p_same, self.alpha_prior, self.model_prior,
+                            self.experiences)
+        posterior = jp.select_models(threshold=1e-3)
+        np.testing.assert_array_equal(
+            jp.models, np.flatnonzero(posterior[:-1] >= 1e-3))
+        self.assertLess(jp.pruned_mass, 1e-3 * self.num_joints)
+
+    def test_cache_rechecks(self):
+        model_prior = np.tile(self.model_prior, (self.num_joints, 1))
+        cache = PosteriorCache(self.alpha_prior, model_prior, top_k=2,
+                               recheck=10)
+        cache.p_same(self.p_same)
+        experiences = []
+        jp = cache.joint_posterior(5, experiences)
+        np.testing.assert_array_equal(jp.models, [0, 1])
+        experiences.extend(self.experiences[:9])
+        np.testing.assert_array_equal(
+            cache.joint_posterior(5, experiences).models, [0, 1])
+        experiences.extend(self.experiences[9:])
+        self.assertIn(4, cache.joint_posterior(5, experiences).models)
+
+        # scoring all checked joints with different tracked models
+        posteriors = cache.joint_posteriors([self.experiences[:3]] * 5 +
+                                            [experiences])
+        candidates = self.rng.randint(0, 180, size=(4, self.num_joints))
+        augmented, counts = augment_all(posteriors, candidates)
+        for k, jp in enumerate(posteriors):
+            single, single_counts = jp.augment(candidates)
+            np.testing.assert_allclose(np.exp(augmented[k]), np.exp(single),
+                                       atol=1e-12)
+            np.testing.assert_allclose(counts[k], single_counts)
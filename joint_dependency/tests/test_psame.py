@@ -0,0 +1,192 @@
+import pickle
+import unittest
+import numpy as np
+
+from joint_dependency import inference, inference_py
+from joint_dependency.posterior import JointPosterior, PosteriorCache
+from joint_dependency.psame import PSame, SINGLE_PRECISION_ATOL
+from joint_dependency.tests.test_inference import (reference_same_segment,
+                                                   random_experiences,
+                                                   skip_unless_compiled)
+
+
+class TestPSame(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.RandomState(5)
+        self.p_cp = [self.rng.uniform(0, .05, size=360) for _ in range(3)]
+        self.p_cp[1][[40, 250]] = 1.
+        self.p_same = PSame(self.p_cp)
+        self.dense = np.asarray([reference_same_segment(pcp)
+                                 for pcp in self.p_cp])
+
+    def test_dense(self):
+        self.assertEqual(self.p_same.shape, (3, 360, 360))
+        np.testing.assert_allclose(np.asarray(self.p_same), self.dense,
+                                   rtol=1e-10, atol=1e-300)
+
+    def test_lookups(self):
+        np.testing.assert_allclose(self.p_same[1, 30, 300],
+                                   self.dense[1, 30, 300])
+        np.testing.assert_allclose(self.p_same[2][10][200],
+                                   self.dense[2, 10, 200], rtol=1e-10)
+        np.testing.assert_allclose(self.p_same[0, 17], self.dense[0, 17],
+                                   rtol=1e-10)
+        np.testing.assert_allclose(self.p_same[1][41], self.dense[1, 41],
+                                   rtol=1e-10, atol=1e-300)
+        self.assertEqual(self.p_same[1].shape, (360, 360))
+
+        joints = np.array([0, 2, 1])[:, None, None]
+        s = self.rng.randint(0, 360, size=(3, 5, 1))
+        t = self.rng.randint(0, 360, size=(3, 1, 4))
+        np.testing.assert_allclose(self.p_same[joints, s, t],
+                                   self.dense[joints, s, t], rtol=1e-10,
+                                   atol=1e-300)
+
+    def test_identical_profiles_are_shared(self):
+        p_same = PSame([np.array([.1] * 360)] * 5)
+        self.assertEqual(len(p_same), 5)
+        self.assertEqual(p_same.num_profiles, 1)
+        self.assertLess(p_same.nbytes, 360 * 360 * 8)
+        np.testing.assert_allclose(p_same[4, 3, 9], .9 ** 6)
+
+    def test_pickle(self):
+        p_same = pickle.loads(pickle.dumps(self.p_same))
+        np.testing.assert_array_equal(np.asarray(p_same),
+                                      np.asarray(self.p_same))
+
+    def check_inference_accepts_psame(self, backend):
+        alpha_prior = np.array([.1, .1])
+        model_prior = np.array([0., .1, .2, .7])
+        experiences = random_experiences(20, 3, self.rng)
+        candidates = self.rng.randint(0, 180, size=(6, 3))
+        dense = np.asarray(self.p_same)
+        np.testing.assert_allclose(
+            backend.model_posterior(experiences, self.p_same, alpha_prior,
+                                    model_prior),
+            backend.model_posterior(experiences, dense, alpha_prior,
+                                    model_prior), rtol=1e-10)
+        np.testing.assert_allclose(
+            backend.exp_cross_entropy_batch(experiences, candidates,
+                                            self.p_same, alpha_prior,
+                                            model_prior),
+            backend.exp_cross_entropy_batch(experiences, candidates, dense,
+                                            alpha_prior, model_prior),
+            rtol=1e-10)
+        np.testing.assert_allclose(
+            backend.exp_neg_entropy(experiences, candidates[0], self.p_same,
+                                    alpha_prior, model_prior),
+            backend.exp_neg_entropy(experiences, candidates[0], dense,
+                                    alpha_prior, model_prior), rtol=1e-10)
+
+        posterior = JointPosterior(self.p_same, alpha_prior, model_prior,
+                                   experiences)
+        np.testing.assert_allclose(
+            posterior.posterior,
+            inference_py.model_posterior(experiences, dense, alpha_prior,
+                                         model_prior), rtol=1e-10)
+
+    def test_inference_accepts_psame(self):
+        self.check_inference_accepts_psame(inference_py)
+
+    @skip_unless_compiled
+    def test_compiled_inference_accepts_psame(self):
+        self.check_inference_accepts_psame(inference.load_backend('cython'))
+
+    @skip_unless_compiled
+    def test_compiled_kernels(self):
+        inference_cy = inference.load_backend('cython')
+        alpha_prior = np.array([.1, .1])
+        model_prior = np.array([.1, .3, 0., .6])
+        experiences = random_experiences(40, 3, self.rng)
+        candidates = self.rng.randint(0, 180, size=(9, 3))
+        dense = np.asarray(self.p_same)
+        for p_same in (self.p_same, dense):
+            np.testing.assert_allclose(
+                inference_cy.contribution_table(experiences, p_same),
+                inference_py.contribution_table(experiences, p_same),
+                rtol=1e-10, atol=1e-300)
+            np.testing.assert_allclose(
+                inference_cy.create_alpha(77, experiences, 1, p_same[1]),
+                inference_py.create_alpha(77, experiences, 1, p_same[1]),
+                rtol=1e-10)
+            for objective in ('exp_cross_entropy_batch',
+                              'exp_neg_entropy_batch'):
+                np.testing.assert_allclose(
+                    getattr(inference_cy, objective)(
+                        experiences, candidates, p_same, alpha_prior,
+                        model_prior),
+                    getattr(inference_py, objective)(
+                        experiences, candidates, p_same, alpha_prior,
+                        model_prior), rtol=1e-9, atol=1e-12)
+
+        # pruned posteriors only track some of the models
+        cache = PosteriorCache(alpha_prior, [model_prior] * 3, top_k=2)
+        joint_posteriors = cache.joint_posteriors([experiences] * 3,
+                                                  self.p_same)
+        for objective in ('exp_cross_entropy_all_joints',
+                          'exp_neg_entropy_all_joints'):
+            np.testing.assert_allclose(
+                getattr(inference_cy, objective)(joint_posteriors,
+                                                 candidates, alpha_prior),
+                getattr(inference_py, objective)(joint_posteriors,
+                                                 candidates, alpha_prior),
+                rtol=1e-9, atol=1e-12)
+
+
+class TestSinglePrecision(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.RandomState(9)
+        p_cp = [self.rng.uniform(0, .05, size=360) for _ in range(4)]
+        self.p_same = PSame(p_cp)
+        self.p_same32 = PSame(p_cp, dtype=np.float32)
+        self.alpha_prior = np.array([.1, .1])
+        self.model_prior = np.array([.1, 0., .1, .1, .7])
+
+    def test_dtype(self):
+        self.assertEqual(self.p_same32.dtype, np.float32)
+        self.assertEqual(np.asarray(self.p_same32).dtype, np.float32)
+        self.assertEqual(self.p_same32[1, 3].dtype, np.float32)
+        self.assertEqual(self.p_same.astype(np.float32).dtype, np.float32)
+        np.testing.assert_allclose(np.asarray(self.p_same32),
+                                   np.asarray(self.p_same), rtol=1e-5)
+
+        experiences = random_experiences(10, 4, self.rng)
+        posterior = JointPosterior(self.p_same32, self.alpha_prior,
+                                   self.model_prior, experiences)
+        self.assertEqual(posterior.sums.dtype, np.float32)
+        self.assertEqual(posterior.posterior.dtype, np.float64)
+
+    def check_tolerance(self, backend):
+        experiences = random_experiences(1000, 4, self.rng)
+        candidates = self.rng.randint(0, 180, size=(20, 4))
+        dense32 = np.asarray(self.p_same32)
+        expected = backend.model_posterior(
+            experiences, self.p_same, self.alpha_prior, self.model_prior)
+        for p_same in (self.p_same32, dense32):
+            np.testing.assert_allclose(
+                backend.model_posterior(experiences, p_same,
+                                        self.alpha_prior, self.model_prior),
+                expected, atol=SINGLE_PRECISION_ATOL)
+        for objective in (backend.exp_cross_entropy_batch,
+                          backend.exp_neg_entropy_batch):
+            np.testing.assert_allclose(
+                objective(experiences, candidates, self.p_same32,
+                          self.alpha_prior, self.model_prior),
+                objective(experiences, candidates, self.p_same,
+                          self.alpha_prior, self.model_prior),
+                atol=SINGLE_PRECISION_ATOL)
+        np.testing.assert_allclose(
+            backend.exp_cross_entropy(experiences[:50], candidates[0],
+                                      self.p_same32, self.alpha_prior,
+                                      self.model_prior),
+            backend.exp_cross_entropy(experiences[:50], candidates[0],
+                                      self.p_same, self.alpha_prior,
+                                      self.model_prior),
+            atol=SINGLE_PRECISION_ATOL)
+
+    def test_tolerance(self):
+        self.check_tolerance(inference_py)
+
+    @skip_unless_compiled
+    def test_compiled_tolerance(self):
+        self.check_tolerance(inference.load_backend('cython'))
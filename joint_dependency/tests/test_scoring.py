@@ -0,0 +1,83 @@
+import unittest
+import numpy as np
+
+from joint_dependency import inference
+from joint_dependency.posterior import JointPosterior, PosteriorCache
+from joint_dependency.psame import PSame
+from joint_dependency.scoring import SharedState, ScoringPool, attach
+from joint_dependency.tests.test_inference import random_experiences
+
+
+def worker_threads(_):
+    import os
+    cython = inference.load_backend('cython')
+    return os.environ.get('OMP_NUM_THREADS'), cython._max_threads()
+
+
+class TestScoring(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.RandomState(17)
+        self.num_joints = 3
+        self.p_same = PSame([self.rng.uniform(0, .05, size=360)
+                             for _ in range(self.num_joints)])
+        self.alpha_prior = np.array([.1, .1])
+        self.model_prior = np.array([.1, .2, .1, .6])
+        self.experiences = [random_experiences(n, self.num_joints, self.rng)
+                            for n in (4, 0, 25)]
+        self.candidates = self.rng.randint(0, 180,
+                                           size=(11, self.num_joints))
+
+    def test_shared_state(self):
+        posterior = JointPosterior(self.p_same, self.alpha_prior,
+                                   self.model_prior, self.experiences[2])
+        state = SharedState(posterior)
+        self.assertGreater(state.nbytes, posterior.sums.nbytes)
+        try:
+            copy, blocks = attach(state.handle)
+            np.testing.assert_array_equal(copy.sums, posterior.sums)
+            np.testing.assert_array_equal(copy.table, posterior.table)
+            # the arrays are views of the shared memory, not copies
+            self.assertTrue(any(np.shares_memory(
+                np.frombuffer(block.buf, dtype=np.uint8), copy.sums)
+                for block in blocks))
+            np.testing.assert_allclose(copy.posterior, posterior.posterior)
+            del copy
+        finally:
+            state.close()
+
+    def test_pool_matches_serial(self):
+        for p_same, cache in [
+                (self.p_same, PosteriorCache(self.alpha_prior,
+                                             [self.model_prior] * 3)),
+                (np.asarray(self.p_same),
+                 PosteriorCache(self.alpha_prior, [self.model_prior] * 3,
+                                top_k=2))]:
+            joint_posteriors = cache.joint_posteriors(self.experiences,
+                                                      p_same)
+            with ScoringPool(2) as pool:
+                for objective in (inference.exp_cross_entropy_all_joints,
+                                  inference.exp_neg_entropy_all_joints):
+                    for _ in range(2):
+                        np.testing.assert_allclose(
+                            pool.score(objective, joint_posteriors,
+                                       self.candidates, self.alpha_prior),
+                            objective(joint_posteriors, self.candidates,
+                                      self.alpha_prior), rtol=1e-12)
+                # more workers than candidates
+                np.testing.assert_allclose(
+                    pool.score(inference.exp_cross_entropy_all_joints,
+                               joint_posteriors, self.candidates[:1],
+                               self.alpha_prior),
+                    inference.exp_cross_entropy_all_joints(
+                        joint_posteriors, self.candidates[:1],
+                        self.alpha_prior), rtol=1e-12)
+
+    @unittest.skipUnless('cython' in inference.available_backends(),
+                         "the compiled backend can't be loaded")
+    def test_one_openmp_thread_per_worker(self):
+        # the compiled kernels ran here before, the workers neither inherit
+        # nor oversubscribe the OpenMP threads
+        inference.load_backend('cython')._max_threads()
+        with ScoringPool(2) as pool:
+            self.assertEqual(pool._pool.map(worker_threads, range(2)),
+                             [('1', 1)] * 2)
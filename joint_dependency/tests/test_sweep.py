@@ -0,0 +1,134 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from joint_dependency.sweep import expand, run_hash, run_sweep
+
+
+def fake_run(args, run, seed):
+    # the sweep is killed at the run with the seed in SWEEP_KILL_SEED
+    if str(seed) == os.environ.get('SWEEP_KILL_SEED'):
+        raise KeyboardInterrupt
+    if "{}:{}".format(args.objective, args.samples) == os.environ.get(
+            'SWEEP_FAIL'):
+        raise RuntimeError("the run failed")
+    with open(os.path.join(os.environ['SWEEP_LOG_DIR'], "{}_{}_{}".format(
+            args.objective, args.samples, run)), 'w') as _file:
+        _file.write(str(os.getpid()))
+    with open("data_run{}.pkl".format(run), 'wb') as _file:
+        _file.write(str(seed).encode())
+    return {'Run': run, 'Seed': seed, 'Queries': args.queries,
+            'Filename': "data_run{}.pkl".format(run)}
+
+
+class TestSweep(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.log_dir = tempfile.mkdtemp()
+        os.environ['SWEEP_LOG_DIR'] = self.log_dir
+        self.sweep = {'base': {'queries': 7},
+                      'grid': {'objective': ['random', 'entropy'],
+                               'samples': [10, 20]},
+                      'runs': 2, 'seed': 3}
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+        shutil.rmtree(self.log_dir)
+        os.environ.pop('SWEEP_LOG_DIR', None)
+        os.environ.pop('SWEEP_KILL_SEED', None)
+        os.environ.pop('SWEEP_FAIL', None)
+
+    def runs(self):
+        return sorted(os.listdir(self.log_dir))
+
+    def test_expand(self):
+        specs = expand({'base': {'queries': 7},
+                        'grid': {'objective': ['random', 'entropy'],
+                                 'samples': [10, 20, 30]},
+                        'runs': 2, 'seed': 3})
+        self.assertEqual(len(specs), 12)
+        self.assertEqual(len(set(run_hash(spec) for spec in specs)), 12)
+        # every configuration runs on the same seeds
+        self.assertEqual(set(spec['seed'] for spec in specs if
+                             spec['run'] == 0), {specs[0]['seed']})
+        self.assertNotEqual(specs[0]['seed'], specs[1]['seed'])
+        self.assertTrue(all(spec['args']['queries'] == 7 for spec in specs))
+        self.assertEqual(specs[0]['args']['joint_state'], 'large')
+        self.assertRaises(ValueError, expand, {'grid': {'querys': [1]}})
+
+    def test_expand_checks_values(self):
+        # the values are converted and checked like on the command line,
+        # before anything runs
+        for grid in ({'joint_state': ['large', 'medium']},
+                     {'queries': [10, 'many']},
+                     {'headless': ['yes']}):
+            self.assertRaises(ValueError, expand, {'grid': grid})
+        specs = expand({'grid': {'resolution': [1, 1.0, '1']},
+                        'base': {'headless': True, 'top_k': None}})
+        self.assertEqual(len(set(run_hash(spec) for spec in specs)), 1)
+        self.assertIsInstance(specs[0]['args']['resolution'], float)
+        self.assertTrue(specs[0]['args']['headless'])
+        self.assertEqual(specs[0]['args']['objective'], 'random')
+
+    def test_hash(self):
+        spec = expand({'runs': 1})[0]
+        other = dict(spec, args=dict(spec['args'], threads=8, headless=True,
+                                     backend='numpy'))
+        self.assertEqual(run_hash(spec), run_hash(other))
+        other = dict(spec, args=dict(spec['args'], queries=1))
+        self.assertNotEqual(run_hash(spec), run_hash(other))
+        self.assertNotEqual(run_hash(spec), run_hash(dict(spec, seed=1)))
+
+    def test_resume(self):
+        specs = expand(self.sweep)
+        # the sweep is killed at the second run
+        os.environ['SWEEP_KILL_SEED'] = str(specs[1]['seed'])
+        self.assertRaises(KeyboardInterrupt, run_sweep, self.sweep,
+                          self.output_dir, run_fnc=fake_run)
+        self.assertEqual(len(self.runs()), 1)
+
+        del os.environ['SWEEP_KILL_SEED']
+        summary = run_sweep(self.sweep, self.output_dir, run_fnc=fake_run)
+        self.assertEqual(len(summary), 8)
+        self.assertEqual(len(self.runs()), 8)
+        self.assertEqual(sorted(summary['objective'].unique()),
+                         ['entropy', 'random'])
+        self.assertTrue((summary['Queries'] == 7).all())
+        self.assertNotIn('Filename', summary.columns)
+        for _, row in summary.iterrows():
+            path = os.path.join(self.output_dir, row['Files'][0])
+            with open(path, 'rb') as _file:
+                self.assertEqual(_file.read(), str(row['Seed']).encode())
+
+        # finished runs are skipped, new cells of the grid are run
+        shutil.rmtree(self.log_dir)
+        os.makedirs(self.log_dir)
+        self.sweep['grid']['samples'].append(30)
+        summary = run_sweep(self.sweep, self.output_dir, threads=2,
+                            run_fnc=fake_run)
+        self.assertEqual(len(summary), 12)
+        self.assertEqual(self.runs(), ['entropy_30_0', 'entropy_30_1',
+                                       'random_30_0', 'random_30_1'])
+
+    def test_failing_runs(self):
+        # the runs of one configuration fail, the others still run
+        os.environ['SWEEP_FAIL'] = 'entropy:10'
+        for threads in (1, 2):
+            summary = run_sweep(self.sweep, self.output_dir, threads=threads,
+                                run_fnc=fake_run)
+            self.assertEqual(len(summary), 8)
+            failed = summary[summary['Error'].notnull()]
+            self.assertEqual(len(failed), 2)
+            self.assertTrue((failed['objective'] == 'entropy').all())
+            self.assertTrue((failed['samples'] == 10).all())
+            self.assertIn("the run failed", failed['Error'].iloc[0])
+        self.assertEqual(len(self.runs()), 6)
+
+        # the failed runs are tried again by the next sweep
+        del os.environ['SWEEP_FAIL']
+        summary = run_sweep(self.sweep, self.output_dir, run_fnc=fake_run)
+        self.assertNotIn('Error', summary.columns)
+        self.assertEqual(len(self.runs()), 8)
+        self.assertFalse([name for name in os.listdir(self.output_dir)
+                          if name.endswith('.error.json')])
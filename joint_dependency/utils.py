@@ -66,3 +66,39 @@ def nan_helper(y):
     """
 
     return np.isnan(y), lambda z: z.nonzero()[0]
+
+
+def num_bins(resolution=1.):
+    """
+    The number of bins a full turn is divided into.
+
+    :param resolution: The size of one bin in degrees
+    :return: The number of bins (int)
+    """
+    return int(round(360. / resolution))
+
+
+def to_bins(positions, resolution=1.):
+    """
+    Map joint positions in degrees to the index of the bin they fall into.
+
+    :param positions: The joint positions in degrees (scalar or array-like)
+    :param resolution: The size of one bin in degrees
+    :return: The bin indices (int array)
+    """
+    positions = np.asarray(positions, dtype=float)
+    # the small offset keeps multiples of the resolution in their own bin
+    # despite rounding errors (e.g. 0.3 / 0.1 < 3)
+    bins = np.floor(positions / resolution + 1e-9).astype(int)
+    return np.maximum(bins, 0)
+
+
+def quantize(positions, resolution=1.):
+    """
+    Round joint positions down to the start of the bin they fall into.
+
+    :param positions: The joint positions in degrees (scalar or array-like)
+    :param resolution: The size of one bin in degrees
+    :return: The quantized positions in degrees (float array)
+    """
+    return to_bins(positions, resolution) * resolution
@@ -0,0 +1,86 @@
+"""
+Compare the action sampling modes of the experiments.
+
+For random worlds with random experiences every mode proposes its best action,
+and the wall time and the expected information gain (the value of the
+cross entropy objective) of that action are reported.
+"""
+from __future__ import division, print_function
+
+from functools import partial
+import argparse
+import time
+
+import numpy as np
+
+from joint_dependency.experiments import (
+    init, compute_p_same, build_model_prior_simple, get_best_point,
+    small_joint_state_sampling, large_joint_state_one_joint_moving_sampling,
+    exhaustive_joint_state_sampling, exp_cross_entropy)
+from joint_dependency.posterior import PosteriorCache
+from joint_dependency.simulation import create_world
+
+
+def random_experiences(world, num_experiences, rng):
+    _, experiences = init(world)
+    for joint_experiences in experiences:
+        for _ in range(num_experiences):
+            joint_experiences.append({
+                'data': rng.randint(0, 180, size=len(world.joints)),
+                'value': bool(rng.randint(2))})
+    return experiences
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-e", "--experiences", type=int, default=20,
+                        help="The number of experiences per joint")
+    parser.add_argument("-s", "--samples", type=int, default=4000,
+                        help="The number of samples of the sampling modes")
+    parser.add_argument("-f", "--furniture", type=int, default=2,
+                        help="The number of pieces of furniture per world")
+    parser.add_argument("-r", "--runs", type=int, default=5,
+                        help="The number of random worlds")
+    parser.add_argument("--resolution", type=float, default=1.)
+    args = parser.parse_args()
+
+    modes = [
+        ('small', small_joint_state_sampling, False),
+        ('large', partial(large_joint_state_one_joint_moving_sampling,
+                          resolution=args.resolution), False),
+        ('exhaustive', partial(exhaustive_joint_state_sampling,
+                               resolution=args.resolution), True)]
+    times = {name: [] for name, _, _ in modes}
+    gains = {name: [] for name, _, _ in modes}
+
+    for run in range(args.runs):
+        rng = np.random.RandomState(run)
+        np.random.seed(run)
+        world = create_world(args.furniture)
+        num_joints = len(world.joints)
+        p_cp, _ = init(world, args.resolution)
+        p_same = compute_p_same(p_cp, args.resolution)
+        alpha_prior = np.array([.1, .1])
+        model_prior = build_model_prior_simple(world, .7)
+        experiences = random_experiences(world, args.experiences, rng)
+
+        for name, sampling_fnc, exhaustive in modes:
+            cache = PosteriorCache(alpha_prior, model_prior, args.resolution)
+            start = time.time()
+            best = get_best_point(exp_cross_entropy, experiences, p_same,
+                                  alpha_prior, model_prior, args.samples,
+                                  world, [0] * num_joints, sampling_fnc,
+                                  posterior_cache=cache,
+                                  resolution=args.resolution,
+                                  exhaustive=exhaustive)
+            times[name].append(time.time() - start)
+            gains[name].append(best[3])
+
+    print("{:>12} {:>12} {:>12}".format("mode", "time [s]", "info gain"))
+    for name, _, _ in modes:
+        print("{:>12} {:>12.4f} {:>12.5f}".format(name, np.mean(times[name]),
+                                                 np.mean(gains[name])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Compare the latency of one query scored serially and by a `ScoringPool`.
+
+For a random world with random experiences the candidates of the large joint
+state are scored for every checked joint with the expected cross entropy, and
+the median wall time per query is reported for every number of workers.
+"""
+from __future__ import division, print_function
+
+import argparse
+import multiprocessing
+import time
+
+import numpy as np
+
+from joint_dependency.experiments import (
+    init, compute_p_same, build_model_prior_simple,
+    large_joint_state_one_joint_moving_sampling)
+from joint_dependency.inference import exp_cross_entropy_all_joints
+from joint_dependency.posterior import PosteriorCache
+from joint_dependency.scoring import ScoringPool
+from joint_dependency.simulation import create_world
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-e", "--experiences", type=int, default=200,
+                        help="The number of experiences per joint")
+    parser.add_argument("-s", "--samples", type=int, default=4000,
+                        help="The number of candidates per query")
+    parser.add_argument("-f", "--furniture", type=int, default=4,
+                        help="The number of pieces of furniture of the world")
+    parser.add_argument("-w", "--workers", type=int, nargs='+',
+                        default=sorted({2, multiprocessing.cpu_count()}),
+                        help="The numbers of workers to compare")
+    parser.add_argument("-q", "--queries", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    np.random.seed(0)
+    world = create_world(args.furniture)
+    num_joints = len(world.joints)
+    p_cp, experiences = init(world)
+    for joint_experiences in experiences:
+        for _ in range(args.experiences):
+            joint_experiences.append({
+                'data': rng.randint(0, 180, size=num_joints),
+                'value': bool(rng.randint(2))})
+    alpha_prior = np.array([.1, .1])
+    cache = PosteriorCache(alpha_prior,
+                           build_model_prior_simple(world, .7))
+    joint_posteriors = cache.joint_posteriors(experiences,
+                                              compute_p_same(p_cp))
+    candidates = np.array([action[1] for action in
+                           large_joint_state_one_joint_moving_sampling(
+                               args.samples, world, [0] * num_joints)])
+
+    def latency(score):
+        times = []
+        for _ in range(args.queries):
+            start = time.time()
+            score()
+            times.append(time.time() - start)
+        return np.median(times)
+
+    print("{} joints, {} candidates, {} cores".format(
+        num_joints, candidates.shape[0], multiprocessing.cpu_count()))
+    print("{:>10} {:>12}".format("workers", "time [s]"))
+    print("{:>10} {:>12.4f}".format("serial", latency(
+        lambda: exp_cross_entropy_all_joints(joint_posteriors, candidates,
+                                             alpha_prior))))
+    for workers in args.workers:
+        with ScoringPool(workers) as pool:
+            pool.score(exp_cross_entropy_all_joints, joint_posteriors,
+                       candidates[:workers], alpha_prior)
+            print("{:>10} {:>12.4f}".format(workers, latency(
+                lambda: pool.score(exp_cross_entropy_all_joints,
+                                   joint_posteriors, candidates,
+                                   alpha_prior))))
+
+
+if __name__ == '__main__':
+    main()
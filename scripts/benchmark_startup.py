@@ -0,0 +1,68 @@
+"""
+Measure the startup time of the experiments.
+
+Every command runs in a fresh interpreter, like a new shell or a pool worker,
+and the median wall time over the repetitions is reported. With --limit the
+script fails if a median exceeds the limit, to guard against slow imports
+creeping back.
+"""
+from __future__ import division, print_function
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = [
+    ('python', ['-c', 'pass']),
+    ('import experiments', ['-c', 'import joint_dependency.experiments']),
+    ('--help', [os.path.join(ROOT, 'scripts', 'joint_dep_exp.py'), '--help']),
+    ('first inference', ['-c', 'import numpy as np; '
+                               'from joint_dependency.inference import '
+                               'model_posterior; '
+                               'model_posterior([], np.ones((1, 360, 360)), '
+                               'np.array([.1, .1]), np.array([.5, .5]))']),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", "--repetitions", type=int, default=5,
+                        help="How often every command is started")
+    parser.add_argument("--limit", type=float, default=None,
+                        help="Fail if the median time of a command other "
+                             "than the first inference exceeds this many "
+                             "seconds")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [ROOT] + [p for p in [env.get('PYTHONPATH')] if p])
+
+    failed = False
+    print("{:>20} {:>12}".format("command", "time [s]"))
+    for name, command in COMMANDS:
+        times = []
+        for _ in range(args.repetitions):
+            start = time.time()
+            subprocess.check_call([sys.executable] + command, env=env,
+                                  stdout=open(os.devnull, 'w'))
+            times.append(time.time() - start)
+        median = np.median(times)
+        print("{:>20} {:>12.3f}".format(name, median))
+        if (args.limit is not None and name != 'first inference' and
+                median > args.limit):
+            failed = True
+
+    if failed:
+        print("Startup is slower than {} s".format(args.limit))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,4 @@
+from joint_dependency.sweep import sweep_main
+
+if __name__ == '__main__':
+    sweep_main()
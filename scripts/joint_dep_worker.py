@@ -0,0 +1,4 @@
+from joint_dependency.distributed import worker_main
+
+if __name__ == '__main__':
+    worker_main()
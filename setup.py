@@ -1,16 +1,29 @@
 #!/usr/bin/env python2
 
-from setuptools import setup
-from Cython.Build import cythonize
+from setuptools import setup, Extension
 import joint_dependency
-import numpy
+
+# the compiled inference backend is optional, without Cython or a compiler
+# joint_dependency.inference falls back to the NumPy backend
+try:
+    from Cython.Build import cythonize
+    import numpy
+except ImportError:
+    ext_modules = []
+else:
+    ext_modules = cythonize([
+        Extension("joint_dependency.inference_cy",
+                  ["joint_dependency/inference_cy.pyx"],
+                  include_dirs=[numpy.get_include()],
+                  extra_compile_args=['-fopenmp'],
+                  extra_link_args=['-fopenmp'],
+                  optional=True)])
 
 setup(
     name='joint_dependency',
     version=joint_dependency.__version__,
     description='Inference about the dependency structure of joints',
-    ext_modules=cythonize("joint_dependency/inference_cy.pyx"),
-    include_dirs=[numpy.get_include()],
+    ext_modules=ext_modules,
     author='Johannes Kulick',
     author_email='johannes.kulick@ipvs.uni-stuttgart.de',
     url='http://github.com/hildensia/joint_dependency',